@@ -0,0 +1,22 @@
+# The library API lives in minimize_ninja.api. It is imported on first access,
+# so that importing the CLI does not pay for it.
+API = [
+    "DeckFinished",
+    "ImageDone",
+    "ImagesPruned",
+    "SlimOptions",
+    "StageFinished",
+    "StageStarted",
+    "aslim",
+    "create_resources",
+    "slim",
+    "slim_keynote",
+]
+
+
+def __getattr__(name):
+    if name in API:
+        from minimize_ninja import api
+
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
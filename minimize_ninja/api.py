@@ -0,0 +1,215 @@
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from minimize_ninja.backends import check_backends
+from minimize_ninja.cache import ResultCache
+from minimize_ninja.common import Tracer, read_config
+from minimize_ninja.events import (
+    DeckFinished,
+    ImageDone,
+    ImagesPruned,
+    StageFinished,
+    StageStarted,
+)
+from minimize_ninja.jpeg import create_jpeg_encoder
+from minimize_ninja.pipeline import (
+    QUALITY_LEVELS,
+    MemoryBudget,
+    default_jobs,
+    slim_deck_events,
+)
+from minimize_ninja.png import PngOptimizer
+
+# The event classes are part of the API, so that callers need only this module.
+__all__ = [
+    "DeckFinished",
+    "ImageDone",
+    "ImagesPruned",
+    "SlimOptions",
+    "StageFinished",
+    "StageStarted",
+    "aslim",
+    "create_resources",
+    "slim",
+    "slim_keynote",
+]
+
+# Everything `mn slim` can be told, with the same defaults. `quality` 1–3
+# overrides resize_factor, jpeg_compression and png_convert.
+SlimOptions = namedtuple(
+    "SlimOptions",
+    [
+        "quality",
+        "resize_factor",
+        "jpeg_compression",
+        "png_convert",
+        "target_ssim",
+        "dedup",
+        "prune",
+        "crop",
+        "jpeg_encoder",
+        "png_time_budget",
+        "png_deck_budget",
+        "png_min_gain",
+        "jobs",
+        "max_memory",
+        "no_cache",
+        "cache_dir",
+        "cache_size",
+        "native",
+        "streaming",
+        "force",
+        "keep_unpacked",
+        "trace",
+    ],
+    defaults=[
+        0,
+        2.0,
+        85,
+        False,
+        None,
+        True,
+        False,
+        False,
+        "auto",
+        None,
+        None,
+        0.5,
+        None,
+        None,
+        False,
+        None,
+        1024,
+        False,
+        False,
+        False,
+        False,
+        False,
+    ],
+)
+
+
+def deck_settings(options):
+    resize_factor = options.resize_factor
+    jpeg_compression = options.jpeg_compression
+    png_convert = options.png_convert
+    if options.quality in QUALITY_LEVELS:
+        resize_factor, jpeg_compression, png_convert = QUALITY_LEVELS[options.quality]
+    return dict(
+        dedup=options.dedup,
+        keep_unpacked=options.keep_unpacked,
+        png_convert=png_convert,
+        resize_factor=resize_factor,
+        jpeg_compression=jpeg_compression,
+        target_ssim=options.target_ssim,
+        prune=options.prune,
+        crop=options.crop,
+    )
+
+
+def configure_memory(resources, max_memory):
+    if max_memory is not None:
+        from minimize_ninja.keynote import configure_memory_limits
+
+        configure_memory_limits(max_memory * 1024 * 1024)
+        resources["memory_budget"] = MemoryBudget(max_memory * 1024 * 1024)
+
+
+def configure_cache(resources, no_cache, cache_dir, cache_size):
+    if not no_cache:
+        resources["cache"] = ResultCache(
+            resources, path=cache_dir, max_size=cache_size * 1024 * 1024
+        )
+
+
+def create_resources(options=None):
+    # The shared services of a run. Pass the result to several slim() calls
+    # to share the cache, the encoders and the memory budget between decks.
+    if options is None:
+        options = SlimOptions()
+    resources = read_config()
+    check_backends(
+        resources,
+        required=["image", "png"],
+        optional=["jpeg", "jpeg-command", "pdf", "pdf-command", "export"],
+    )
+    configure_cache(resources, options.no_cache, options.cache_dir, options.cache_size)
+    configure_memory(resources, options.max_memory)
+    if options.trace:
+        resources["tracer"] = Tracer()
+    resources["jpeg_encoder"] = create_jpeg_encoder(resources, options.jpeg_encoder)
+    resources["png_optimizer"] = PngOptimizer(
+        resources,
+        image_budget=options.png_time_budget,
+        deck_budget=options.png_deck_budget,
+        min_gain=options.png_min_gain / 100.0,
+    )
+    return resources
+
+
+def deck_resources(resources):
+    # The resources of a single deck: the shared services of the run, but
+    # an Oxipng deck budget of its own.
+    resources = dict(resources)
+    if "png_optimizer" in resources:
+        resources["png_optimizer"] = resources["png_optimizer"].for_deck()
+    return resources
+
+
+def slim_keynote(kf, options=None, executor=None):
+    # Slims an existing KeynoteFile and yields the events of
+    # minimize_ninja.events, ending with DeckFinished. Without an executor,
+    # one with `options.jobs` workers is used for this deck alone.
+    if options is None:
+        options = SlimOptions()
+    if executor is not None:
+        yield from slim_deck_events(kf, executor, **deck_settings(options))
+        return
+    with ThreadPoolExecutor(max_workers=options.jobs or default_jobs()) as executor:
+        yield from slim_deck_events(kf, executor, **deck_settings(options))
+
+
+def slim(path, options=None, resources=None, executor=None, path_repacked=None):
+    # Slims the Keynote file at `path` into `path_repacked` (default:
+    # <name>_tiffy.key in the working directory) and yields its progress
+    # events. Stop iterating and close the generator to cancel.
+    from minimize_ninja.keynote import KeynoteFile
+
+    if options is None:
+        options = SlimOptions()
+    if resources is None:
+        resources = create_resources(options)
+    kf = KeynoteFile(
+        deck_resources(resources),
+        path_keynote=Path(path),
+        native=options.native,
+        streaming=options.streaming,
+        path_repacked=Path(path_repacked) if path_repacked is not None else None,
+        reuse_manifest=not options.force,
+    )
+    yield from slim_keynote(kf, options, executor)
+
+
+async def aslim(path, options=None, resources=None, executor=None, path_repacked=None):
+    # slim() for asyncio: the work up to each event runs in a thread, so the
+    # event loop stays responsive. Cancelling the task cancels the deck once
+    # the step in flight is done.
+    events = slim(path, options, resources, executor, path_repacked)
+    # One thread steps the generator, so closing it waits for the step in
+    # flight instead of running into it.
+    stepper = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            event = await asyncio.wrap_future(stepper.submit(next, events, None))
+            if event is None:
+                return
+            yield event
+    finally:
+        try:
+            # Closing runs the cleanup of the deck, which must not block the
+            # loop; shielded so a second cancellation does not cut it short.
+            await asyncio.shield(asyncio.wrap_future(stepper.submit(events.close)))
+        finally:
+            stepper.shutdown(wait=False)
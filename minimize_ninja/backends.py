@@ -0,0 +1,258 @@
+import importlib
+import shutil
+import sys
+import threading
+from importlib.metadata import entry_points
+from importlib.util import find_spec
+
+# Third-party packages register backends under this entry point group. Each
+# entry point refers to a Backend instance, e.g.
+#   [project.entry-points."minimize_ninja.backends"]
+#   zopflipng = "my_package.backends:zopflipng"
+ENTRY_POINT_GROUP = "minimize_ninja.backends"
+
+# What a backend of each kind has to provide. Python backends expose the
+# module interface, command backends the command line.
+BACKEND_KINDS = {
+    "image": "Wand's wand.image, which is checked but not replaceable",
+    "png": "module with optimize_from_memory(data, level, fast_evaluation, timeout)",
+    "jpeg": "module with optimize(jpeg_bytes) for lossless JPEG optimization",
+    "jpeg-command": "command reading PPM/PGM from stdin with -quality Q",
+    "pdf": "pikepdf, used in-process by minimize_ninja.pdf",
+    "pdf-command": "command taking an input and an output PDF path",
+    "export": "module with run(applescript)",
+}
+
+
+class BackendError(Exception):
+    pass
+
+
+class Backend(object):
+    # An encoder, optimizer or exporter. Python backends are found without
+    # importing them and only imported on first use, command backends are
+    # looked up on the PATH; a Python backend driving a command needs both.
+    # Modules that can be found but still fail to import, like bindings to a
+    # missing shared library, are imported to check them (`verify_import`).
+    # Among the available backends of a kind the one with the highest
+    # priority is used.
+    def __init__(
+        self,
+        name,
+        kind,
+        module=None,
+        command=None,
+        priority=0,
+        hint=None,
+        verify_import=False,
+    ):
+        self._name = name
+        self._kind = kind
+        self._module = module
+        self._command = command
+        self._priority = priority
+        self._hint = hint
+        self._verify_import = verify_import
+        self._loaded = None
+        self._import_error = None
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"Backend({self._name}, {self._kind})"
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @property
+    def hint(self):
+        return self._hint
+
+    @property
+    def available(self):
+        if self._command is not None and shutil.which(self._command) is None:
+            return False
+        if self._module is None:
+            return True
+        if self._verify_import:
+            return self._try_import()
+        # Only the top-level package is looked up, which does not import it.
+        package = self._module.split(".")[0]
+        try:
+            return find_spec(package) is not None
+        except ValueError:
+            # Imported already, but without a spec, e.g. created at runtime.
+            return package in sys.modules
+
+    def _try_import(self):
+        # Imports the module once and keeps the error if that fails.
+        with self._lock:
+            if self._loaded is None and self._import_error is None:
+                try:
+                    self._loaded = importlib.import_module(self._module)
+                except ImportError as exc:
+                    self._import_error = exc
+            return self._loaded is not None
+
+    def load(self):
+        # The imported module, or the full path of the command.
+        with self._lock:
+            if self._loaded is None:
+                if not self.available:
+                    raise BackendError(self.missing_message)
+                if self._module is None:
+                    self._loaded = shutil.which(self._command)
+                else:
+                    try:
+                        self._loaded = importlib.import_module(self._module)
+                    except ImportError as exc:
+                        raise BackendError(f"{self.missing_message} ({exc})")
+            return self._loaded
+
+    @property
+    def missing_message(self):
+        message = f"The {self._kind} backend {self._name} is not available."
+        if self._hint is not None:
+            message += f" {self._hint}"
+        if self._import_error is not None:
+            message += f" ({self._import_error})"
+        return message
+
+
+BUILTIN_BACKENDS = [
+    Backend(
+        "wand",
+        "image",
+        module="wand.image",
+        hint="Install ImageMagick and `pip install wand`.",
+        verify_import=True,
+    ),
+    Backend("oxipng", "png", module="oxipng", hint="Run `pip install pyoxipng`."),
+    Backend(
+        "mozjpeg",
+        "jpeg",
+        module="mozjpeg_lossless_optimization",
+        hint="Run `pip install minimize-ninja[mozjpeg]`.",
+    ),
+    Backend(
+        "cjpeg",
+        "jpeg-command",
+        command="cjpeg",
+        hint="Install MozJPEG and put its cjpeg on the PATH.",
+    ),
+    Backend(
+        "pikepdf",
+        "pdf",
+        module="pikepdf",
+        hint="Run `pip install minimize-ninja[pdf]`.",
+    ),
+    Backend(
+        "pdfsizeopt",
+        "pdf-command",
+        command="pdfsizeopt",
+        hint="Install pdfsizeopt and put it on the PATH.",
+    ),
+    Backend(
+        "applescript",
+        "export",
+        module="applescript",
+        command="osascript",
+        hint="PDF export needs macOS with Keynote and `pip install applescript`.",
+    ),
+]
+
+_registry = {}
+_registry_lock = threading.RLock()
+_discovered = False
+
+
+def register_backend(backend):
+    if backend.kind not in BACKEND_KINDS:
+        raise BackendError(f"Unknown backend kind {backend.kind}.")
+    with _registry_lock:
+        _registry[backend.name] = backend
+    return backend
+
+
+def _discover():
+    # Built-in backends first, so third-party ones of the same name win.
+    global _discovered
+    with _registry_lock:
+        if _discovered:
+            return
+        _discovered = True
+        for backend in BUILTIN_BACKENDS:
+            _registry.setdefault(backend.name, backend)
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            try:
+                register_backend(entry_point.load())
+            except Exception as exc:
+                raise BackendError(
+                    f"Unable to load backend {entry_point.name} from "
+                    f"{entry_point.value}: {exc}"
+                )
+
+
+def registered_backends(kind=None):
+    _discover()
+    with _registry_lock:
+        backends = list(_registry.values())
+    backends = [backend for backend in backends if kind in (None, backend.kind)]
+    return sorted(backends, key=lambda backend: -backend.priority)
+
+
+def get_backend(kind, name=None):
+    # The named backend, or the available one of the kind with the highest
+    # priority. Neither is imported yet.
+    backends = registered_backends(kind)
+    if name is not None:
+        backends = [backend for backend in backends if backend.name == name]
+        if not backends:
+            raise BackendError(f"Unknown {kind} backend {name}.")
+        return backends[0]
+    for backend in backends:
+        if backend.available:
+            return backend
+    if backends:
+        raise BackendError(backends[0].missing_message)
+    raise BackendError(f"No {kind} backend registered.")
+
+
+def has_backend(kind):
+    return any(backend.available for backend in registered_backends(kind))
+
+
+def load_backend(kind, name=None):
+    return get_backend(kind, name).load()
+
+
+def check_backends(resources, required=(), optional=()):
+    # Capability check at startup: fails early if a required kind has no
+    # available backend and tells which optional features are off. Backends
+    # with `verify_import` are imported here already.
+    logger = resources["logger"]
+    for kind in optional:
+        if not has_backend(kind):
+            logger.debug(
+                f"No {kind} backend available: "
+                + " ".join(
+                    backend.missing_message for backend in registered_backends(kind)
+                )
+            )
+    missing = [kind for kind in required if not has_backend(kind)]
+    if missing:
+        raise BackendError(
+            " ".join(
+                backend.missing_message
+                for kind in missing
+                for backend in registered_backends(kind)[:1]
+            )
+        )
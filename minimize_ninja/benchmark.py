@@ -0,0 +1,262 @@
+import json
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+from wand.image import Image
+
+from minimize_ninja.keynote import KeynoteFile, convert_package
+from minimize_ninja.pipeline import default_jobs, image_settings, slim_deck
+
+# Synthetic images per format: photo-like plasma noise compresses like
+# photographs, gradients compress like flat graphics and screenshots.
+PSEUDO_IMAGES = ["plasma:", "gradient:white-steelblue"]
+
+
+def generate_deck(path, tiffs=4, pngs=4, jpegs=4, width=3000, height=2000):
+    # Creates an unpacked deck in the layout KeynoteFile(path_unpacked=...)
+    # expects, which convert_package() can also pack. Every image is placed
+    # on its own slide at a third of its height, so the resize stage has
+    # something to do.
+    path = Path(path)
+    if path.exists():
+        shutil.rmtree(path)
+    (path / "Index").mkdir(parents=True)
+    (path / "Data").mkdir()
+
+    datas = []
+    slide_objects = []
+    formats = ["tiff"] * tiffs + ["png"] * pngs + ["jpg"] * jpegs
+    for number, format in enumerate(formats):
+        identifier = 1000 + number
+        filename = f"image-{number}.{format}"
+        pseudo = PSEUDO_IMAGES[number % len(PSEUDO_IMAGES)]
+        with Image(width=width, height=height, pseudo=pseudo) as image:
+            image.format = format
+            if format == "tiff":
+                image.compression = "no"
+            image.save(filename=str(path / "Data" / f"{filename}"))
+        datas.append(
+            {
+                "identifier": identifier,
+                # Keynote checks digests, MinimizeNinja does not.
+                "digest": "AAAA",
+                "fileName": filename,
+                "preferredFileName": filename,
+            }
+        )
+        slide_objects.append(
+            {
+                "_pbtype": "TSD.ImageArchive",
+                "data": {"identifier": identifier},
+                "originalSize": {"width": width / 3.0, "height": height / 3.0},
+                "super": {},
+            }
+        )
+
+    metadata = {
+        "_pbtype": "TSP.PackageMetadata",
+        "lastObjectIdentifier": str(1000 + 2 * len(formats)),
+        "revision": {"identifier": "1"},
+        "datas": datas,
+    }
+    types = message_types()
+    write_archive(path / "Index" / "Metadata.iwa.yaml", {1: metadata}, types)
+    # Slide archives are numbered after the images, so no identifier is used
+    # twice.
+    for number, obj in enumerate(slide_objects):
+        identifier = 1000 + len(formats) + number
+        write_archive(
+            path / "Index" / f"Slide-{number}.iwa.yaml", {identifier: obj}, types
+        )
+    return path
+
+
+def message_types():
+    # Message name -> type number in the archive headers of keynote_parser.
+    from keynote_parser.codec import import_version
+
+    return {
+        message.DESCRIPTOR.full_name: number
+        for number, message in import_version()[0].items()
+    }
+
+
+def write_archive(path, objects, types):
+    # One archive per {identifier: object}, with the header keynote_parser
+    # needs to encode it again.
+    archives = [
+        {
+            "header": {
+                "_pbtype": "TSP.ArchiveInfo",
+                "identifier": str(identifier),
+                "messageInfos": [
+                    {
+                        "_pbtype": "TSP.MessageInfo",
+                        "type": types[obj["_pbtype"]],
+                        "version": [1, 0, 5],
+                    }
+                ],
+            },
+            "objects": [obj],
+        }
+        for identifier, obj in objects.items()
+    ]
+    with open(path, "w") as file:
+        yaml.dump({"chunks": [{"archives": archives}]}, file)
+
+
+def measure(name, images, function, sizes_in, sizes_out):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    function()
+    seconds = time.perf_counter() - start_wall
+    bytes_in = sum(sizes_in())
+    bytes_out = sum(sizes_out())
+    return {
+        "stage": name,
+        "images": len(images),
+        "seconds": seconds,
+        "cpu_seconds": time.process_time() - start_cpu,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "images_per_second": len(images) / seconds if seconds else 0.0,
+        "mb_per_second": bytes_in / seconds / 1e6 if seconds else 0.0,
+        "bytes_saved": bytes_in - bytes_out,
+    }
+
+
+def run_benchmark(
+    resources,
+    path_deck,
+    jobs=1,
+    png_convert=False,
+    resize_factor=2.0,
+    jpeg_compression=85,
+):
+    results = []
+    settings = dict(
+        png_convert=png_convert,
+        resize_factor=resize_factor,
+        jpeg_compression=jpeg_compression,
+    )
+
+    # Stage by stage, as separate passes over all images.
+    path_work = copy_deck(path_deck)
+    kf = KeynoteFile(resources, path_unpacked=path_work)
+    images = list(kf.images_dict.values())
+    results.append(
+        measure(
+            "references",
+            images,
+            kf.link_references,
+            lambda: [0],
+            lambda: [0],
+        )
+    )
+
+    def convert():
+        for image in images:
+            if not image_settings(image, **settings)["convert"]:
+                continue
+            if "tif" in image.filename.suffix:
+                image.convert()
+            else:
+                image.convert(jpeg_compression=jpeg_compression)
+
+    def resize():
+        for image in images:
+            image.resize(max_ratio_factor=resize_factor)
+
+    def optimize():
+        for image in images:
+            image.optimize(jpeg_compression=jpeg_compression)
+
+    results.append(
+        measure(
+            "convert",
+            images,
+            convert,
+            lambda: [image.size_original for image in images],
+            lambda: [image.size_converted for image in images],
+        )
+    )
+    results.append(
+        measure(
+            "resize",
+            images,
+            resize,
+            lambda: [image.size_converted for image in images],
+            lambda: [image.size_resized for image in images],
+        )
+    )
+    results.append(
+        measure(
+            "optimize",
+            images,
+            optimize,
+            lambda: [image.size_resized for image in images],
+            lambda: [image.size_optimized for image in images],
+        )
+    )
+    shutil.rmtree(path_work)
+
+    # The fused pipeline as used by `mn slim`, from unpacking a packed copy
+    # of the deck to repacking it. Duplicates are kept like in the passes.
+    path_keynote = path_deck.with_name(path_deck.name + ".key")
+    convert_package(path_deck, path_keynote)
+    kf = KeynoteFile(
+        resources,
+        path_keynote=path_keynote,
+        streaming=True,
+        path_repacked=path_deck.with_name(path_deck.name + "_tiffy.key"),
+    )
+    with ThreadPoolExecutor(max_workers=jobs or default_jobs()) as executor:
+        results.append(
+            measure(
+                "pipeline",
+                images,
+                lambda: slim_deck(kf, executor, dedup=False, **settings),
+                lambda: [image.size_original for image in kf.images_dict.values()],
+                lambda: [image.size_optimized for image in kf.images_dict.values()],
+            )
+        )
+    path_keynote.unlink()
+    kf.path_repacked.unlink()
+    return results
+
+
+def check_predictions(resources, path_deck, png_convert=False):
+    # How often the format predicted from tiles matches the winner of full
+    # encodes, for all images the pipeline would convert.
+    kf = KeynoteFile(resources, path_unpacked=path_deck)
+    result = dict(images=0, predicted=0, matched=0)
+    for image in kf.images_dict.values():
+        if not image_settings(image, png_convert=png_convert)["convert"]:
+            continue
+        predicted, actual = image.check_format_prediction()
+        result["images"] += 1
+        if predicted is not None:
+            result["predicted"] += 1
+            result["matched"] += predicted == actual
+    return result
+
+
+def copy_deck(path_deck):
+    path_work = path_deck.with_name(path_deck.name + "-work")
+    if path_work.exists():
+        shutil.rmtree(path_work)
+    shutil.copytree(path_deck, path_work)
+    return path_work
+
+
+def load_baseline(path):
+    with open(path, "r") as file:
+        return {result["stage"]: result for result in json.load(file)}
+
+
+def save_baseline(path, results):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
@@ -0,0 +1,152 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+# Eviction starts once the cache outgrows its maximum size and removes
+# entries until it is down to this fraction of it, so it runs only every
+# so often instead of on every write.
+EVICT_TO = 0.9
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if cache_home:
+        return Path(cache_home) / "minimize-ninja"
+    return Path.home() / ".cache" / "minimize-ninja"
+
+
+class ResultCache(object):
+    # Content-addressed store for optimized images. Every entry consists of
+    # `<key>.bin` (the final bytes) and `<key>.json` (format and sizes). The
+    # modification time of the `.bin` file serves as last-access time for the
+    # LRU eviction. Entries are written via temporary files and os.replace(),
+    # so concurrent `mn` processes never see partial entries; eviction runs
+    # under an exclusive flock on `lock`. The size of the cache is counted
+    # once and then kept up to date by every put(); entries written by other
+    # processes are counted again by the next eviction.
+
+    def __init__(self, resources, path=None, max_size=1024 * 1024 * 1024):
+        self._logger = resources["logger"]
+        self._path = Path(path) if path is not None else default_cache_dir()
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._size = None
+        self._hits = 0
+        self._misses = 0
+        self._counter_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"ResultCache({self._path})"
+
+    @staticmethod
+    def make_key(source, settings):
+        digest = hashlib.sha256(source)
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry_paths(self, key):
+        directory = self._path / key[0:2]
+        return directory / f"{key}.bin", directory / f"{key}.json"
+
+    def get(self, key):
+        path_blob, path_info = self._entry_paths(key)
+        try:
+            with open(path_info, "r") as file:
+                info = json.load(file)
+            blob = path_blob.read_bytes()
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._count(hit=False)
+            return None
+        if len(blob) != info.get("size"):
+            self._count(hit=False)
+            return None
+        try:
+            os.utime(path_blob)
+        except FileNotFoundError:
+            pass
+        self._count(hit=True)
+        return blob, info
+
+    def put(self, key, blob, info):
+        path_blob, path_info = self._entry_paths(key)
+        path_blob.parent.mkdir(exist_ok=True)
+        info = dict(info, size=len(blob))
+        suffix = f".{uuid.uuid4().hex[0:8]}.tmp"
+        path_tmp_blob = path_blob.with_name(path_blob.name + suffix)
+        path_tmp_info = path_info.with_name(path_info.name + suffix)
+        with open(path_tmp_blob, "wb") as file:
+            file.write(blob)
+        with open(path_tmp_info, "w") as file:
+            json.dump(info, file)
+        os.replace(path_tmp_blob, path_blob)
+        os.replace(path_tmp_info, path_info)
+        with self._counter_lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(blob)
+            full = self._size > self._max_size
+        if full:
+            self.evict()
+
+    def _entries(self):
+        # (last access, size, path) of the `.bin` file of every entry.
+        entries = []
+        for path_blob in self._path.glob("*/*.bin"):
+            try:
+                stat = path_blob.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path_blob))
+        return entries
+
+    def evict(self):
+        with self._locked():
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path_blob in entries:
+                if total <= self._max_size * EVICT_TO:
+                    break
+                self._logger.debug(f"Evicting {path_blob.stem} from {self}…")
+                for path in [path_blob, path_blob.with_suffix(".json")]:
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                total -= size
+        with self._counter_lock:
+            self._size = total
+
+    @contextmanager
+    def _locked(self):
+        with open(self._path / "lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _count(self, hit):
+        with self._counter_lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
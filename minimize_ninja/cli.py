@@ -1,17 +1,56 @@
-import shutil
-import uuid
+import glob
 from pathlib import Path
 
-import applescript
 import click
 import humanize
-from keynote_parser.file_utils import process
 from rich.console import Console
 from rich.panel import Panel
+from rich.table import Table
 from tqdm import tqdm
 
-from minimize_ninja.common import configure_logger, get_logger, read_config
-from minimize_ninja.keynote import KeynoteFile, TiffyYaml
+from minimize_ninja.api import (
+    SlimOptions,
+    configure_cache,
+    configure_memory,
+    create_resources,
+    deck_resources,
+    deck_settings,
+    slim_keynote,
+)
+from minimize_ninja.backends import (
+    BACKEND_KINDS,
+    BackendError,
+    check_backends,
+    get_backend,
+    load_backend,
+    registered_backends,
+)
+from minimize_ninja.common import (
+    configure_logger,
+    get_logger,
+    peak_rss,
+    read_config,
+)
+from minimize_ninja.events import (
+    DeckFinished,
+    ImageDone,
+    ImagesPruned,
+    StageFinished,
+    StageStarted,
+)
+from minimize_ninja.jpeg import JPEG_ENCODERS, create_jpeg_encoder
+from minimize_ninja.pipeline import (
+    ANALYSIS_LEVELS,
+    QUALITY_LEVELS,
+    analyze_deck,
+    default_jobs,
+    slim_decks,
+)
+from minimize_ninja.png import PngOptimizer
+
+# The modules doing the actual work (and through them Wand, keynote_parser
+# and the optimizer backends) are only imported by the commands that need
+# them, which keeps `mn --help` fast.
 
 
 @click.group(help=f"MinimizeNinja version 0.0.2")
@@ -23,94 +62,200 @@ def cli(verbosity, log_file):
     pass
 
 
-@click.command(help="Get a Keynote file into shape by losing " "unnecessary weight")
-@click.option(
-    "-q",
-    "--quality",
-    "quality",
-    default=0,
-    type=int,
-    show_default=True,
-    help="Control the quality of the resulting Keynote file. The "
-    "level [0–3] controls quality vs. size with 0 resulting "
-    "in the highest quality/largest size and 3 in lowest "
-    "quality/smallest size. Zero is the default and best "
-    "setting to retain a reasonable quality to store "
-    "your Keynote files. Levels 1–3 are targeted for creating "
-    "reasonably-sized PDF exports. DO NOT USE LEVELS 1–3 TO "
-    "OPTIMIZE YOUR KEYNOTE FILE PERMANENTLY AS IMAGES WILL BE "
-    "DEGRADED IN QUALITY!",
-)
-@click.option(
-    "-p",
-    "--export-pdf",
-    "export_pdf",
-    help="Export Keynote presentation to PDF after optimizing",
-    is_flag=True,
-)
-@click.option(
-    "--keep-unpacked",
-    "keep_unpacked",
-    help="Do not delete unpacked Keynote data",
-    is_flag=True,
-)
-@click.option(
-    "--resize-factor",
-    "resize_factor",
-    default=2.0,
-    show_default=True,
-    help="Resizing factor to keep acceptable resolution for images",
-)
-@click.option(
-    "--jpeg-compression",
-    "jpeg_compression",
-    default=85,
-    show_default=True,
-    help="JPEG quality setting for compression (0–100, default: 85)",
-)
-@click.option(
-    "--png-convert",
-    "png_convert",
-    is_flag=True,
-    help="Try to convert PNG files to JPEG to save additional space",
-)
-@click.argument("keynote_file", type=click.Path(exists=True))
-def slim(
-    quality,
-    keynote_file,
-    export_pdf,
-    keep_unpacked,
-    resize_factor,
-    jpeg_compression,
-    png_convert,
-):
-    resources = read_config()
-    logger = get_logger()
-    console = resources["console"]
-    path_packed = Path(keynote_file)
+SLIMMING_OPTIONS = [
+    click.option(
+        "-q",
+        "--quality",
+        "quality",
+        default=0,
+        type=int,
+        show_default=True,
+        help="Control the quality of the resulting Keynote file. The "
+        "level [0–3] controls quality vs. size with 0 resulting "
+        "in the highest quality/largest size and 3 in lowest "
+        "quality/smallest size. Zero is the default and best "
+        "setting to retain a reasonable quality to store "
+        "your Keynote files. Levels 1–3 are targeted for creating "
+        "reasonably-sized PDF exports. DO NOT USE LEVELS 1–3 TO "
+        "OPTIMIZE YOUR KEYNOTE FILE PERMANENTLY AS IMAGES WILL BE "
+        "DEGRADED IN QUALITY!",
+    ),
+    click.option(
+        "--keep-unpacked",
+        "keep_unpacked",
+        help="Do not delete unpacked Keynote data",
+        is_flag=True,
+    ),
+    click.option(
+        "--resize-factor",
+        "resize_factor",
+        default=2.0,
+        show_default=True,
+        help="Resizing factor to keep acceptable resolution for images",
+    ),
+    click.option(
+        "--jpeg-compression",
+        "jpeg_compression",
+        default=85,
+        show_default=True,
+        help="JPEG quality setting for compression (0–100, default: 85)",
+    ),
+    click.option(
+        "--png-convert",
+        "png_convert",
+        is_flag=True,
+        help="Try to convert PNG files to JPEG to save additional space",
+    ),
+    click.option(
+        "--target-ssim",
+        "target_ssim",
+        default=None,
+        type=click.FloatRange(min=0.0, max=1.0, min_open=True),
+        help="Pick the lowest JPEG quality per image that keeps this structural "
+        "similarity (SSIM) to the source instead of a fixed "
+        "--jpeg-compression, e.g. 0.98",
+    ),
+    click.option(
+        "--jpeg-encoder",
+        "jpeg_encoder",
+        default="auto",
+        show_default=True,
+        type=click.Choice(JPEG_ENCODERS),
+        help="Encode JPEGs in-process with MozJPEG optimization (needs "
+        "mozjpeg-lossless-optimization) or via the cjpeg command; auto "
+        "prefers in-process",
+    ),
+    click.option(
+        "--png-time-budget",
+        "png_time_budget",
+        default=None,
+        type=click.FloatRange(min=0.0, min_open=True),
+        help="Seconds of Oxipng optimization per PNG. Levels are raised step "
+        "by step while the next one fits into the budget",
+    ),
+    click.option(
+        "--png-deck-budget",
+        "png_deck_budget",
+        default=None,
+        type=click.FloatRange(min=0.0, min_open=True),
+        help="Seconds of Oxipng optimization for all PNGs of a Keynote file",
+    ),
+    click.option(
+        "--png-min-gain",
+        "png_min_gain",
+        default=0.5,
+        show_default=True,
+        type=click.FloatRange(min=0.0),
+        help="Stop raising the Oxipng level once a level saves less than this "
+        "percentage (only with a time budget)",
+    ),
+    click.option(
+        "-j",
+        "--jobs",
+        "jobs",
+        default=default_jobs(),
+        show_default=True,
+        type=click.IntRange(min=1),
+        help="Number of images to process in parallel",
+    ),
+    click.option(
+        "--max-memory",
+        "max_memory",
+        default=None,
+        type=click.IntRange(min=1),
+        help="Memory budget in MB for image processing. Limits ImageMagick "
+        "and the number of large images processed at the same time",
+    ),
+    click.option(
+        "--no-cache",
+        "no_cache",
+        is_flag=True,
+        help="Do not use or fill the cache of previously optimized images",
+    ),
+    click.option(
+        "--cache-dir",
+        "cache_dir",
+        type=click.Path(file_okay=False),
+        default=None,
+        help="Directory of the image cache (default: ~/.cache/minimize-ninja)",
+    ),
+    click.option(
+        "--cache-size",
+        "cache_size",
+        default=1024,
+        show_default=True,
+        type=click.IntRange(min=0),
+        help="Maximum size of the image cache in MB",
+    ),
+    click.option(
+        "--dedup/--no-dedup",
+        "dedup",
+        default=True,
+        show_default=True,
+        help="Process byte-identical images only once and merge them where possible",
+    ),
+    click.option(
+        "--prune",
+        "prune",
+        is_flag=True,
+        help="Remove images that nothing in the Keynote file refers to anymore, "
+        "e.g. leftovers of deleted slides",
+    ),
+    click.option(
+        "--crop",
+        "crop",
+        is_flag=True,
+        help="Crop images to the part their masks and the slide edges leave "
+        "visible and adapt their frames accordingly",
+    ),
+    click.option(
+        "--native",
+        "native",
+        is_flag=True,
+        help="Work on the binary IWA archives directly instead of converting "
+        "the whole package to YAML and back",
+    ),
+    click.option(
+        "--streaming",
+        "streaming",
+        is_flag=True,
+        help="Read images straight from the Keynote file and copy unchanged "
+        "files into the result without unpacking them (implies --native)",
+    ),
+    click.option(
+        "--force",
+        "force",
+        is_flag=True,
+        help="Process all images, even those an earlier run recorded as "
+        "slimmed with the same settings",
+    ),
+    click.option(
+        "--trace",
+        "trace",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="Write a Chrome trace of all stages and images to this file "
+        "(open in chrome://tracing or Perfetto)",
+    ),
+    click.option(
+        "--report",
+        "report",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="Write a JSON report with time and bytes per stage and image",
+    ),
+]
+
+
+def slimming_options(function):
+    for option in reversed(SLIMMING_OPTIONS):
+        function = option(function)
+    return function
 
-    kf = KeynoteFile(resources, path_keynote=path_packed)
-
-    match quality:
-        case 0:
-            # Nothing to do, use standard settings defined above.
-            pass
-        case 1:
-            resize_factor = 2.0
-            jpeg_compression = 80
-            png_convert = True
-            export_pdf = True
-        case 2:
-            resize_factor = 1.5
-            jpeg_compression = 75
-            png_convert = True
-            export_pdf = True
-        case 3:
-            resize_factor = 1.0
-            jpeg_compression = 70
-            png_convert = True
-            export_pdf = True
 
+def warn_about_quality(resources, resize_factor, jpeg_compression):
+    logger = resources["logger"]
+    console = resources["console"]
     if resize_factor < 2.0:
         console.print()
         logger.warning(
@@ -133,22 +278,64 @@ def slim(
         )
         console.print()
 
-    kf.unpack()
-    console.print()
 
-    metadata = kf.metadata
+def check_slimming_backends(resources):
+    try:
+        check_backends(
+            resources,
+            required=["image", "png"],
+            optional=["jpeg", "jpeg-command", "pdf", "pdf-command", "export"],
+        )
+    except BackendError as exc:
+        resources["logger"].error(str(exc))
+        raise SystemExit(1)
 
-    logger.debug(f"Searching images in Metadata.iwa.yaml…")
-    images_dict = kf.images_dict
-    logger.debug(f"…done! Found {len(images_dict.keys())} image files.")
 
-    tiffies = [
-        image for id, image in images_dict.items() if "tif" in image.filename.suffix
-    ]
-    pngs = [
-        image for id, image in images_dict.items() if "png" in image.filename.suffix
+def create_slimming_resources(options):
+    try:
+        return create_resources(options)
+    except BackendError as exc:
+        get_logger().error(str(exc))
+        raise SystemExit(1)
+
+
+def write_tracing(resources, trace, report):
+    logger = resources["logger"]
+    tracer = resources.get("tracer")
+    if tracer is None:
+        return
+    if trace is not None:
+        tracer.write_trace(trace)
+        logger.info(f"Wrote trace to {trace}.")
+    if report is not None:
+        tracer.write_report(report)
+        logger.info(f"Wrote report to {report}.")
+
+
+def log_png_stats(resources):
+    logger = resources["logger"]
+    for level, entry in resources["png_optimizer"].stats.levels.items():
+        logger.info(
+            f"Oxipng level {level}: {entry['runs']} run(s) in "
+            f"{entry['seconds']:.1f} s saved {humanize.naturalsize(entry['saved'])}."
+        )
+
+
+def all_images(kf):
+    # The processed images plus the duplicates that received a copy.
+    return list(kf.images_dict.values()) + [
+        duplicate for image in kf.images_dict.values() for duplicate in image.duplicates
     ]
 
+
+def log_found_images(resources, kf, png_convert):
+    logger = resources["logger"]
+    console = resources["console"]
+    images_dict = kf.images_dict
+    images = all_images(kf)
+    tiffies = [image for image in images if "tif" in image.filename.suffix]
+    pngs = [image for image in images if "png" in image.filename.suffix]
+
     if tiffies:
         logger.info(
             f"Found {len(tiffies)} TIFF files 🙄. Did someone have"
@@ -156,11 +343,47 @@ def slim(
         )
         tiff_file_names = [tiff.filename.name for tiff in tiffies]
         logger.debug(f'List of TIFF files: {", ".join(tiff_file_names)}')
+    else:
+        logger.info(f"No TIFF files in {str(kf.path_keynote)}.")
+
+    if pngs and png_convert:
+        console.print()
+        logger.info(
+            f"Found {len(pngs)} PNG files 🙄. Let us check for "
+            f"weight-loss potential…"
+        )
+        png_file_names = [png.filename.name for png in pngs]
+        logger.debug(f'List of PNG files: {", ".join(png_file_names)}')
+
+    console.print()
+    logger.info(
+        f"Found {len(images_dict.keys())} tasty images. 🧁 Let's see "
+        f"how we can cut some calories by optimizing your diet plan "
+        f"(i.e. resize images to an optimal resolution)…"
+    )
+    logger.debug(f"Indexed {len(kf.references.files)} metadata YAML files.")
+
 
-        logger.info(f"Building personal training plans to get images into " f"shape…")
-        for tiff in tqdm(tiffies):
-            tiff.convert()
+def log_image_results(resources, kf, png_convert):
+    logger = resources["logger"]
+    images_dict = kf.images_dict
+    images = all_images(kf)
+    tiffies = [image for image in images if "tif" in image.filename.suffix]
+    pngs = [image for image in images if "png" in image.filename.suffix]
+    duplicates = [
+        duplicate
+        for image in images_dict.values()
+        for duplicate in image.duplicates + image.merged
+    ]
+
+    unchanged = [image for image in images_dict.values() if image.unchanged]
+    if unchanged:
+        logger.info(
+            f"Skipped {len(unchanged)} images that are unchanged since the "
+            f"last run. 😴"
+        )
 
+    if tiffies:
         sizes_original = sum([tiff.size_original for tiff in tiffies])
         sizes_converted = sum([tiff.size_converted for tiff in tiffies])
         sizes_original_humanized = humanize.naturalsize(sizes_original)
@@ -173,24 +396,8 @@ def slim(
             f"{sizes_converted_humanized} ({reduction:.1f} %"
             f" reduction). 🚀"
         )
-        metadata.save()
-    else:
-        logger.info(f"No TIFF files in {str(path_packed)}.")
-        pass
 
     if pngs and png_convert:
-        console.print()
-        logger.info(
-            f"Found {len(pngs)} PNG files 🙄. Let us check for "
-            f"weight-loss potential…"
-        )
-        png_file_names = [png.filename.name for png in pngs]
-        logger.debug(f'List of PNG files: {", ".join(png_file_names)}')
-
-        logger.info(f"Building personal training plans to get images into " f"shape…")
-        for png in tqdm(pngs):
-            png.convert(jpeg_compression=jpeg_compression)
-
         sizes_original = sum([png.size_original for png in pngs])
         sizes_converted = sum([png.size_converted for png in pngs])
         sizes_original_humanized = humanize.naturalsize(sizes_original)
@@ -203,48 +410,9 @@ def slim(
             f"{sizes_converted_humanized} ({reduction:.1f} %"
             f" reduction). 🚀"
         )
-        metadata.save()
 
-    console.print()
-    logger.info(
-        f"Found {len(images_dict.keys())} tasty images. 🧁 Let's see "
-        f"how we can cut some calories by optimizing your diet plan "
-        f"(i.e. resize images to an optimal resolution)…"
-    )
-    all_yaml = [TiffyYaml(file) for file in kf.path_index.iterdir()]
-    logger.debug(
-        f"Searching {len(all_yaml)} metadata YAML files for "
-        f"references to the {len(images_dict.keys())} image files…"
-    )
-    for yaml_file in all_yaml:
-        for chunk in yaml_file.yaml["chunks"]:
-            for archive in chunk["archives"]:
-                for object in archive["objects"]:
-                    if object["_pbtype"] == "TSD.ImageArchive":
-                        identifier = object.get("data", {}).get("identifier", 0)
-                        if identifier in images_dict:
-                            images_dict[identifier].add_slide_reference(
-                                yaml_file, object
-                            )
-                    if object["_pbtype"] == "KN.SlideStyleArchive":
-                        if "image" in object.get("slideProperties", {}).get("fill", {}):
-                            identifier = (
-                                object.get("slideProperties", {})
-                                .get("fill", {})
-                                .get("image", {})
-                                .get("imagedata", {})
-                                .get("identifier", 0)
-                            )
-                            if identifier in images_dict:
-                                images_dict[identifier].add_slide_style_reference(
-                                    yaml_file, object
-                                )
-
-    for _, image in tqdm(images_dict.items()):
-        image.resize(max_ratio_factor=resize_factor)
-
-    sizes_converted = sum([image.size_converted for id, image in images_dict.items()])
-    sizes_resized = sum([image.size_resized for id, image in images_dict.items()])
+    sizes_converted = sum([image.size_converted for image in images])
+    sizes_resized = sum([image.size_resized for image in images])
     sizes_converted_humanized = humanize.naturalsize(sizes_converted)
     sizes_resized_humanized = humanize.naturalsize(sizes_resized)
     reduction = (1.0 - (sizes_resized / sizes_converted)) * 100.0
@@ -255,18 +423,8 @@ def slim(
         f" reduction) by resizing optimally. 🚀"
     )
 
-    console.print()
-    logger.info(
-        f"Analyze nutrients in {len(images_dict.keys())} images. "
-        f"🧁->🥬 Optimizing food healthiness (i.e. optimize image "
-        f"compression)…"
-    )
-
-    for _, image in tqdm(images_dict.items()):
-        image.optimize(jpeg_compression=jpeg_compression)
-
-    sizes_resized = sum([image.size_resized for id, image in images_dict.items()])
-    sizes_optimized = sum([image.size_optimized for id, image in images_dict.items()])
+    sizes_resized = sum([image.size_resized for image in images])
+    sizes_optimized = sum([image.size_optimized for image in images])
     sizes_resized_humanized = humanize.naturalsize(sizes_resized)
     sizes_optimized_humanized = humanize.naturalsize(sizes_optimized)
     reduction = (1.0 - (sizes_optimized / sizes_resized)) * 100.0
@@ -276,26 +434,121 @@ def slim(
         f"{sizes_optimized_humanized} ({reduction:.1f} %"
         f" reduction) by running compression optimizations. 🚀"
     )
+    if duplicates:
+        sizes_duplicates = sum([duplicate.size_original for duplicate in duplicates])
+        merged = [image for image in images_dict.values() if image.merged]
+        sizes_merged = sum(
+            [merge.size_original for image in merged for merge in image.merged]
+        )
+        cpu_time_saved = sum(
+            [
+                image.cpu_time * (len(image.duplicates) + len(image.merged))
+                for image in images_dict.values()
+            ]
+        )
+        logger.info(
+            f"Processing {len(duplicates)} duplicate images "
+            f"({humanize.naturalsize(sizes_duplicates)}) only once saved "
+            f"{cpu_time_saved:.1f} s of CPU time and removed "
+            f"{humanize.naturalsize(sizes_merged)} of identical files. 👯"
+        )
+    if resources.get("cache") is not None:
+        cache = resources["cache"]
+        logger.info(
+            f"Image cache: {cache.hits} hit(s), {cache.misses} miss(es) "
+            f"in {str(cache.path)}."
+        )
 
-    console.print()
-    kf.repack()
-    console.print()
+    log_png_stats(resources)
+
+
+@click.command(help="Get a Keynote file into shape by losing " "unnecessary weight")
+@slimming_options
+@click.option(
+    "-p",
+    "--export-pdf",
+    "export_pdf",
+    help="Export Keynote presentation to PDF after optimizing",
+    is_flag=True,
+)
+@click.argument("keynote_file", type=click.Path(exists=True))
+def slim(keynote_file, export_pdf, trace, report, **settings):
+    from minimize_ninja.keynote import KeynoteFile
+
+    options = SlimOptions(trace=trace is not None or report is not None, **settings)
+    resources = create_slimming_resources(options)
+    logger = resources["logger"]
+    console = resources["console"]
+    path_packed = Path(keynote_file)
+
+    kf = KeynoteFile(
+        resources,
+        path_keynote=path_packed,
+        native=options.native,
+        streaming=options.streaming,
+        reuse_manifest=not options.force,
+    )
+
+    if options.quality in QUALITY_LEVELS:
+        export_pdf = True
+    if export_pdf:
+        try:
+            applescript = load_backend("export")
+        except BackendError as exc:
+            logger.warning(f"{exc} Skipping the PDF export.")
+            export_pdf = False
+
+    settings = deck_settings(options)
+    warn_about_quality(
+        resources, settings["resize_factor"], settings["jpeg_compression"]
+    )
+
+    peak_memory = {}
+    progress = None
+    for event in slim_keynote(kf, options):
+        if isinstance(event, StageStarted) and event.stage == "images":
+            logger.info(
+                f"Building personal training plans to get images into shape "
+                f"(using {options.jobs} worker(s))…"
+            )
+            progress = tqdm(total=len(kf.images_dict))
+        elif isinstance(event, ImageDone):
+            progress.update()
+        elif isinstance(event, ImagesPruned):
+            logger.info(
+                f"Pruned {len(event.names)} images nothing refers to anymore, "
+                f"reclaiming {humanize.naturalsize(event.size)}. ✂️"
+            )
+            logger.debug(f"Pruned images: {', '.join(event.names)}")
+        elif isinstance(event, StageStarted) and event.stage == "repack":
+            log_image_results(resources, kf, settings["png_convert"])
+            console.print()
+        elif isinstance(event, StageFinished):
+            peak_memory[event.stage] = peak_rss()
+            if event.stage == "unpack":
+                console.print()
+                log_found_images(resources, kf, settings["png_convert"])
+            elif event.stage == "images":
+                progress.close()
+        elif isinstance(event, DeckFinished):
+            console.print()
+            reduction = (1.0 - (event.size_optimized / event.size_original)) * 100.0
+            logger.info(
+                f"MinimizeNinja is finished! 💪 Reducing Keynote file from "
+                f"{humanize.naturalsize(event.size_original)} to "
+                f"{humanize.naturalsize(event.size_optimized)} ({reduction:.1f} %"
+                f" reduction). 🚀"
+            )
 
-    size_original = kf.path_keynote.stat().st_size
-    size_optimized = kf.path_repacked.stat().st_size
-    size_original_humanized = humanize.naturalsize(size_original)
-    size_optimized_humanized = humanize.naturalsize(size_optimized)
-    reduction = (1.0 - (size_optimized / size_original)) * 100.0
     logger.info(
-        f"MinimizeNinja is finished! 💪 Reducing Keynote file from "
-        f"{size_original_humanized} to "
-        f"{size_optimized_humanized} ({reduction:.1f} %"
-        f" reduction). 🚀"
+        "Peak memory usage: "
+        + ", ".join(
+            f"{humanize.naturalsize(peak)} after {stage}"
+            for stage, peak in peak_memory.items()
+        )
     )
 
-    if not keep_unpacked:
-        logger.debug(f"Removing temporary files in {str(kf.path_unpacked)}…")
-        shutil.rmtree(kf.path_unpacked)
+    write_tracing(resources, trace, report)
 
     if export_pdf:
         filename_pdf = str(kf.path_keynote.stem) + ".pdf"
@@ -322,7 +575,545 @@ def slim(
             kf.path_repacked.unlink()
 
 
+def find_keynote_files(paths):
+    found = []
+    for path in paths:
+        if Path(path).is_dir():
+            found.extend(sorted(Path(path).rglob("*.key")))
+        elif Path(path).exists():
+            found.append(Path(path))
+        else:
+            found.extend(sorted(Path(match) for match in glob.glob(path)))
+    return [path for path in found if not path.stem.endswith("_tiffy")]
+
+
+@click.command(
+    "slim-batch",
+    help="Get many Keynote files into shape at once, sharing one pool of "
+    "image workers",
+)
+@slimming_options
+@click.option(
+    "--max-decks",
+    "max_decks",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of Keynote files unpacked at the same time",
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    "output_dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory for the slimmed Keynote files (default: current directory)",
+)
+@click.argument("paths", nargs=-1, required=True)
+def slim_batch(paths, trace, report, max_decks, output_dir, **settings):
+    from minimize_ninja.keynote import KeynoteFile
+
+    options = SlimOptions(trace=trace is not None or report is not None, **settings)
+    resources = create_slimming_resources(options)
+    logger = resources["logger"]
+    console = resources["console"]
+    settings = deck_settings(options)
+    warn_about_quality(
+        resources, settings["resize_factor"], settings["jpeg_compression"]
+    )
+
+    path_output = Path(output_dir) if output_dir is not None else Path.cwd()
+    path_output.mkdir(parents=True, exist_ok=True)
+    kfs = [
+        KeynoteFile(
+            deck_resources(resources),
+            path_keynote=path,
+            native=options.native,
+            streaming=options.streaming,
+            path_repacked=path_output / (path.stem + "_tiffy.key"),
+            reuse_manifest=not options.force,
+        )
+        for path in find_keynote_files(paths)
+    ]
+    if not kfs:
+        logger.error(f"No Keynote files found in {', '.join(paths)}.")
+        return
+
+    logger.info(
+        f"Found {len(kfs)} Keynote files. Time for a group workout! 🏋️ "
+        f"(using {options.jobs} worker(s), {max_decks} deck(s) at a time)"
+    )
+    results = slim_decks(kfs, jobs=options.jobs, max_decks=max_decks, **settings)
+
+    table = Table(title="MinimizeNinja results")
+    table.add_column("Keynote file")
+    table.add_column("Images", justify="right")
+    table.add_column("Original", justify="right")
+    table.add_column("Slimmed", justify="right")
+    table.add_column("Reduction", justify="right")
+    table.add_column("Time", justify="right")
+    for kf, result in results:
+        if "error" in result:
+            logger.error(f"{kf} failed: {result['error']}")
+            table.add_row(kf.path_keynote.name, "", "", "", "[red]failed[/]", "")
+            continue
+        reduction = (1.0 - (result["size_optimized"] / result["size_original"])) * 100.0
+        images = str(result["images"])
+        if result["unchanged"]:
+            images += f" ({result['unchanged']} unchanged)"
+        if result["pruned"]:
+            images += f" ({result['pruned']} pruned)"
+        table.add_row(
+            kf.path_keynote.name,
+            images,
+            humanize.naturalsize(result["size_original"]),
+            humanize.naturalsize(result["size_optimized"]),
+            f"{reduction:.1f} %",
+            f"{result['seconds']:.1f} s",
+        )
+    console.print()
+    console.print(table)
+    logger.info(f"Peak memory usage: {humanize.naturalsize(peak_rss())}")
+    if resources.get("cache") is not None:
+        cache = resources["cache"]
+        logger.info(
+            f"Image cache: {cache.hits} hit(s), {cache.misses} miss(es) "
+            f"in {str(cache.path)}."
+        )
+    log_png_stats(resources)
+    write_tracing(resources, trace, report)
+
+
+@click.command(
+    help="Estimate how much weight a Keynote file could lose at each quality "
+    "level without slimming it"
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    default=default_jobs(),
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of images to analyze in parallel",
+)
+@click.option(
+    "--max-memory",
+    "max_memory",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Memory budget in MB for image analysis",
+)
+@click.option(
+    "--tile-size",
+    "tile_size",
+    default=256,
+    show_default=True,
+    type=click.IntRange(min=16),
+    help="Edge length in pixels of the tiles test-encoded per image",
+)
+@click.option(
+    "--top",
+    "top",
+    default=15,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of heaviest images to list",
+)
+@click.argument("keynote_file", type=click.Path(exists=True, dir_okay=False))
+def analyze(keynote_file, jobs, max_memory, tile_size, top):
+    from minimize_ninja.keynote import KeynoteFile
+
+    resources = read_config()
+    logger = get_logger()
+    console = resources["console"]
+    check_slimming_backends(resources)
+    configure_memory(resources, max_memory)
+
+    kf = KeynoteFile(resources, path_keynote=Path(keynote_file), streaming=True)
+    logger.info(f"Weighing {kf.path_keynote.name} without touching it… ⚖️")
+    result = analyze_deck(kf, jobs=jobs, tile_size=tile_size)
+    images = sorted(
+        result["images"], key=lambda item: item[0].size_original, reverse=True
+    )
+
+    table = Table(title=f"Heaviest images in {kf.path_keynote.name}")
+    table.add_column("Image")
+    table.add_column("Pixels", justify="right")
+    table.add_column("Slides", justify="right")
+    table.add_column("Size", justify="right")
+    for level in ANALYSIS_LEVELS:
+        table.add_column(f"Level {level}", justify="right")
+    for image, estimates in images[0:top]:
+        info = image.info
+        name = image.filename.name
+        if image in result["duplicates"]:
+            name += " [dim](duplicate)[/]"
+        table.add_row(
+            name,
+            f"{info.width} x {info.height}" if info is not None else "",
+            str(len(image.slide_references) + len(image.slide_style_references)),
+            humanize.naturalsize(image.size_original),
+            *[humanize.naturalsize(estimates[level]) for level in ANALYSIS_LEVELS],
+        )
+    console.print()
+    console.print(table)
+
+    size_images = sum(image.size_original for image, _ in images)
+    summary = Table(title="Estimated result")
+    summary.add_column("Level")
+    summary.add_column("Settings")
+    summary.add_column("Keynote file", justify="right")
+    summary.add_column("Reduction", justify="right")
+    for level, (
+        resize_factor,
+        jpeg_compression,
+        png_convert,
+    ) in ANALYSIS_LEVELS.items():
+        size = (
+            result["size_original"]
+            - size_images
+            + sum(estimates[level] for _, estimates in images)
+        )
+        reduction = (1.0 - size / result["size_original"]) * 100.0
+        summary.add_row(
+            str(level),
+            f"resize factor {resize_factor}, JPEG quality {jpeg_compression}"
+            + (", PNG to JPEG" if png_convert else ""),
+            humanize.naturalsize(size),
+            f"{reduction:.1f} %",
+        )
+    console.print()
+    console.print(summary)
+    if result["duplicates"]:
+        sizes_duplicates = sum(image.size_original for image in result["duplicates"])
+        logger.info(
+            f"{len(result['duplicates'])} duplicate images "
+            f"({humanize.naturalsize(sizes_duplicates)}) could additionally be "
+            f"merged by --dedup. 👯"
+        )
+    logger.info(
+        f"Analyzed {len(images)} images in {result['seconds']:.1f} s. Levels 1–3 "
+        f"are meant for PDF exports only."
+    )
+
+
+@click.command(
+    help="Measure the speed of each pipeline stage on a synthetic Keynote file"
+)
+@click.option(
+    "--deck-dir",
+    "deck_dir",
+    type=click.Path(file_okay=False),
+    default="minimize-ninja-benchmark",
+    show_default=True,
+    help="Directory for the synthetic unpacked Keynote file",
+)
+@click.option("--tiffs", "tiffs", default=4, show_default=True, help="TIFF images")
+@click.option("--pngs", "pngs", default=4, show_default=True, help="PNG images")
+@click.option("--jpegs", "jpegs", default=4, show_default=True, help="JPEG images")
+@click.option("--width", "width", default=3000, show_default=True, help="Image width")
+@click.option(
+    "--height", "height", default=2000, show_default=True, help="Image height"
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    default=default_jobs(),
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of images to process in parallel in the pipeline stage",
+)
+@click.option(
+    "--png-convert",
+    "png_convert",
+    is_flag=True,
+    help="Try to convert PNG files to JPEG",
+)
+@click.option(
+    "--baseline",
+    "baseline",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="JSON file with results of an earlier run to compare against",
+)
+@click.option(
+    "--save-baseline",
+    "save",
+    is_flag=True,
+    help="Store the results in the --baseline file instead of comparing",
+)
+def benchmark(
+    deck_dir, tiffs, pngs, jpegs, width, height, jobs, png_convert, baseline, save
+):
+    from minimize_ninja.benchmark import (
+        check_predictions,
+        generate_deck,
+        load_baseline,
+        run_benchmark,
+        save_baseline,
+    )
+
+    resources = read_config()
+    logger = get_logger()
+    console = resources["console"]
+
+    path_deck = Path(deck_dir)
+    logger.info(
+        f"Generating synthetic Keynote file with {tiffs + pngs + jpegs} images "
+        f"of {width} x {height} pixels in {str(path_deck)}…"
+    )
+    generate_deck(path_deck, tiffs, pngs, jpegs, width, height)
+    results = run_benchmark(resources, path_deck, jobs=jobs, png_convert=png_convert)
+    predictions = check_predictions(resources, path_deck, png_convert=png_convert)
+
+    baseline_results = {}
+    if baseline is not None and save:
+        save_baseline(baseline, results)
+        logger.info(f"Stored results as baseline in {baseline}.")
+    elif baseline is not None and Path(baseline).exists():
+        baseline_results = load_baseline(baseline)
+
+    table = Table(title="MinimizeNinja benchmark")
+    table.add_column("Stage")
+    table.add_column("Time", justify="right")
+    table.add_column("CPU", justify="right")
+    table.add_column("Images/s", justify="right")
+    table.add_column("MB/s", justify="right")
+    table.add_column("Saved", justify="right")
+    if baseline_results:
+        table.add_column("vs. baseline", justify="right")
+    for result in results:
+        row = [
+            result["stage"],
+            f"{result['seconds']:.2f} s",
+            f"{result['cpu_seconds']:.2f} s",
+            f"{result['images_per_second']:.1f}",
+            f"{result['mb_per_second']:.1f}",
+            humanize.naturalsize(result["bytes_saved"]),
+        ]
+        if baseline_results:
+            previous = baseline_results.get(result["stage"])
+            if previous and previous["seconds"]:
+                change = (result["seconds"] / previous["seconds"] - 1.0) * 100.0
+                color = "green" if change <= 0 else "red"
+                row.append(f"[{color}]{change:+.1f} %[/]")
+            else:
+                row.append("")
+        table.add_row(*row)
+    console.print()
+    console.print(table)
+    logger.info(
+        f"Format prediction: decided {predictions['predicted']} of "
+        f"{predictions['images']} conversions from tiles, matching the full "
+        f"comparison in {predictions['matched']} of them."
+    )
+
+
+@click.command(
+    help="Run a local HTTP service that slims uploaded Keynote files from a "
+    "job queue, keeping workers and caches warm between uploads"
+)
+@click.option(
+    "--host", "host", default="127.0.0.1", show_default=True, help="Address to bind"
+)
+@click.option(
+    "--port", "port", default=8737, show_default=True, type=int, help="Port to bind"
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    default=default_jobs(),
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of images to process in parallel across all jobs",
+)
+@click.option(
+    "--max-jobs",
+    "max_jobs",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of Keynote files slimmed at the same time",
+)
+@click.option(
+    "--max-queued",
+    "max_queued",
+    default=16,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Maximum number of uploads waiting for their turn",
+)
+@click.option(
+    "--max-upload",
+    "max_upload",
+    default=2048,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum size of an upload in MB",
+)
+@click.option(
+    "--max-memory",
+    "max_memory",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Memory budget in MB for image processing across all jobs",
+)
+@click.option(
+    "--work-dir",
+    "work_dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory for uploads and results (default: a temporary directory)",
+)
+@click.option(
+    "--result-ttl",
+    "result_ttl",
+    default=3600,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Seconds a finished job and its result are kept",
+)
+@click.option(
+    "--jpeg-encoder",
+    "jpeg_encoder",
+    default="auto",
+    show_default=True,
+    type=click.Choice(JPEG_ENCODERS),
+    help="Encode JPEGs in-process or via the cjpeg command",
+)
+@click.option(
+    "--png-time-budget",
+    "png_time_budget",
+    default=None,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Seconds of Oxipng optimization per PNG",
+)
+@click.option(
+    "--png-deck-budget",
+    "png_deck_budget",
+    default=None,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Seconds of Oxipng optimization for all PNGs of a Keynote file",
+)
+@click.option(
+    "--png-min-gain",
+    "png_min_gain",
+    default=0.5,
+    show_default=True,
+    type=click.FloatRange(min=0.0),
+    help="Stop raising the Oxipng level once a level saves less than this "
+    "percentage (only with a time budget)",
+)
+@click.option(
+    "--no-cache",
+    "no_cache",
+    is_flag=True,
+    help="Do not use or fill the cache of previously optimized images",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory of the image cache (default: ~/.cache/minimize-ninja)",
+)
+@click.option(
+    "--cache-size",
+    "cache_size",
+    default=1024,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Maximum size of the image cache in MB",
+)
+def serve(
+    host,
+    port,
+    jobs,
+    max_jobs,
+    max_queued,
+    max_upload,
+    max_memory,
+    work_dir,
+    result_ttl,
+    jpeg_encoder,
+    png_time_budget,
+    png_deck_budget,
+    png_min_gain,
+    no_cache,
+    cache_dir,
+    cache_size,
+):
+    from minimize_ninja.server import JobQueue, SlimServer
+
+    resources = read_config()
+    logger = get_logger()
+    check_slimming_backends(resources)
+    configure_cache(resources, no_cache, cache_dir, cache_size)
+    configure_memory(resources, max_memory)
+    resources["jpeg_encoder"] = create_jpeg_encoder(resources, jpeg_encoder)
+    resources["png_optimizer"] = PngOptimizer(
+        resources,
+        image_budget=png_time_budget,
+        deck_budget=png_deck_budget,
+        min_gain=png_min_gain / 100.0,
+    )
+
+    queue = JobQueue(
+        resources,
+        path_work=work_dir,
+        jobs=jobs,
+        max_jobs=max_jobs,
+        max_queued=max_queued,
+        result_ttl=result_ttl,
+    )
+    server = SlimServer(
+        resources, queue, host=host, port=port, max_upload=max_upload * 1024 * 1024
+    )
+    logger.info(
+        f"MinimizeNinja is serving on http://{host}:{server.server_port} "
+        f"({jobs} worker(s), {max_jobs} deck(s) at a time). 🥷"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down, waiting for running jobs…")
+    finally:
+        server.server_close()
+        queue.shutdown()
+
+
+@click.command(help="List the encoder and optimizer backends and which are available")
+def backends():
+    resources = read_config()
+    console = resources["console"]
+    table = Table(title="MinimizeNinja backends")
+    table.add_column("Kind")
+    table.add_column("Backend")
+    table.add_column("Priority", justify="right")
+    table.add_column("Status")
+    for kind, interface in BACKEND_KINDS.items():
+        try:
+            selected = get_backend(kind)
+        except BackendError:
+            selected = None
+        for backend in registered_backends(kind):
+            if backend.available:
+                status = "[green]used[/]" if backend is selected else "available"
+            else:
+                status = f"[red]missing[/] {backend.hint or ''}"
+            table.add_row(kind, backend.name, str(backend.priority), status)
+    console.print(table)
+
+
 cli.add_command(slim)
+cli.add_command(slim_batch)
+cli.add_command(analyze)
+cli.add_command(serve)
+cli.add_command(backends)
+cli.add_command(benchmark)
 
 
 def main():
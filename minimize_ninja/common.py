@@ -1,5 +1,11 @@
+import json
 import logging
+import os
+import resource
+import sys
+import threading
 import time
+from contextlib import contextmanager
 
 from rich.console import Console
 from rich.logging import RichHandler
@@ -56,6 +62,136 @@ class Stopwatch(object):
         self._lap = time.time()
 
 
+class Span(object):
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer(object):
+    # Records wall and CPU time of nested spans per thread. The events can be
+    # written as Chrome trace-event file (chrome://tracing, Perfetto) or as an
+    # aggregated JSON report.
+    def __init__(self, enabled=True):
+        self._enabled = enabled
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, category="stage", **args):
+        span = Span(name, category, args)
+        if not self._enabled:
+            yield span
+            return
+        start = time.perf_counter()
+        cpu_time = time.thread_time()
+        try:
+            yield span
+        finally:
+            self._record(
+                span, start, time.perf_counter(), time.thread_time() - cpu_time
+            )
+
+    def _record(self, span, start, end, cpu_time):
+        with self._lock:
+            thread = threading.current_thread()
+            tid = self._threads.setdefault(
+                thread.ident, (len(self._threads) + 1, thread.name)
+            )[0]
+            self._events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": (start - self._start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": dict(span.args, cpu_ms=cpu_time * 1000.0),
+                }
+            )
+
+    def chrome_trace(self):
+        names = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in self._threads.values()
+        ]
+        return {"traceEvents": names + self._events, "displayTimeUnit": "ms"}
+
+    def report(self):
+        stages = {}
+        images = []
+        for event in self._events:
+            args = event["args"]
+            stage = stages.setdefault(
+                f"{event['cat']}:{event['name']}",
+                {
+                    "count": 0,
+                    "wall_s": 0.0,
+                    "cpu_s": 0.0,
+                    "bytes_in": 0,
+                    "bytes_out": 0,
+                },
+            )
+            stage["count"] += 1
+            stage["wall_s"] += event["dur"] / 1e6
+            stage["cpu_s"] += args["cpu_ms"] / 1000.0
+            stage["bytes_in"] += args.get("bytes_in", 0)
+            stage["bytes_out"] += args.get("bytes_out", 0)
+            if event["cat"] == "image":
+                images.append(
+                    dict(
+                        args,
+                        stage=event["name"],
+                        wall_s=event["dur"] / 1e6,
+                        thread=event["tid"],
+                    )
+                )
+        return {"stages": stages, "images": images}
+
+    def write_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+    def write_report(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+
+NULL_TRACER = Tracer(enabled=False)
+
+
+def converts(suffix, png_convert=False):
+    # Whether images with this suffix are test-converted to PNG and JPEG.
+    return "tif" in suffix or ("png" in suffix and png_convert)
+
+
+def get_tracer(resources):
+    if resources is None:
+        return NULL_TRACER
+    return resources.get("tracer", NULL_TRACER)
+
+
+def peak_rss():
+    # ru_maxrss is reported in kilobytes on Linux, but in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
 def read_config():
     logger = get_logger()
 
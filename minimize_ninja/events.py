@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+# Progress events of slimming a deck, in the order they are emitted.
+
+# A stage of the deck ("unpack", "images" or "repack") started.
+StageStarted = namedtuple("StageStarted", ["stage"])
+
+# A stage finished after `seconds`; "unpack" reports the number of images.
+StageFinished = namedtuple("StageFinished", ["stage", "seconds", "images"])
+
+# Unreferenced images were removed before processing, freeing `size` bytes.
+ImagesPruned = namedtuple("ImagesPruned", ["names", "size"])
+
+# One image (and its duplicates) is done; `done` of `total` images so far.
+ImageDone = namedtuple(
+    "ImageDone",
+    ["name", "done", "total", "size_original", "size_optimized", "unchanged"],
+)
+
+# The slimmed deck is written; sizes are those of the Keynote files.
+DeckFinished = namedtuple(
+    "DeckFinished",
+    [
+        "images",
+        "unchanged",
+        "pruned",
+        "size_original",
+        "size_optimized",
+        "seconds",
+    ],
+)
+
+
+def event_name(event):
+    # "StageStarted" → "stage_started", as used in JSON.
+    name = type(event).__name__
+    return "".join(
+        "_" + char.lower() if char.isupper() and index else char.lower()
+        for index, char in enumerate(name)
+    )
@@ -0,0 +1,201 @@
+from collections import namedtuple
+
+# Slides are assumed to be shown this many pixels high; `resize_factor` is
+# applied on top of it.
+RENDER_HEIGHT = 1080.0
+
+# Keynote's default slide size in points, used if a deck does not tell.
+DEFAULT_SLIDE_SIZE = (1920.0, 1080.0)
+
+# Nested groups deeper than this are not followed any further.
+MAX_GROUP_DEPTH = 16
+
+# The pixels an image covers when its slide is shown RENDER_HEIGHT pixels
+# high. `visible` is the part of the image that can be seen, as (left, top,
+# right, bottom) fractions of the image, or None if all of it may be seen.
+Footprint = namedtuple("Footprint", ["width", "height", "visible"])
+
+
+def size_of(node):
+    # (width, height) of a TSP.Size, or None if it is missing or empty.
+    if not isinstance(node, dict):
+        return None
+    width, height = node.get("width"), node.get("height")
+    if width is None or height is None:
+        return None
+    width, height = float(width), float(height)
+    if width <= 0 or height <= 0:
+        return None
+    return width, height
+
+
+def position_of(node):
+    if not isinstance(node, dict):
+        return 0.0, 0.0
+    return float(node.get("x", 0.0)), float(node.get("y", 0.0))
+
+
+def drawable_of(obj):
+    # The TSD.DrawableArchive at the end of the `super` chain of a drawable.
+    node = obj
+    while isinstance(node, dict):
+        if "geometry" in node or "parent" in node:
+            return node
+        node = node.get("super")
+    return {}
+
+
+def is_axis_aligned(geometry):
+    return not float(geometry.get("angle", 0.0)) and not geometry.get("flags", 0)
+
+
+class ResolutionEngine(object):
+    # Works out how many pixels of an image a deck can actually show: the
+    # size of every placement in slide coordinates, scaled by the groups it
+    # is nested in and by the slide size, and which part of the image its
+    # mask and the slide edges leave visible.
+    def __init__(self, slide_size=None, objects=None):
+        self._slide_size = slide_size or DEFAULT_SLIDE_SIZE
+        # Archive identifier -> (yaml_file, object), for masks and groups.
+        self._objects = objects if objects is not None else {}
+        self._scale = RENDER_HEIGHT / self._slide_size[1]
+
+    def __repr__(self):
+        return f"ResolutionEngine({self._slide_size[0]:g} x {self._slide_size[1]:g})"
+
+    @property
+    def slide_size(self):
+        return self._slide_size
+
+    def image_footprint(self, obj):
+        # Footprint of a TSD.ImageArchive, or None if it has no size at all.
+        drawable = drawable_of(obj)
+        geometry = drawable.get("geometry", {})
+        size = size_of(geometry.get("size"))
+        if size is None:
+            # Without a frame the natural size stands in for the placed one.
+            size = size_of(obj.get("originalSize"))
+            if size is None:
+                return None
+            return Footprint(size[0] * self._scale, size[1] * self._scale, None)
+        scale = self._scale * self._group_scale(drawable)
+        return Footprint(
+            size[0] * scale, size[1] * scale, self._visible(obj, drawable, size)
+        )
+
+    def background_footprint(self):
+        # Slide backgrounds fill the whole slide.
+        return Footprint(
+            self._slide_size[0] * self._scale, self._slide_size[1] * self._scale, None
+        )
+
+    def _lookup(self, reference):
+        if not isinstance(reference, dict) or "identifier" not in reference:
+            return None, None
+        return self._objects.get(str(reference["identifier"]), (None, None))
+
+    def _parent(self, drawable):
+        _, obj = self._lookup(drawable.get("parent"))
+        if obj is None or obj.get("_pbtype") != "TSD.GroupArchive":
+            return None
+        return obj
+
+    def _group_scale(self, drawable):
+        # Groups store the frame of their children as they were when grouped
+        # and stretch them to their own frame. A group drawn smaller than its
+        # children only ever needs fewer pixels, so only enlargements count.
+        scale = 1.0
+        for _ in range(MAX_GROUP_DEPTH):
+            group = self._parent(drawable)
+            if group is None:
+                break
+            drawable = drawable_of(group)
+            size = size_of(drawable.get("geometry", {}).get("size"))
+            bounds = self._children_bounds(group)
+            if size is not None and bounds is not None:
+                scale *= max(size[0] / bounds[0], size[1] / bounds[1], 1.0)
+        return scale
+
+    def _children_bounds(self, group):
+        left = top = right = bottom = None
+        for child in group.get("children", []):
+            _, obj = self._lookup(child)
+            if obj is None:
+                continue
+            geometry = drawable_of(obj).get("geometry", {})
+            size = size_of(geometry.get("size"))
+            if size is None:
+                continue
+            x, y = position_of(geometry.get("position"))
+            left = x if left is None else min(left, x)
+            top = y if top is None else min(top, y)
+            right = x + size[0] if right is None else max(right, x + size[0])
+            bottom = y + size[1] if bottom is None else max(bottom, y + size[1])
+        if left is None or right <= left or bottom <= top:
+            return None
+        return right - left, bottom - top
+
+    def _visible(self, obj, drawable, size):
+        # Only straight, unflipped images outside of groups are cropped, as
+        # only for these the visible part maps to a rectangle of pixels.
+        geometry = drawable.get("geometry", {})
+        if not is_axis_aligned(geometry) or self._parent(drawable) is not None:
+            return None
+        left, top, right, bottom = 0.0, 0.0, size[0], size[1]
+        if "mask" in obj:
+            _, mask = self._lookup(obj["mask"])
+            if mask is None:
+                return None
+            mask_geometry = drawable_of(mask).get("geometry", {})
+            mask_size = size_of(mask_geometry.get("size"))
+            if mask_size is None or not is_axis_aligned(mask_geometry):
+                return None
+            # Mask positions are relative to the image frame.
+            x, y = position_of(mask_geometry.get("position"))
+            left, top = max(left, x), max(top, y)
+            right, bottom = min(right, x + mask_size[0]), min(bottom, y + mask_size[1])
+        x, y = position_of(geometry.get("position"))
+        left, top = max(left, -x), max(top, -y)
+        right = min(right, self._slide_size[0] - x)
+        bottom = min(bottom, self._slide_size[1] - y)
+        if right <= left or bottom <= top:
+            # Nothing to see; keep the image as it is rather than guess.
+            return None
+        visible = (left / size[0], top / size[1], right / size[0], bottom / size[1])
+        if visible == (0.0, 0.0, 1.0, 1.0):
+            return None
+        return visible
+
+    def crop_placement(self, obj, visible):
+        # Shrinks the frame of a placement to its `visible` part, so the image
+        # cropped to it shows where it did before, and moves the mask along.
+        # Returns the file of the mask if it has been changed.
+        left, top, right, bottom = visible
+        geometry = drawable_of(obj)["geometry"]
+        width, height = size_of(geometry["size"])
+        x, y = position_of(geometry.get("position"))
+        geometry["position"] = dict(
+            geometry.get("position", {}), x=x + width * left, y=y + height * top
+        )
+        geometry["size"] = dict(
+            geometry["size"],
+            width=width * (right - left),
+            height=height * (bottom - top),
+        )
+        for field in ["originalSize", "naturalSize"]:
+            size = size_of(obj.get(field))
+            if size is not None:
+                obj[field] = dict(
+                    obj[field],
+                    width=size[0] * (right - left),
+                    height=size[1] * (bottom - top),
+                )
+        if "mask" not in obj:
+            return None
+        yaml_file, mask = self._lookup(obj["mask"])
+        mask_geometry = drawable_of(mask)["geometry"]
+        x, y = position_of(mask_geometry.get("position"))
+        mask_geometry["position"] = dict(
+            mask_geometry.get("position", {}), x=x - width * left, y=y - height * top
+        )
+        return yaml_file
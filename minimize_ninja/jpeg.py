@@ -0,0 +1,90 @@
+import subprocess
+
+from minimize_ninja.backends import BackendError, has_backend, load_backend
+
+JPEG_ENCODERS = ["auto", "inprocess", "cjpeg"]
+
+
+class InProcessEncoder(object):
+    # Encodes the decoded pixels with ImageMagick and runs MozJPEG's
+    # progressive scan and Huffman optimization on the result, all in memory
+    # and inside the calling worker thread.
+    name = "mozjpeg"
+
+    def __init__(self, resources):
+        self._logger = resources["logger"]
+        self._optimizer = load_backend("jpeg")
+
+    def __repr__(self):
+        return "InProcessEncoder()"
+
+    def encode(self, image, quality, label=None):
+        from wand.exceptions import WandException
+
+        try:
+            image.format = "jpg"
+            image.compression_quality = quality
+            return self._optimizer.optimize(image.make_blob())
+        except (WandException, ValueError) as exc:
+            self._logger.error(f"MozJPEG was unable to encode {label}: {exc}")
+            return None
+
+
+class CjpegEncoder(object):
+    # Pipes the decoded pixels as PPM/PGM into cjpeg, which every cjpeg
+    # build can read, unlike JPEG input.
+    name = "cjpeg"
+
+    def __init__(self, resources):
+        self._logger = resources["logger"]
+
+    def __repr__(self):
+        return "CjpegEncoder()"
+
+    def encode(self, image, quality, label=None):
+        image.format = "pgm" if image.colorspace == "gray" else "ppm"
+        image.depth = 8
+        try:
+            r = subprocess.run(
+                [load_backend("jpeg-command"), "-quality", str(quality)],
+                input=image.make_blob(),
+                capture_output=True,
+                timeout=20,
+            )
+        except subprocess.TimeoutExpired:
+            self._logger.error(f"cjpeg aborted due to timeout on {label}.")
+            return None
+        except BackendError as exc:
+            self._logger.error(f"Unable to encode {label}: {exc}")
+            return None
+        if r.returncode != 0:
+            self._logger.error(f"cjpeg was unable to run on {label}:")
+            self._logger.error(r.stderr.decode())
+            return None
+        return r.stdout
+
+
+def create_jpeg_encoder(resources, name="auto"):
+    if name == "auto":
+        name = "inprocess" if has_backend("jpeg") else "cjpeg"
+    if name == "inprocess" and not has_backend("jpeg"):
+        resources["logger"].warning(
+            "mozjpeg-lossless-optimization is not installed, falling back to "
+            "cjpeg. Install minimize-ninja[mozjpeg] for in-process encoding."
+        )
+        name = "cjpeg"
+    if name == "cjpeg" and not has_backend("jpeg-command"):
+        resources["logger"].warning(
+            "Neither mozjpeg-lossless-optimization nor cjpeg is available, "
+            "JPEG images will not be re-encoded."
+        )
+    if name == "inprocess":
+        return InProcessEncoder(resources)
+    return CjpegEncoder(resources)
+
+
+def get_jpeg_encoder(resources):
+    encoder = resources.get("jpeg_encoder")
+    if encoder is None:
+        encoder = resources.setdefault("jpeg_encoder", create_jpeg_encoder(resources))
+    return encoder
@@ -1,19 +1,394 @@
+import copy
+import hashlib
+import math
+import re
+import struct
 import subprocess
+import tempfile
+import threading
 import uuid
+import zlib
+from collections import namedtuple
 from pathlib import Path
+from zipfile import ZIP_STORED, ZipFile
 
 import humanize
-import oxipng
 import yaml
-from keynote_parser.file_utils import process
+from keynote_parser.codec import IWACompressedChunk, IWAFile
+from wand.exceptions import WandException
 from wand.image import Image
+from wand.resource import limits
+
+from minimize_ninja.backends import has_backend, load_backend
+from minimize_ninja.common import converts, get_tracer
+from minimize_ninja.geometry import DEFAULT_SLIDE_SIZE, ResolutionEngine, size_of
+from minimize_ninja.jpeg import get_jpeg_encoder
+from minimize_ninja.manifest import MANIFEST_NAME, Manifest
+from minimize_ninja.pdf import get_pdf_optimizer
+from minimize_ninja.png import get_png_optimizer
+from minimize_ninja.quality import (
+    PALETTE_COLORS,
+    image_luma,
+    pixel_stats,
+    search_jpeg_quality,
+    ssim,
+)
+
+RESIZABLE_SUFFIXES = [".png", ".jpg", ".gif", ".jpeg"]
+
+# Images below this size are test-encoded in full in every candidate format;
+# above it, a format is picked from encoded tiles if it is predicted to be
+# smaller by the margin.
+PREDICTION_MIN_PIXELS = 1024 * 1024
+PREDICTION_TILE_SIZE = 256
+PREDICTION_MARGIN = 0.2
+
+# Images are only cropped to the part their placements show if that drops at
+# least this share of the pixels.
+CROP_MIN_GAIN = 0.1
+
+# TSD.ImageArchive fields that refer to the whole image and would no longer
+# fit it once cropped.
+CROP_BLOCKING_FIELDS = [
+    "originalData",
+    "thumbnailData",
+    "adjustedImageData",
+    "enhancedImageData",
+    "imageAdjustments",
+    "instantAlphaPath",
+]
+
+# ImageMagick (Q16) keeps four 16 bit channels per pixel.
+BYTES_PER_PIXEL = 8
+
+# Use the libyaml bindings whenever PyYAML has been built with them.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Fields holding references to files in Data/ that can be pointed to another
+# file safely, per protobuf type.
+DATA_REFERENCE_FIELDS = {
+    "TSD.ImageArchive": [["data"], ["originalData"], ["thumbnailData"]],
+    "KN.SlideStyleArchive": [
+        ["slideProperties", "fill", "image", "imagedata"],
+        ["slideProperties", "fill", "image", "originalImageData"],
+    ],
+}
+
+
+def rewritable_data_references(obj):
+    rewritable = set()
+    for keys in DATA_REFERENCE_FIELDS.get(obj.get("_pbtype"), []):
+        node = obj
+        for key in keys:
+            node = node.get(key) if isinstance(node, dict) else None
+        if isinstance(node, dict):
+            rewritable.add(id(node))
+    return rewritable
+
+
+def iter_identifier_nodes(node):
+    if isinstance(node, dict):
+        if "identifier" in node:
+            yield node
+        for value in node.values():
+            yield from iter_identifier_nodes(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from iter_identifier_nodes(value)
+
+
+def is_identifier(value, identifiers):
+    return not isinstance(value, (dict, list)) and value in identifiers
+
+
+def slide_style_image_identifier(obj):
+    fill = obj.get("slideProperties", {}).get("fill", {})
+    if "image" not in fill:
+        return None
+    return fill.get("image", {}).get("imagedata", {}).get("identifier", 0)
+
+
+ImageInfo = namedtuple(
+    "ImageInfo", ["format", "width", "height", "bit_depth", "alpha", "color_type"]
+)
+
+PNG_COLOR_TYPES = {0: "gray", 2: "rgb", 3: "palette", 4: "gray", 6: "rgb"}
+JPEG_COLOR_TYPES = {1: "gray", 3: "rgb", 4: "cmyk"}
+TIFF_COLOR_TYPES = {0: "gray", 1: "gray", 2: "rgb", 3: "palette", 5: "cmyk"}
+
+
+def probe_image(file):
+    # Reads only as much of the header as needed to find the dimensions.
+    header = file.read(26)
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and header[12:16] == b"IHDR":
+        width, height, bit_depth, color_type = struct.unpack(">IIBB", header[16:26])
+        return ImageInfo(
+            "png",
+            width,
+            height,
+            bit_depth,
+            color_type in [4, 6],
+            PNG_COLOR_TYPES.get(color_type),
+        )
+    if header[0:6] in [b"GIF87a", b"GIF89a"]:
+        width, height, packed = struct.unpack("<HHB", header[6:11])
+        return ImageInfo("gif", width, height, (packed & 0x07) + 1, None, "palette")
+    if header.startswith(b"\xff\xd8"):
+        return _probe_jpeg(file, header)
+    if header[0:4] in [b"II*\x00", b"MM\x00*"]:
+        return _probe_tiff(file, header)
+    return None
+
+
+def _probe_jpeg(file, header):
+    data = header[2:]
+    while True:
+        while len(data) < 4:
+            block = file.read(4096)
+            if not block:
+                return None
+            data += block
+        if data[0] != 0xFF:
+            return None
+        marker = data[1]
+        if marker == 0xFF:
+            data = data[1:]
+            continue
+        if marker in [0x01] or 0xD0 <= marker <= 0xD9:
+            data = data[2:]
+            continue
+        length = struct.unpack(">H", data[2:4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in [0xC4, 0xC8, 0xCC]:
+            while len(data) < 10:
+                block = file.read(4096)
+                if not block:
+                    return None
+                data += block
+            bit_depth, height, width, components = struct.unpack(">BHHB", data[4:10])
+            return ImageInfo(
+                "jpg",
+                width,
+                height,
+                bit_depth,
+                False,
+                JPEG_COLOR_TYPES.get(components),
+            )
+        skip = 2 + length
+        if skip <= len(data):
+            data = data[skip:]
+        else:
+            file.seek(skip - len(data), 1)
+            data = b""
+
+
+def _probe_tiff(file, header):
+    order = "<" if header[0:2] == b"II" else ">"
+    offset = struct.unpack(order + "I", header[4:8])[0]
+    file.seek(offset)
+    count = struct.unpack(order + "H", file.read(2))[0]
+    entries = file.read(12 * count)
+    tags = {}
+    for index in range(count):
+        tag, type, number, value = struct.unpack(
+            order + "HHI4s", entries[12 * index : 12 * index + 12]
+        )
+        if type == 3 and number <= 2:
+            tags[tag] = struct.unpack(order + "H", value[0:2])[0]
+        elif type == 4 and number == 1:
+            tags[tag] = struct.unpack(order + "I", value)[0]
+        elif type == 3:
+            # Values that do not fit into the entry are stored elsewhere, use
+            # the first one (e.g. BitsPerSample per channel).
+            position = file.tell()
+            file.seek(struct.unpack(order + "I", value)[0])
+            tags[tag] = struct.unpack(order + "H", file.read(2))[0]
+            file.seek(position)
+    if 256 not in tags or 257 not in tags:
+        return None
+    return ImageInfo(
+        "tiff",
+        tags[256],
+        tags[257],
+        tags.get(258, 1),
+        338 in tags,
+        TIFF_COLOR_TYPES.get(tags.get(262)),
+    )
+
+
+def encode_varint(value):
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def extract_package(path_keynote, path_unpacked):
+    # Unlike keynote_parser's process(), this keeps the IWA archives binary.
+    with ZipFile(path_keynote, "r") as zipfile:
+        for zipinfo in zipfile.infolist():
+            if not zipinfo.flag_bits & 0x800:
+                zipinfo.filename = zipinfo.filename.encode("cp437").decode("utf-8")
+            if zipinfo.filename.endswith("/"):
+                continue
+            zipfile.extract(zipinfo, path_unpacked)
+
+
+def convert_package(path_from, path_to):
+    # keynote_parser's conversion of the whole package to and from YAML. Its
+    # protobuf modules take a while to load, so only runs without --native
+    # import it.
+    from keynote_parser.file_utils import process
+
+    process(str(path_from), str(path_to), replacements=[])
+
+
+def write_package(path_unpacked, path_repacked):
+    with ZipFile(path_repacked, "w", ZIP_STORED) as zipfile:
+        for path in sorted(path_unpacked.rglob("*")):
+            if path.is_file():
+                zipfile.write(path, path.relative_to(path_unpacked).as_posix())
+
+
+def copy_raw_member(source, target, zipinfo):
+    # Copies local header and (compressed) data of a member verbatim, so it is
+    # neither decompressed nor compressed again.
+    source.fp.seek(zipinfo.header_offset)
+    header = source.fp.read(30)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    length = name_length + extra_length + zipinfo.compress_size
+    if zipinfo.flag_bits & 0x08:
+        # The sizes follow the data in a data descriptor, possibly prefixed by
+        # its optional signature.
+        source.fp.seek(zipinfo.header_offset + 30 + length)
+        length += 16 if source.fp.read(4) == b"PK\x07\x08" else 12
+        source.fp.seek(zipinfo.header_offset + 30)
+    info = copy.copy(zipinfo)
+    info.header_offset = target.fp.tell()
+    target.fp.write(header)
+    while length > 0:
+        block = source.fp.read(min(length, 1024 * 1024))
+        target.fp.write(block)
+        length -= len(block)
+    target.filelist.append(info)
+    target.NameToInfo[info.filename] = info
+    target.start_dir = target.fp.tell()
+
+
+class KeynotePackage(object):
+    # Lazy view on a packed Keynote file. Only the Index archives are
+    # extracted; members in Data/ are read from the zip on demand and all
+    # members that were not rewritten are raw-copied into the repacked file.
+    def __init__(self, path_keynote):
+        self._path_keynote = path_keynote
+        self._zipfile = ZipFile(path_keynote, "r")
+        self._members = {}
+        for zipinfo in self._zipfile.infolist():
+            if not zipinfo.flag_bits & 0x800:
+                zipinfo.filename = zipinfo.filename.encode("cp437").decode("utf-8")
+            if not zipinfo.filename.endswith("/"):
+                self._members[zipinfo.filename] = zipinfo
+        self._extracted = {}
+        self._discarded = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"KeynotePackage({self._path_keynote})"
+
+    def member(self, name):
+        return self._members.get(name)
+
+    def open(self, name):
+        return self._zipfile.open(self._members[name])
+
+    def read(self, name):
+        with self.open(name) as file:
+            return file.read()
+
+    def discard(self, name):
+        with self._lock:
+            self._discarded.add(name)
+
+    def extract_index(self, path_unpacked):
+        for name, zipinfo in self._members.items():
+            if name.startswith("Index/"):
+                path = Path(self._zipfile.extract(zipinfo, path_unpacked))
+                self._extracted[name] = path.stat().st_mtime_ns
+        (path_unpacked / "Data").mkdir(parents=True, exist_ok=True)
+
+    def write(self, path_unpacked, path_repacked):
+        written = set()
+        with ZipFile(path_repacked, "w", ZIP_STORED) as zipfile:
+            for name, zipinfo in self._members.items():
+                if name in self._discarded:
+                    continue
+                written.add(name)
+                path = path_unpacked / name
+                if path.exists() and self._is_changed(name, path):
+                    zipfile.write(path, name)
+                elif name.isascii():
+                    copy_raw_member(self._zipfile, zipfile, zipinfo)
+                else:
+                    zipfile.writestr(zipinfo, self.read(name))
+            for path in sorted(path_unpacked.rglob("*")):
+                name = path.relative_to(path_unpacked).as_posix()
+                if path.is_file() and name not in written:
+                    zipfile.write(path, name)
+
+    def _is_changed(self, name, path):
+        # A new modification time means the member has been written. The
+        # same one does not prove the opposite on file systems with coarse
+        # timestamps, so the content is compared against the zip's size and
+        # CRC then.
+        if name not in self._extracted:
+            return True
+        if path.stat().st_mtime_ns != self._extracted[name]:
+            return True
+        zipinfo = self._members[name]
+        if path.stat().st_size != zipinfo.file_size:
+            return True
+        return zlib.crc32(path.read_bytes()) != zipinfo.CRC
+
+    def close(self):
+        self._zipfile.close()
+
+
+def configure_memory_limits(max_memory):
+    # Beyond these limits ImageMagick falls back to its disk pixel cache
+    # instead of growing the process further.
+    limits["memory"] = max_memory
+    limits["map"] = max_memory * 2
 
 
 class KeynoteFile(object):
-    def __init__(self, resources, path_keynote=None, path_unpacked=None):
+    def __init__(
+        self,
+        resources,
+        path_keynote=None,
+        path_unpacked=None,
+        native=False,
+        streaming=False,
+        path_repacked=None,
+        reuse_manifest=True,
+    ):
         self._resources = resources
+        self._reuse_manifest = reuse_manifest
         self._logger = resources["logger"]
-        if path_keynote is not None:
+        # Streaming always works on the binary archives.
+        self._native = native or streaming
+        self._streaming = streaming
+        self._package = None
+        if path_keynote is not None and streaming:
+            self._path_keynote = path_keynote
+            self._path_unpacked = Path(tempfile.mkdtemp(prefix="minimize-ninja-"))
+            self._is_unpacked = False
+            filename_repacked = str(self._path_keynote.stem) + "_tiffy.key"
+        elif path_keynote is not None:
             self._path_keynote = path_keynote
             self._path_unpacked = Path.cwd()
             self._is_unpacked = False
@@ -25,10 +400,17 @@ class KeynoteFile(object):
             self._path_unpacked = path_unpacked
             self._is_unpacked = True
             filename_repacked = str(self._path_unpacked.stem) + "_tiffy.key"
-        self._path_repacked = Path.cwd() / filename_repacked
+        if path_repacked is not None:
+            self._path_repacked = path_repacked
+        else:
+            self._path_repacked = Path.cwd() / filename_repacked
         self._images_dict = None
-        self._slides = None
         self._metadata = None
+        self._aliases = {}
+        self._references = None
+        self._manifest = None
+        self._slide_size = None
+        self._resolution = None
 
     def __repr__(self):
         if self.path_keynote is not None:
@@ -40,29 +422,82 @@ class KeynoteFile(object):
         if not self.is_unpacked:
             self._logger.info(f"Unpacking Keynote file {str(self.path_keynote)}…")
             print()
-            process(str(self.path_keynote), str(self.path_unpacked), replacements=[])
+            with get_tracer(self._resources).span(
+                "unpack",
+                "package",
+                file=self.path_keynote.name,
+                bytes_in=self.path_keynote.stat().st_size,
+            ):
+                if self.streaming:
+                    self._package = KeynotePackage(self.path_keynote)
+                    self._package.extract_index(self.path_unpacked)
+                elif self.native:
+                    extract_package(self.path_keynote, self.path_unpacked)
+                else:
+                    convert_package(self.path_keynote, self.path_unpacked)
             self._is_unpacked = True
         else:
             self._logger.error(f"{self} already unpacked! Will not unpack again.")
 
     def repack(self):
         if self.is_unpacked:
+            self._save_manifest()
             self._logger.info(f"Re-packing Keynote file {self.path_repacked.name}…")
             print()
-            process(str(self.path_unpacked), str(self.path_repacked), replacements=[])
+            with get_tracer(self._resources).span(
+                "repack", "package", file=self.path_repacked.name
+            ) as span:
+                if self.streaming:
+                    self._package.write(self.path_unpacked, self.path_repacked)
+                elif self.native:
+                    write_package(self.path_unpacked, self.path_repacked)
+                else:
+                    convert_package(self.path_unpacked, self.path_repacked)
+                span.set(bytes_out=self.path_repacked.stat().st_size)
         else:
             self._logger.error(
                 f"{self} not yet unpacked! Cannot repack before unpacking."
             )
 
+    def _load_manifest(self):
+        path = self.path_unpacked / MANIFEST_NAME
+        if self.streaming and not path.exists():
+            if self._package.member(MANIFEST_NAME) is None:
+                self._manifest = Manifest()
+            else:
+                self._manifest = Manifest.from_buffer(self._package.read(MANIFEST_NAME))
+        else:
+            self._manifest = Manifest.load(path)
+        if self._manifest.entries:
+            self._logger.debug(f"Found {self._manifest} of an earlier run.")
+
+    def _save_manifest(self):
+        # Images this run did not process keep the entries of the last run.
+        manifest = Manifest()
+        for survivor in self.images_dict.values():
+            for image in [survivor] + survivor.duplicates:
+                name = image.path.name
+                if image.settings is not None:
+                    manifest.record(name, image.digest, image.settings)
+                elif name in self.manifest:
+                    entry = self.manifest.entries[name]
+                    manifest.record(name, entry["digest"], entry["settings"])
+        manifest.save(self.path_unpacked / MANIFEST_NAME)
+
     def _load_metadata(self):
         if not self.is_unpacked:
             self._logger.error(
                 f"{self} cannot load metadata as Keynote file is not unpacked yet!"
             )
             return
-        path_metadata = self.path_unpacked / "Index" / "Metadata.iwa.yaml"
-        self._metadata = TiffyYaml(path_metadata)
+        if self.native:
+            self._metadata = TiffyIwa(
+                self.path_index / "Metadata.iwa", resources=self._resources
+            )
+        else:
+            self._metadata = TiffyYaml(
+                self.path_index / "Metadata.iwa.yaml", resources=self._resources
+            )
 
     def _load_image_metadata(self):
         if not self.is_unpacked:
@@ -79,34 +514,215 @@ class KeynoteFile(object):
                 for obj in archive["objects"]:
                     for data in obj.get("datas", []):
                         if data["fileName"] != "":
-                            image = ImageFile(data, self.path_data, self._resources)
+                            image = ImageFile(
+                                data,
+                                self.path_data,
+                                self._resources,
+                                package=self._package,
+                                manifest=(
+                                    self.manifest if self._reuse_manifest else None
+                                ),
+                            )
                             # images.append(image)
                             self._images_dict[image.identifier] = image
 
-    def _load_slides(self):
-        if not self.is_unpacked:
-            self._logger.error(
-                f"{self} cannot load image metadata as Keynote file is not unpacked yet!"
-            )
-            return
-        path_document = self.path_unpacked / "Index" / "Document.iwa.yaml"
-        self._document = TiffyYaml(path_document)
-        self._slides = []
-        for chunk in self._document.yaml["chunks"]:
+    def _load_slide_size(self):
+        # The slide size lives in the KN.ShowArchive of the Document archive,
+        # which the reference scan may have loaded already.
+        self._slide_size = DEFAULT_SLIDE_SIZE
+        name = "Document.iwa" if self.native else "Document.iwa.yaml"
+        path = self.path_index / name
+        documents = [file for file in self.references.files if file.path == path]
+        if not documents and path.exists():
+            if self.native:
+                documents = [TiffyIwa(path, resources=self._resources)]
+            else:
+                documents = [TiffyYaml(path, resources=self._resources)]
+        for document in documents:
+            for chunk in document.yaml["chunks"]:
+                for archive in chunk["archives"]:
+                    for obj in archive["objects"]:
+                        if obj.get("_pbtype") == "KN.ShowArchive":
+                            size = size_of(obj.get("size"))
+                            if size is not None:
+                                self._slide_size = size
+        self._logger.debug(
+            f"Slides are {self._slide_size[0]:g} x {self._slide_size[1]:g} points."
+        )
+
+    def link_references(self):
+        for identifier, references in self.references.slide_references.items():
+            identifier = self._aliases.get(identifier, identifier)
+            if identifier in self.images_dict:
+                for yaml_file, obj in references:
+                    self.images_dict[identifier].add_slide_reference(
+                        yaml_file, obj, self.resolution
+                    )
+        for identifier, references in self.references.slide_style_references.items():
+            identifier = self._aliases.get(identifier, identifier)
+            if identifier in self.images_dict:
+                for yaml_file, obj in references:
+                    self.images_dict[identifier].add_slide_style_reference(
+                        yaml_file, obj, self.resolution
+                    )
+
+    def save_placements(self):
+        # Writes the archives whose placements were changed by cropping. Only
+        # called once all images are done, as they share these archives.
+        changed = []
+        for image in self.images_dict.values():
+            for yaml_file in image.changed_files:
+                if yaml_file not in changed:
+                    changed.append(yaml_file)
+        for yaml_file in changed:
+            yaml_file.save()
+
+    def deduplicate(self):
+        # Byte-identical files in Data/ are processed only once. Duplicates
+        # whose references can all be rewritten safely are merged into the
+        # surviving file, all others follow the survivor and receive a copy of
+        # its processed result.
+        images_by_digest = {}
+        for image in self.images_dict.values():
+            images_by_digest.setdefault(image.digest, []).append(image)
+        survivors = {}
+        for images in images_by_digest.values():
+            images.sort(key=lambda image: image.identifier)
+            for image in images[1:]:
+                survivors[image.identifier] = images[0]
+        if not survivors:
+            return []
+
+        references, blocked = self._find_data_references(survivors)
+        changed = []
+        duplicates = []
+        for identifier, survivor in survivors.items():
+            duplicate = self._images_dict.pop(identifier)
+            duplicates.append(duplicate)
+            if identifier in blocked:
+                self._logger.debug(
+                    f"{duplicate} duplicates {survivor} but is referenced in a "
+                    f"way that cannot be rewritten. Will copy the result."
+                )
+                survivor.add_duplicate(duplicate)
+                self._aliases[identifier] = survivor.identifier
+                continue
+            self._logger.debug(f"Merging {duplicate} into {survivor}…")
+            for yaml_file, reference in references.get(identifier, []):
+                reference["identifier"] = survivor.identifier
+                if yaml_file not in changed:
+                    changed.append(yaml_file)
+            self._remove_data_entry(duplicate)
+            duplicate.remove()
+            survivor.add_merged(duplicate)
+            self._aliases[identifier] = survivor.identifier
+        for yaml_file in changed:
+            yaml_file.save()
+        return duplicates
+
+    def prune(self):
+        # Removes images nothing refers to, typically leftovers of deleted
+        # slides. An image only counts as unreferenced if neither it nor any
+        # of its duplicates is mentioned by an object in any Index archive or
+        # by a Metadata object other than the `datas` list itself. Returns
+        # the removed images, including duplicates that followed them.
+        candidates = {}
+        for identifier, image in self.images_dict.items():
+            identifiers = [identifier] + [
+                other.identifier for other in image.duplicates + image.merged
+            ]
+            if not any(
+                other in self.references.data_references for other in identifiers
+            ):
+                candidates[identifier] = identifiers
+        if not candidates:
+            return []
+        identifiers = {
+            other for identifiers in candidates.values() for other in identifiers
+        }
+        _, blocked = self._find_data_references(identifiers)
+        blocked |= self._mentioned_in_index(identifiers)
+        pruned = []
+        for identifier, identifiers in candidates.items():
+            if not blocked.isdisjoint(identifiers):
+                continue
+            image = self._images_dict.pop(identifier)
+            for removed in [image] + image.duplicates:
+                self._logger.debug(f"Pruning unreferenced {removed}…")
+                self._remove_data_entry(removed)
+                removed.remove()
+                pruned.append(removed)
+        return pruned
+
+    def _mentioned_in_index(self, identifiers):
+        # Safety net independent of how keynote_parser decodes the archives:
+        # a raw search of every Index archive for the encoded identifiers. A
+        # match that is something else entirely only keeps an image.
+        mentioned = set()
+        for path in sorted(self.path_index.iterdir()):
+            if path.name in ["Metadata.iwa", "Metadata.iwa.yaml"]:
+                continue
+            if path.suffix == ".iwa":
+                data = b"".join(IWACompressedChunk._decompress_all(path.read_bytes()))
+                mentioned |= {
+                    identifier
+                    for identifier in identifiers
+                    if b"\x08" + encode_varint(int(identifier)) in data
+                }
+            else:
+                found = set(ReferenceIndex.IDENTIFIER_PATTERN.findall(path.read_text()))
+                mentioned |= {
+                    identifier for identifier in identifiers if str(identifier) in found
+                }
+        return mentioned
+
+    def _find_data_references(self, identifiers):
+        references = {}
+        blocked = set()
+        for identifier in identifiers:
+            for yaml_file, node, rewritable in self.references.data_references.get(
+                identifier, []
+            ):
+                if rewritable:
+                    references.setdefault(identifier, []).append((yaml_file, node))
+                else:
+                    blocked.add(identifier)
+        for chunk in self.metadata.yaml["chunks"]:
             for archive in chunk["archives"]:
                 for obj in archive["objects"]:
-                    if obj["_pbtype"] == "KN.SlideNodeArchive":
-                        slide = KeynoteSlide(obj, path_unpacked)
-                        self._slides.append(slide)
-                        slide.build_file_references(self.images_dict)
-        slides_numbered = [slide for slide in self._slides if not slide.is_skipped]
-        for number, slide in enumerate(slides_numbered):
-            slide.slide_number = number + 1
+                    for key, value in obj.items():
+                        if key == "datas":
+                            continue
+                        for node in iter_identifier_nodes(value):
+                            if is_identifier(node["identifier"], identifiers):
+                                blocked.add(node["identifier"])
+        return references, blocked
+
+    def _remove_data_entry(self, image):
+        for chunk in self.metadata.yaml["chunks"]:
+            for archive in chunk["archives"]:
+                for obj in archive["objects"]:
+                    if "datas" in obj:
+                        obj["datas"] = [
+                            data for data in obj["datas"] if data is not image.metadata
+                        ]
+
+    @property
+    def resources(self):
+        return self._resources
 
     @property
     def is_unpacked(self):
         return self._is_unpacked
 
+    @property
+    def native(self):
+        return self._native
+
+    @property
+    def streaming(self):
+        return self._streaming
+
     @property
     def path_keynote(self):
         return self._path_keynote
@@ -150,58 +766,369 @@ class KeynoteFile(object):
         return self._metadata
 
     @property
-    def slides(self):
-        if self._slides is None:
-            self._load_slides()
-        return self._slides
+    def aliases(self):
+        return self._aliases
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._load_manifest()
+        return self._manifest
+
+    @property
+    def references(self):
+        if self._references is None:
+            self._references = ReferenceIndex(
+                self._resources, self.path_index, self.images_dict.keys()
+            )
+            self._references.scan()
+        return self._references
+
+    @property
+    def slide_size(self):
+        if self._slide_size is None:
+            self._load_slide_size()
+        return self._slide_size
+
+    @property
+    def resolution(self):
+        if self._resolution is None:
+            self._resolution = ResolutionEngine(
+                self.slide_size, self.references.archives
+            )
+        return self._resolution
+
+
+class ReferenceIndex(object):
+    # Scans all Index YAML files once and keeps only what the image pipeline
+    # needs: references from TSD.ImageArchive and KN.SlideStyleArchive objects,
+    # objects of a few interesting types, the objects by archive identifier,
+    # and every place that mentions one of the data identifiers. Files that
+    # cannot contain any of these are skipped by a plain text search before
+    # they are parsed.
+    TYPES = ["TSD.ImageArchive", "KN.SlideStyleArchive"]
+    IDENTIFIER_PATTERN = re.compile(r"identifier: '?(\d+)'?")
+
+    def __init__(self, resources, path_index, identifiers):
+        self._resources = resources
+        self._logger = resources["logger"]
+        self._path_index = path_index
+        self._identifiers = set(identifiers)
+        self._identifier_strings = {str(identifier) for identifier in identifiers}
+        self._identifier_varints = None
+        self._files = []
+        self._files_skipped = 0
+        self._objects = {}
+        self._archives = {}
+        self._slide_references = {}
+        self._slide_style_references = {}
+        self._data_references = {}
+
+    def __repr__(self):
+        return f"ReferenceIndex({self._path_index})"
+
+    def scan(self):
+        with get_tracer(self._resources).span("reference scan") as span:
+            self._scan()
+            span.set(files=len(self._files), files_skipped=self._files_skipped)
+
+    def _scan(self):
+        for path in sorted(self._path_index.iterdir()):
+            if path.name in ["Metadata.iwa", "Metadata.iwa.yaml"]:
+                continue
+            if path.suffix == ".iwa":
+                with open(path, "rb") as stream:
+                    content = stream.read()
+                if not self._may_contain_data_references(content):
+                    self._files_skipped += 1
+                    continue
+                yaml_file = TiffyIwa(path, content=content, resources=self._resources)
+            else:
+                with open(path, "r") as stream:
+                    content = stream.read()
+                if not self._may_contain_references(content):
+                    self._files_skipped += 1
+                    continue
+                yaml_file = TiffyYaml(path, content=content, resources=self._resources)
+            self._files.append(yaml_file)
+            for chunk in yaml_file.yaml["chunks"]:
+                for archive in chunk["archives"]:
+                    if archive["objects"]:
+                        identifier = str(archive["header"]["identifier"])
+                        self._archives[identifier] = (yaml_file, archive["objects"][0])
+                    for obj in archive["objects"]:
+                        self._index_object(yaml_file, obj)
+        self._logger.debug(
+            f"{self} indexed {len(self._files)} file(s), skipped "
+            f"{self._files_skipped} file(s) without references."
+        )
+
+    def _may_contain_references(self, content):
+        if any(pbtype in content for pbtype in self.TYPES):
+            return True
+        found = set(self.IDENTIFIER_PATTERN.findall(content))
+        return not self._identifier_strings.isdisjoint(found)
+
+    def _may_contain_data_references(self, content):
+        # Every TSP.DataReference is encoded as field 1 (tag 0x08) followed by
+        # the identifier as varint, so the decompressed archive can be searched
+        # for these byte sequences without decoding any protobuf message.
+        if self._identifier_varints is None:
+            self._identifier_varints = [
+                b"\x08" + encode_varint(int(identifier))
+                for identifier in self._identifiers
+            ]
+        data = b"".join(IWACompressedChunk._decompress_all(content))
+        return any(varint in data for varint in self._identifier_varints)
+
+    def _index_object(self, yaml_file, obj):
+        pbtype = obj.get("_pbtype")
+        if pbtype in self.TYPES:
+            self._objects.setdefault(pbtype, []).append((yaml_file, obj))
+        if pbtype == "TSD.ImageArchive":
+            identifier = obj.get("data", {}).get("identifier", 0)
+            self._slide_references.setdefault(identifier, []).append((yaml_file, obj))
+        if pbtype == "KN.SlideStyleArchive":
+            identifier = slide_style_image_identifier(obj)
+            if identifier is not None:
+                self._slide_style_references.setdefault(identifier, []).append(
+                    (yaml_file, obj)
+                )
+        rewritable = rewritable_data_references(obj)
+        for node in iter_identifier_nodes(obj):
+            identifier = node["identifier"]
+            if is_identifier(identifier, self._identifiers):
+                self._data_references.setdefault(identifier, []).append(
+                    (yaml_file, node, id(node) in rewritable)
+                )
+
+    def objects_of_type(self, pbtype):
+        return self._objects.get(pbtype, [])
+
+    @property
+    def files(self):
+        return self._files
+
+    @property
+    def archives(self):
+        # Archive identifier -> (yaml_file, object), e.g. to follow the mask
+        # or the group of an image.
+        return self._archives
+
+    @property
+    def slide_references(self):
+        return self._slide_references
+
+    @property
+    def slide_style_references(self):
+        return self._slide_style_references
+
+    @property
+    def data_references(self):
+        return self._data_references
 
 
 class TiffyYaml(object):
-    def __init__(self, path):
+    def __init__(self, path, content=None, resources=None):
         self._path = path
-        with open(self._path, "r") as stream:
+        self._resources = resources
+        if content is None:
+            with open(self._path, "r") as stream:
+                content = stream.read()
+        with get_tracer(resources).span(
+            "load", "yaml", file=path.name, bytes_in=len(content)
+        ):
             try:
-                self._yaml = yaml.safe_load(stream)
+                self._yaml = yaml.load(content, Loader=SafeLoader)
             except yaml.YAMLError as exc:
                 print(exc)
 
     def __repr__(self):
         return f"TiffyYaml({self._path})"
 
+    @property
+    def path(self):
+        return self._path
+
     @property
     def yaml(self):
         return self._yaml
 
     def save(self):
-        with open(self._path, "w") as file:
-            yaml.dump(self._yaml, file)
+        with get_tracer(self._resources).span(
+            "save", "yaml", file=self._path.name
+        ) as span:
+            with open(self._path, "w") as file:
+                yaml.dump(self._yaml, file, Dumper=SafeDumper)
+            span.set(bytes_out=self._path.stat().st_size)
+
+
+class TiffyIwa(TiffyYaml):
+    # Same interface as TiffyYaml, but reads and writes the binary IWA archive
+    # directly. The archive is only re-encoded on save(), so untouched archives
+    # stay byte-for-byte identical.
+    def __init__(self, path, content=None, resources=None):
+        self._path = path
+        self._resources = resources
+        if content is None:
+            with open(self._path, "rb") as stream:
+                content = stream.read()
+        with get_tracer(resources).span(
+            "load", "iwa", file=path.name, bytes_in=len(content)
+        ):
+            self._yaml = IWAFile.from_buffer(content, str(path)).to_dict()
+
+    def __repr__(self):
+        return f"TiffyIwa({self._path})"
+
+    def save(self):
+        with get_tracer(self._resources).span(
+            "save", "iwa", file=self._path.name
+        ) as span:
+            # keynote_parser strips `_pbtype` and adds header lengths while
+            # encoding, so it gets a copy and the parsed archive stays usable.
+            buffer = IWAFile.from_dict(copy.deepcopy(self._yaml)).to_buffer()
+            with open(self._path, "wb") as file:
+                file.write(buffer)
+            span.set(bytes_out=len(buffer))
 
 
 class ImageFile(object):
-    def __init__(self, metadata, path_data, resources):
+    def __init__(self, metadata, path_data, resources, package=None, manifest=None):
         self._resources = resources
         self._logger = resources["logger"]
         self._metadata = metadata
+        self._package = package
+        self._manifest = manifest
         self._filename = Path(self._metadata["preferredFileName"])
         self._filename_package = self._metadata["fileName"]
         self._path = path_data / self._filename_package
-        self._size_original = self._path.stat().st_size
-        self._size_converted = self._path.stat().st_size
-        self._size_resized = self._path.stat().st_size
-        self._size_optimized = self._path.stat().st_size
+        self._size_original = self.size_current
+        self._size_converted = self._size_original
+        self._size_resized = self._size_original
+        self._size_optimized = self._size_original
         self._identifier = self._metadata["identifier"]
         self._slide_references = []
         self._slide_style_references = []
+        self._footprints = []
+        self._resolution = None
+        self._cropped = None
+        self._changed_files = []
+        self._duplicates = []
+        self._merged = []
+        self._digest = None
+        self._info = None
+        self._probed = False
+        self._cpu_time = 0.0
+        self._settings = None
+        self._unchanged = False
 
     def __repr__(self):
-        natural_size = humanize.naturalsize(self._path.stat().st_size)
+        natural_size = humanize.naturalsize(self._size_optimized)
         return f"ImageFile({self._filename}, {natural_size})"
 
-    def add_slide_reference(self, yaml_file, data):
+    def add_slide_reference(self, yaml_file, data, resolution=None):
         self._slide_references.append((yaml_file, data))
+        if resolution is not None:
+            self._resolution = resolution
+            footprint = resolution.image_footprint(data)
+            if footprint is not None:
+                self._footprints.append(footprint)
 
-    def add_slide_style_reference(self, yaml_file, data):
+    def add_slide_style_reference(self, yaml_file, data, resolution=None):
         self._slide_style_references.append((yaml_file, data))
+        if resolution is not None:
+            self._footprints.append(resolution.background_footprint())
+
+    def add_duplicate(self, image):
+        self._duplicates.append(image)
+
+    def add_merged(self, image):
+        self._merged.append(image)
+
+    def remove(self):
+        self._discard(self._path)
+
+    def adopt(self, image):
+        # Take over the processed result of a byte-identical image.
+        path_original = self._path
+        if image.filename.suffix.lower() != self._path.suffix.lower():
+            self._switch_format(image.filename.suffix[1:])
+        self._write(image.read())
+        if self._path != path_original:
+            self._discard(path_original)
+        self._size_converted = image.size_converted
+        self._size_resized = image.size_resized
+        self._size_optimized = image.size_optimized
+        self._settings = image.settings
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            digest = hashlib.sha256()
+            with self._open() as file:
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(block)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    @property
+    def info(self):
+        # Dimensions and color properties from the file header; None for
+        # formats the probe does not understand.
+        if not self._probed:
+            with self._open() as file:
+                try:
+                    self._info = probe_image(file)
+                except (struct.error, OSError):
+                    self._info = None
+            self._probed = True
+        return self._info
+
+    @property
+    def resources(self):
+        return self._resources
+
+    @property
+    def settings(self):
+        return self._settings
+
+    @property
+    def unchanged(self):
+        return self._unchanged
+
+    @property
+    def memory_cost(self):
+        # Rough number of bytes needed to process the image: the decoded
+        # raster plus the resized copy. Without a header to look at, assume a
+        # compression ratio of 1:4.
+        if self.info is not None:
+            return self.info.width * self.info.height * BYTES_PER_PIXEL * 2
+        return self.size_original * 4 * 2
+
+    @property
+    def duplicates(self):
+        return self._duplicates
+
+    @property
+    def merged(self):
+        return self._merged
+
+    @property
+    def cpu_time(self):
+        return self._cpu_time
+
+    @cpu_time.setter
+    def cpu_time(self, value):
+        self._cpu_time = value
 
     @property
     def filename(self):
@@ -213,8 +1140,61 @@ class ImageFile(object):
 
     @property
     def size_current(self):
+        if self._is_packed:
+            return self._package.member(self._member_name(self._path)).file_size
         return self._path.stat().st_size
 
+    @property
+    def _is_packed(self):
+        return self._package is not None and not self._path.exists()
+
+    @staticmethod
+    def _member_name(path):
+        return f"Data/{path.name}"
+
+    def _open(self):
+        if self._is_packed:
+            return self._package.open(self._member_name(self._path))
+        return open(self._path, "rb")
+
+    def read(self):
+        with self._open() as file:
+            return file.read()
+
+    def _open_image(self, size_hint=None):
+        with self._span("decode", tool="wand", bytes_in=self.size_current):
+            image = Image()
+            if size_hint is not None:
+                # Lets libjpeg decode at a fraction of the full resolution.
+                image.options["jpeg:size"] = f"{size_hint[0]}x{size_hint[1]}"
+            if self._is_packed:
+                image.read(blob=self.read())
+            else:
+                image.read(filename=str(self._path))
+            return image
+
+    def _span(self, name, **args):
+        return get_tracer(self._resources).span(
+            name, "image", file=self._filename_package, **args
+        )
+
+    def _span_event(self, name):
+        with self._span(name):
+            pass
+
+    def _write(self, blob):
+        with open(self._path, "wb") as file:
+            file.write(blob)
+        self._info = None
+        self._probed = False
+        self._digest = None
+
+    def _discard(self, path):
+        if path.exists():
+            path.unlink()
+        if self._package is not None:
+            self._package.discard(self._member_name(path))
+
     @property
     def size_original(self):
         return self._size_original
@@ -251,178 +1231,802 @@ class ImageFile(object):
     def slide_style_references(self):
         return self._slide_style_references
 
+    @property
+    def footprints(self):
+        return self._footprints
+
+    @property
+    def changed_files(self):
+        # Archives whose placements of this image were changed by cropping.
+        return self._changed_files
+
     @property
     def has_slide_references(self):
         return self._slide_references or self._slide_style_references
 
+    @property
+    def _is_jpeg(self):
+        return self.filename.suffix.lower() in [".jpg", ".jpeg"]
+
+    @property
+    def is_resizable(self):
+        return self.filename.suffix.lower() in RESIZABLE_SUFFIXES
+
+    def process(
+        self,
+        convert=False,
+        formats=["png", "jpg"],
+        jpeg_compression=85,
+        convert_jpeg_compression=None,
+        max_ratio_factor=2.0,
+        oxipng_level=6,
+        target_ssim=None,
+        crop=False,
+        png_convert=False,
+    ):
+        # Fused variant of convert() -> resize() -> optimize(): the image is
+        # decoded once, kept in memory for format choice, cropping, resizing
+        # and optimization, and written to Data/ exactly once.
+        if convert_jpeg_compression is None:
+            convert_jpeg_compression = jpeg_compression
+        crop = self._crop_fractions() if crop else None
+        self._settings = dict(
+            suffix=self._path.suffix.lower(),
+            convert=convert,
+            formats=formats,
+            jpeg_compression=jpeg_compression,
+            convert_jpeg_compression=convert_jpeg_compression,
+            max_ratio_factor=max_ratio_factor,
+            oxipng_level=oxipng_level,
+            target_ssim=target_ssim,
+            jpeg_encoder=get_jpeg_encoder(self._resources).name,
+            png_optimizer=get_png_optimizer(self._resources).settings,
+            footprints=self._rounded_footprints(),
+            crop=crop,
+        )
+        if self._is_unchanged():
+            self._logger.debug(f"{self} is unchanged since it was last slimmed.")
+            self._span_event("manifest hit")
+            self._unchanged = True
+            return
+        if not convert and not self.has_slide_references:
+            return
+        with self._span("process", bytes_in=self.size_original) as span:
+            self._process_cached(
+                convert,
+                formats,
+                jpeg_compression,
+                convert_jpeg_compression,
+                max_ratio_factor,
+                oxipng_level,
+                target_ssim,
+                crop,
+            )
+            span.set(bytes_out=self.size_optimized)
+        if self._cropped is not None:
+            self._crop_placements(self._cropped)
+        self._settings = self._output_settings(png_convert)
+
+    def _process_cached(
+        self,
+        convert,
+        formats,
+        jpeg_compression,
+        convert_jpeg_compression,
+        max_ratio_factor,
+        oxipng_level,
+        target_ssim,
+        crop,
+    ):
+        cache = self._resources.get("cache")
+        if cache is None:
+            self._process(
+                convert,
+                formats,
+                jpeg_compression,
+                convert_jpeg_compression,
+                max_ratio_factor,
+                oxipng_level,
+                target_ssim,
+                crop,
+            )
+            return
+
+        source = self.read()
+        key = cache.make_key(source, self._settings)
+        entry = cache.get(key)
+        if entry is not None:
+            self._logger.debug(f"{self} found in {cache}.")
+            self._span_event("cache hit")
+            blob, info = entry
+            path_original = self._path
+            if info["suffix"].lower() != self._path.suffix.lower():
+                self._switch_format(info["suffix"][1:])
+            self._write(blob)
+            if self._path != path_original:
+                self._discard(path_original)
+            self._size_converted = info["size_converted"]
+            self._size_resized = info["size_resized"]
+            self._size_optimized = info["size_optimized"]
+            self._cropped = info.get("cropped")
+            return
+
+        self._process(
+            convert,
+            formats,
+            jpeg_compression,
+            convert_jpeg_compression,
+            max_ratio_factor,
+            oxipng_level,
+            target_ssim,
+            crop,
+        )
+        cache.put(
+            key,
+            self.read(),
+            dict(
+                suffix=self._path.suffix,
+                size_converted=self._size_converted,
+                size_resized=self._size_resized,
+                size_optimized=self._size_optimized,
+                cropped=self._cropped,
+            ),
+        )
+
+    def _process(
+        self,
+        convert,
+        formats,
+        jpeg_compression,
+        convert_jpeg_compression,
+        max_ratio_factor,
+        oxipng_level,
+        target_ssim,
+        crop,
+    ):
+        # TIFFs only become resizable once they have been converted.
+        needs_resize = self.has_slide_references and (self.is_resizable or convert)
+        max_ratio = None
+        if needs_resize and self.info is not None:
+            max_ratio = self._max_ratio(
+                self.info.width, self.info.height, max_ratio_factor
+            )
+            needs_resize = max_ratio < 1.0
+        if not convert and not needs_resize and crop is None:
+            self.optimize(
+                jpeg_compression=jpeg_compression,
+                oxipng_level=oxipng_level,
+                target_ssim=target_ssim,
+                max_ratio_factor=max_ratio_factor,
+            )
+            return
+
+        path_original = self._path
+        blob = None
+        with self._open_image() as image:
+            if convert:
+                natural_size = humanize.naturalsize(self.size_original)
+                self._logger.debug(
+                    f"Working on {self.filename.name} with " f"{natural_size}…"
+                )
+                format_original = image.format
+                quality_original = image.compression_quality
+                choice = self._choose_format(image, formats, convert_jpeg_compression)
+                if choice is not None:
+                    format, blob = choice
+                    self._switch_format(format)
+                    image.format = format
+                    if format == "jpg":
+                        image.compression_quality = convert_jpeg_compression
+                else:
+                    image.format = format_original
+                    image.compression_quality = quality_original
+
+            if needs_resize and max_ratio is None:
+                # Footprints refer to the whole image, so before cropping.
+                max_ratio = self._max_ratio(*image.size, max_ratio_factor)
+
+            if crop is not None and self.is_resizable:
+                with self._span("crop", tool="wand") as span:
+                    self._crop_image(image, crop)
+                    blob = image.make_blob()
+                    span.set(bytes_out=len(blob))
+                self._size_resized = len(blob)
+                self._size_optimized = self._size_resized
+
+            if needs_resize and self.is_resizable:
+                if max_ratio < 1.0:
+                    with self._span("resize", tool="wand") as span:
+                        self._resize_image(image, max_ratio)
+                        blob = image.make_blob()
+                        span.set(bytes_out=len(blob))
+                    self._size_resized = len(blob)
+                    self._size_optimized = self._size_resized
+                    self._log_resized()
+
+            if blob is not None:
+                # JPEGs are encoded again from the pixels in memory, not from
+                # the intermediate blob.
+                blob = self._optimize_blob(
+                    blob, jpeg_compression, oxipng_level, target_ssim, image
+                )
+
+        if blob is None:
+            # Neither converted nor resized, so the file on disk is still
+            # the best we have and can be optimized in place.
+            self.optimize(
+                jpeg_compression=jpeg_compression,
+                oxipng_level=oxipng_level,
+                target_ssim=target_ssim,
+                max_ratio_factor=max_ratio_factor,
+            )
+            return
+
+        self._write(blob)
+        if self._path != path_original:
+            self._discard(path_original)
+        self._log_optimized()
+
+    def estimate(self, levels, tile_size=256, tiles=3):
+        # Estimates the final size for every level of settings without writing
+        # or fully encoding anything: a few tiles of the image are scaled to
+        # the target resolution and encoded, and their bytes per pixel are
+        # extrapolated to the whole image.
+        info = self.info
+        suffix = self.filename.suffix.lower()
+        ratios = {}
+        for level, settings in levels.items():
+            ratios[level] = 1.0
+            resizable = self.is_resizable or settings["convert"]
+            if self.has_slide_references and resizable and info is not None:
+                ratios[level] = min(
+                    self._max_ratio(info.width, info.height, settings["resize_factor"]),
+                    1.0,
+                )
+        if info is None or suffix not in [".png", ".jpg", ".jpeg", ".tif", ".tiff"]:
+            return {
+                level: int(self.size_original * ratio**2)
+                for level, ratio in ratios.items()
+            }
+        if not self.has_slide_references and not any(
+            settings["convert"] for settings in levels.values()
+        ):
+            return {level: self.size_original for level in levels}
+
+        size_hint = None
+        ratio_max = max(ratios.values())
+        if suffix in [".jpg", ".jpeg"] and ratio_max < 1.0:
+            size_hint = (
+                math.ceil(info.width * ratio_max),
+                math.ceil(info.height * ratio_max),
+            )
+        samples = {}
+        estimates = {}
+        with self._open_image(size_hint) as image:
+            scale = image.width / info.width
+            quality_original = image.compression_quality
+            has_alpha = image.alpha_channel and not pixel_stats(image).opaque
+            for level, settings in levels.items():
+                ratio = ratios[level]
+                pixels = int(info.width * ratio) * int(info.height * ratio)
+                sizes = []
+                for candidate in self._estimate_candidates(
+                    settings, ratio, quality_original, has_alpha
+                ):
+                    if (ratio, candidate) not in samples:
+                        samples[(ratio, candidate)] = self._sample_tiles(
+                            image, min(ratio / scale, 1.0), *candidate, tile_size, tiles
+                        )
+                    overhead, bytes_per_pixel = samples[(ratio, candidate)]
+                    sizes.append(int(overhead + bytes_per_pixel * pixels))
+                if not sizes or ratio >= 1.0:
+                    sizes.append(self.size_original)
+                estimates[level] = min(sizes)
+        return estimates
+
+    def _estimate_candidates(self, settings, ratio, quality_original, has_alpha):
+        # The (format, JPEG quality) pairs process() would pick the result from.
+        suffix = self.filename.suffix.lower()
+        jpeg_compression = settings["jpeg_compression"]
+        if suffix in [".tif", ".tiff"] and not self.has_slide_references:
+            # Converted TIFFs without references are not optimized afterwards.
+            jpeg_compression = 85
+        if settings["convert"]:
+            candidates = [("png", None)]
+            if not has_alpha:
+                candidates.append(("jpg", jpeg_compression))
+            return candidates
+        if not self.has_slide_references:
+            return []
+        if suffix == ".png":
+            return [("png", None)]
+        if ratio < 1.0 and quality_original:
+            return [("jpg", quality_original), ("jpg", jpeg_compression)]
+        return [("jpg", jpeg_compression)]
+
+    def _sample_tiles(
+        self, image, ratio, format, quality, tile_size, tiles, optimize=True
+    ):
+        # Returns the size of an empty file of the format and the bytes per
+        # pixel of tiles spread along the diagonal of the image.
+        side = min(int(tile_size / ratio), image.width, image.height)
+        if side == min(image.width, image.height):
+            tiles = 1
+        total = 0
+        pixels = 0
+        for number in range(tiles):
+            left = (image.width - side) * (number + 1) // (tiles + 1)
+            top = (image.height - side) * (number + 1) // (tiles + 1)
+            with image[left : left + side, top : top + side] as tile:
+                if ratio < 1.0:
+                    tile.resize(max(int(side * ratio), 1), max(int(side * ratio), 1))
+                total += len(self._encode_tile(tile, format, quality, optimize))
+                pixels += tile.width * tile.height
+        with image[0:1, 0:1] as tile:
+            overhead = len(self._encode_tile(tile, format, quality, optimize))
+        return overhead, max(total - tiles * overhead, 0) / pixels
+
+    def _encode_tile(self, tile, format, quality, optimize=True):
+        tile.format = format
+        if format == "jpg":
+            tile.compression_quality = quality
+        blob = tile.make_blob()
+        if format == "png" and optimize and self.has_slide_references:
+            blob = load_backend("png").optimize_from_memory(blob, level=2)
+        return blob
+
+    def _output_settings(self, png_convert):
+        # The settings of this run as the next run computes them for the
+        # written file, which may have a different format by now.
+        suffix = self._path.suffix.lower()
+        if suffix == self._settings["suffix"]:
+            return self._settings
+        return dict(
+            self._settings,
+            suffix=suffix,
+            convert=converts(self._path.suffix, png_convert),
+            convert_jpeg_compression=self._settings["jpeg_compression"],
+        )
+
+    def _is_unchanged(self):
+        # Only files listed in the manifest are hashed.
+        if self._manifest is None or self._filename_package not in self._manifest:
+            return False
+        return self._manifest.matches(
+            self._filename_package, self.digest, self._settings
+        )
+
     def convert(self, formats=["png", "jpg"], jpeg_compression=85):
         natural_size = humanize.naturalsize(self.size_original)
         self._logger.debug(f"Working on {self.filename.name} with " f"{natural_size}…")
         path_original = self._path
-        with Image(filename=self._path) as image:
-            format_blobs = []
-            has_alpha = image.alpha_channel
-            for format in formats:
-                if format in ["jpg"] and has_alpha:
-                    continue
-                self._logger.debug(f"  Trying {format}…")
-                image.format = format
-                if format == "jpg":
-                    image.compression_quality = jpeg_compression
-                blob = image.make_blob()
-                format_blobs.append((format, len(blob), blob))
-                natural_size = humanize.naturalsize(len(blob))
-                self._logger.debug(f"  achieving {natural_size}.")
-
-            format_blobs.sort(key=lambda x: x[1])
-            # image.format = format
-            # image.save(filename=self._path.with_suffix(f'.{format}'))
-            format = format_blobs[0][0]
-            if format_blobs[0][1] >= self._size_original:
-                self._logger.debug(
-                    f"Conversion to best format ({format}) results in even "
-                    f"larger file than before. Will not convert."
-                )
+        with self._open_image() as image:
+            choice = self._choose_format(image, formats, jpeg_compression)
+        if choice is None:
+            return
+        format, blob = choice
+        self._switch_format(format)
+        self._write(blob)
+        if self._path != path_original:
+            self._discard(path_original)
+
+    def resize(self, max_ratio_factor=2.0):
+        if not (self.is_resizable and self.has_slide_references):
+            return
+        max_ratio = None
+        if self.info is not None:
+            max_ratio = self._max_ratio(
+                self.info.width, self.info.height, max_ratio_factor
+            )
+            if max_ratio >= 1.0:
                 return
+        with self._open_image() as img:
+            if max_ratio is None:
+                max_ratio = self._max_ratio(*img.size, max_ratio_factor)
+            if max_ratio < 1.0:
+                with self._span("resize", tool="wand"):
+                    self._resize_image(img, max_ratio)
+                    img.save(filename=str(self._path))
+                self._info = None
+                self._probed = False
+                self._digest = None
+                self._size_resized = self._path.stat().st_size
+                self._size_optimized = self._size_resized
+                self._log_resized()
 
-            self._size_converted = format_blobs[0][1]
-            self._size_resized = self._size_converted
-            self._size_optimized = self._size_converted
+    def optimize(
+        self,
+        jpeg_compression=85,
+        oxipng_level=6,
+        target_ssim=None,
+        max_ratio_factor=2.0,
+    ):
+        if (
+            self.filename.suffix.lower() in [".png", ".jpg", ".jpeg"]
+            and self.has_slide_references
+        ):
+            blob = self.read()
+            blob_optimized = self._optimize_blob(
+                blob, jpeg_compression, oxipng_level, target_ssim
+            )
+            if blob_optimized is not blob:
+                self._write(blob_optimized)
+        elif self.filename.suffix.lower() == ".pdf" and self.has_slide_references:
+            if has_backend("pdf"):
+                self._optimize_pdf(jpeg_compression, max_ratio_factor)
+            elif has_backend("pdf-command"):
+                self._optimize_pdf_command()
+            else:
+                self._logger.debug(f"{self} skipped, no PDF optimizer available.")
+
+        self._log_optimized()
+
+    def _optimize_pdf(self, jpeg_compression, max_ratio_factor):
+        self._logger.debug(f"{self} will be optimized via pikepdf…")
+        blob = self.read()
+        with self._span("optimize", tool="pikepdf", bytes_in=len(blob)) as span:
+            blob_optimized = get_pdf_optimizer(self._resources).optimize(
+                blob,
+                target_sizes=[
+                    (
+                        footprint.width * max_ratio_factor,
+                        footprint.height * max_ratio_factor,
+                    )
+                    for footprint in self._footprints
+                ],
+                jpeg_compression=jpeg_compression,
+                label=self,
+            )
+            span.set(bytes_out=len(blob_optimized))
+        if len(blob_optimized) < self._size_resized * 0.98:
+            self._write(blob_optimized)
+            self._size_optimized = len(blob_optimized)
+
+    def _optimize_pdf_command(self):
+        self._logger.debug(f"{self} will be optimized via pdfsizeopt…")
+        if self._is_packed:
+            self._write(self.read())
+        tmp_file = str(uuid.uuid4()) + ".pdf"
+        path_tmp_file = self._path.parent / tmp_file
+        try:
+            r = subprocess.run(
+                [load_backend("pdf-command"), self._path.name, tmp_file],
+                capture_output=True,
+                cwd=self._path.parent,
+                timeout=60,
+            )
+        except subprocess.TimeoutExpired as exc:
+            self._logger.error(f"pdfsizeopt aborted due to timeout on {self}.")
+            if exc.stderr:
+                self._logger.error(exc.stderr.decode())
+        else:
+            if r.returncode != 0:
+                self._logger.error(f"pdfsizeopt was unable to run on {self}:")
+                self._logger.error(r.stderr.decode())
+            elif path_tmp_file.stat().st_size < self._size_resized * 0.98:
+                path_tmp_file.rename(self._path)
+                self._digest = None
+                self._size_optimized = self._path.stat().st_size
+        if path_tmp_file.exists():
+            path_tmp_file.unlink()
+
+    def _choose_format(self, image, formats, jpeg_compression):
+        with self._span("convert", tool="wand", bytes_in=self.size_original) as span:
+            choice = self._choose_best_format(image, formats, jpeg_compression)
+            span.set(bytes_out=self.size_converted)
+        return choice
+
+    def _choose_best_format(self, image, formats, jpeg_compression):
+        # Only the smallest candidate so far is kept in memory, so at most two
+        # encoded blobs exist at the same time.
+        best = None
+        stats = self._reduce_image(image)
+        candidates = self._format_candidates(stats, formats)
+        predicted = self._predict_format(image, candidates, jpeg_compression)
+        if predicted is not None:
+            candidates = [predicted]
+        for format, encoder in candidates:
+            self._logger.debug(f"  Trying {encoder}…")
+            blob = self._encode_candidate(image, format, encoder, jpeg_compression)
+            natural_size = humanize.naturalsize(len(blob))
+            self._logger.debug(f"  achieving {natural_size}.")
+            if best is None or len(blob) < len(best[1]):
+                best = (format, blob)
+            del blob
+
+        if best is None:
+            return None
+        format = best[0]
+        if len(best[1]) >= self._size_original:
             self._logger.debug(
-                f"  Picking {format} and losing "
-                f"{(self.lost_weight_converted * 100.0):.1f}%!"
+                f"Conversion to best format ({format}) results in even "
+                f"larger file than before. Will not convert."
+            )
+            return None
+
+        self._size_converted = len(best[1])
+        self._size_resized = self._size_converted
+        self._size_optimized = self._size_converted
+        self._logger.debug(
+            f"  Picking {format} and losing "
+            f"{(self.lost_weight_converted * 100.0):.1f}%!"
+        )
+        return best
+
+    def _format_candidates(self, stats, formats):
+        # (format, ImageMagick encoder) pairs worth encoding for the pixels.
+        palette = stats.colors is not None and stats.colors <= PALETTE_COLORS
+        candidates = []
+        for format in formats:
+            if format in ["jpg"] and not stats.opaque:
+                continue
+            if format in ["jpg"] and palette and "png" in formats:
+                # Flat graphics never get smaller as JPEG than as palette PNG.
+                continue
+            encoder = format
+            if format == "png" and palette and stats.binary_alpha:
+                encoder = "png8"
+            candidates.append((format, encoder))
+        return candidates
+
+    def _encode_candidate(self, image, format, encoder, jpeg_compression):
+        image.format = encoder
+        if format == "jpg":
+            image.compression_quality = jpeg_compression
+        return image.make_blob()
+
+    def _predict_format(self, image, candidates, jpeg_compression):
+        # Extrapolates the size of every candidate from a few encoded tiles.
+        # Returns the clear winner, or None when the prediction is too close
+        # to call (or the image too small to bother) and all candidates have
+        # to be encoded in full.
+        pixels = image.width * image.height
+        if len(candidates) < 2 or pixels < PREDICTION_MIN_PIXELS:
+            return None
+        sizes = {}
+        for format, encoder in candidates:
+            overhead, bytes_per_pixel = self._sample_tiles(
+                image,
+                1.0,
+                encoder,
+                jpeg_compression if format == "jpg" else None,
+                PREDICTION_TILE_SIZE,
+                3,
+                optimize=False,
             )
-            with open(self._path.with_suffix(f".{format}"), "wb") as file:
-                file.write(format_blobs[0][2])
+            sizes[format] = overhead + bytes_per_pixel * pixels
+        ranked = sorted(candidates, key=lambda candidate: sizes[candidate[0]])
+        smallest = sizes[ranked[0][0]]
+        if smallest > sizes[ranked[1][0]] * (1.0 - PREDICTION_MARGIN):
+            self._logger.debug(f"  Prediction too close to call: {sizes}.")
+            return None
+        self._logger.debug(
+            f"  Predicting {ranked[0][0]} with {humanize.naturalsize(smallest)}."
+        )
+        return ranked[0]
+
+    def check_format_prediction(self, formats=["png", "jpg"], jpeg_compression=85):
+        # Compares the predicted format with the winner of full encodes of all
+        # candidates without changing the file. Returns both formats; the
+        # predicted one is None where the prediction was not used.
+        with self._open_image() as image:
+            stats = self._reduce_image(image)
+            candidates = self._format_candidates(stats, formats)
+            predicted = self._predict_format(image, candidates, jpeg_compression)
+            sizes = {
+                format: len(
+                    self._encode_candidate(image, format, encoder, jpeg_compression)
+                )
+                for format, encoder in candidates
+            }
+        actual = min(sizes, key=sizes.get) if sizes else None
+        return (predicted[0] if predicted is not None else None), actual
+
+    def _reduce_image(self, image):
+        # Drops what the pixels do not need before anything is encoded: an
+        # opaque alpha channel, the color channels of gray images and the
+        # unused low byte of 16 bit samples.
+        stats = pixel_stats(image)
+        self._logger.debug(f"  {stats}")
+        if image.alpha_channel and stats.opaque:
+            image.alpha_channel = "off"
+        if stats.gray and not image.alpha_channel:
+            image.type = "grayscale"
+        if stats.fits_8bit and image.depth > 8:
+            image.depth = 8
+        return stats
+
+    def _switch_format(self, format):
         self._filename = self._filename.with_suffix(f".{format}")
         self._path = self._path.with_suffix(f".{format}")
         self._metadata["preferredFileName"] = self._filename.name
         self._metadata["fileName"] = self._path.name
-        if self._path != path_original:
-            path_original.unlink()
 
-    def resize(self, max_ratio_factor=2.0):
-        max_ratio = 1.0
+    def _max_ratio(self, width, height, max_ratio_factor):
+        # The largest share of the pixels any placement shows, in either
+        # direction, times `max_ratio_factor`.
+        if not self._footprints:
+            return 1.0
+        max_ratio = max(
+            max(footprint.width / width, footprint.height / height)
+            for footprint in self._footprints
+        )
+        self._logger.debug(
+            f"{self} is placed {len(self._footprints)} time(s) on slides and "
+            f"layouts. Maximum used resolution ratio: {(max_ratio * 100.0):.1f}%."
+        )
+        return max_ratio * max_ratio_factor
 
-        if (
-            self.filename.suffix.lower() in [".png", ".jpg", ".gif", ".jpeg"]
-            and self.slide_references
-        ):
-            with Image(filename=self._path) as img:
-                height = img.size[1]
-            # TODO: original size not from YAML, but from file itself!
-            ratios = [
-                data["originalSize"]["height"] / height
-                for yaml_file, data in self.slide_references
-            ]
-            max_ratio = max(ratios)
-            self._logger.debug(
-                f"{self} is being used in "
-                f"{len(self.slide_references)} slide(s). "
-                f"Maximum used resolution ratio: "
-                f"{(max_ratio * 100.0):.1f}%."
-            )
-            max_ratio *= max_ratio_factor
+    def _rounded_footprints(self):
+        # Archives store geometry as 32 bit floats, so footprints are
+        # compared at a precision that survives saving them.
+        return [
+            [round(footprint.width, 1), round(footprint.height, 1)]
+            for footprint in self._footprints
+        ]
 
+    def _crop_fractions(self):
+        # The part of the image any placement shows, if cutting off the rest
+        # is worth it and every placement can be adapted to the cropped image.
         if (
-            self.filename.suffix.lower() in [".png", ".jpg", ".gif", ".jpeg"]
-            and self.slide_style_references
+            not self._slide_references
+            or self._slide_style_references
+            or self._duplicates
+            or len(self._footprints) != len(self._slide_references)
+            or any(
+                field in data
+                for yaml_file, data in self._slide_references
+                for field in CROP_BLOCKING_FIELDS
+            )
         ):
-            with Image(filename=self._path) as img:
-                height = img.size[1]
-            max_ratio = 1080.0 / height
+            return None
+        visible = [footprint.visible for footprint in self._footprints]
+        if None in visible:
+            return None
+        left = min(fractions[0] for fractions in visible)
+        top = min(fractions[1] for fractions in visible)
+        right = max(fractions[2] for fractions in visible)
+        bottom = max(fractions[3] for fractions in visible)
+        if (right - left) * (bottom - top) > 1.0 - CROP_MIN_GAIN:
+            return None
+        # Rounded outwards, so nothing visible gets lost.
+        return [
+            math.floor(left * 10000) / 10000,
+            math.floor(top * 10000) / 10000,
+            min(math.ceil(right * 10000) / 10000, 1.0),
+            min(math.ceil(bottom * 10000) / 10000, 1.0),
+        ]
 
-            self._logger.debug(
-                f"{self} is being used as "
-                f"master slide background. "
-                f"Maximum used resolution ratio: "
-                f"{(max_ratio * 100.0):.1f}%."
-            )
-            max_ratio *= max_ratio_factor
+    def _crop_image(self, image, crop):
+        width, height = image.size
+        left = int(width * crop[0])
+        top = int(height * crop[1])
+        right = min(math.ceil(width * crop[2]), width)
+        bottom = min(math.ceil(height * crop[3]), height)
+        self._logger.debug(
+            f"  will crop from {width} x {height} to {right - left} x "
+            f"{bottom - top} at {left}, {top}"
+        )
+        image.crop(left, top, right, bottom)
+        # The placements follow the pixels actually kept.
+        self._cropped = [left / width, top / height, right / width, bottom / height]
 
-        if max_ratio < 1.0:
-            with Image(filename=self._path) as img:
-                w = int(img.size[0] * max_ratio)
-                h = int(img.size[1] * max_ratio)
-                self._logger.debug(
-                    f"  will resize from {img.size[0]} x {img.size[1]} " f"to {w} x {h}"
-                )
-                img.resize(w, h)
-                img.save(filename=str(self._path))
-                self._size_resized = self._path.stat().st_size
-                self._size_optimized = self._size_resized
-                self._logger.debug(
-                    f"  Reducing size from "
-                    f"{humanize.naturalsize(self._size_converted)} to "
-                    f"{humanize.naturalsize(self._size_resized)} ("
-                    f"{(self.lost_weight_resized * 100.0):.1f}% "
-                    f"reduction)."
-                )
+    def _crop_placements(self, cropped):
+        for yaml_file, data in self._slide_references:
+            mask_file = self._resolution.crop_placement(data, cropped)
+            for changed in [yaml_file, mask_file]:
+                if changed is not None and changed not in self._changed_files:
+                    self._changed_files.append(changed)
+        self._footprints = [
+            self._resolution.image_footprint(data)
+            for yaml_file, data in self._slide_references
+        ]
+        # What the next run finds in the saved deck.
+        self._settings = dict(
+            self._settings, footprints=self._rounded_footprints(), crop=None
+        )
 
-    def optimize(self, jpeg_compression=85, oxipng_level=6):
-        if self.filename.suffix.lower() == ".png" and self.has_slide_references:
+    def _resize_image(self, img, max_ratio):
+        w = int(img.size[0] * max_ratio)
+        h = int(img.size[1] * max_ratio)
+        self._logger.debug(
+            f"  will resize from {img.size[0]} x {img.size[1]} " f"to {w} x {h}"
+        )
+        img.resize(w, h)
+
+    def _optimize_blob(
+        self, blob, jpeg_compression, oxipng_level, target_ssim=None, image=None
+    ):
+        if not self.has_slide_references:
+            return blob
+        with self._span("optimize", bytes_in=len(blob)) as span:
+            blob_optimized = self._optimize_best_blob(
+                blob, jpeg_compression, oxipng_level, target_ssim, image, span
+            )
+            span.set(bytes_out=len(blob_optimized))
+        return blob_optimized
+
+    def _optimize_best_blob(
+        self, blob, jpeg_compression, oxipng_level, target_ssim, image, span
+    ):
+        if self.filename.suffix.lower() == ".png":
             self._logger.debug(f"{self} will be optimized via Oxipng…")
-            oxipng.optimize(self._path, self._path, level=oxipng_level)
-            self._size_optimized = self._path.stat().st_size
-        elif (
-            self.filename.suffix.lower() == ".jpeg"
-            or self.filename.suffix.lower() == ".jpg"
-        ) and self.has_slide_references:
-            self._logger.debug(f"{self} will be optimized via MozJPEG…")
-            tmp_file = str(uuid.uuid4()) + ".jpg"
-            path_tmp_file = self._path.parent / tmp_file
-            try:
-                r = subprocess.run(
-                    f"cjpeg -quality {jpeg_compression} "
-                    f'-outfile "{tmp_file}" '
-                    f'"{self._path.name}"',
-                    shell=True,
-                    capture_output=True,
-                    cwd=self._path.parent,
-                    timeout=20,
-                )
-            except subprocess.TimeoutExpired:
-                self._logger.error(f"cjpeg aborted due to timeout on " f"{self}:")
-                self._logger.error(r.stderr.decode())
-            if r.returncode != 0:
-                self._logger.error(f"cjpeg was unable to run on {self}:")
-                self._logger.error(r.stderr.decode())
+            span.set(tool="oxipng")
+            if image is not None:
+                # The image in memory may be resized already, the file on
+                # disk is not.
+                pixels = image.width * image.height
+            elif self.info is not None:
+                pixels = self.info.width * self.info.height
             else:
-                size_tmp = path_tmp_file.stat().st_size
-                if size_tmp < (self._size_resized * 0.98):
-                    path_tmp_file.rename(self._path)
-                    self._size_optimized = self._path.stat().st_size
-            if path_tmp_file.exists():
-                path_tmp_file.unlink()
-        elif self.filename.suffix.lower() == ".pdf" and self.has_slide_references:
-            self._logger.debug(f"{self} will be optimized via pdfsizeopt…")
-            tmp_file = str(uuid.uuid4()) + ".pdf"
-            path_tmp_file = self._path.parent / tmp_file
-            try:
-                r = subprocess.run(
-                    f'"/Users/fkruse/Documents/Point 8/fkruse/pdfsizeopt/'
-                    f'pdfsizeopt" '
-                    f'"{self._path.name}" '
-                    f'"{tmp_file}" ',
-                    shell=True,
-                    capture_output=True,
-                    cwd=self._path.parent,
-                    timeout=60,
-                )
-            except subprocess.TimeoutExpired:
-                self._logger.error(f"pdfsizeopt aborted due to timeout on " f"{self}:")
-                self._logger.error(r.stderr.decode())
-            if r.returncode != 0:
-                self._logger.error(f"pdfsizeopt was unable to run on {self}:")
-                self._logger.error(r.stderr.decode())
+                pixels = None
+            blob_optimized = get_png_optimizer(self._resources).optimize(
+                blob, level=oxipng_level, pixels=pixels, label=self
+            )
+            if len(blob_optimized) < len(blob):
+                self._size_optimized = len(blob_optimized)
+                return blob_optimized
+        elif self._is_jpeg:
+            encoder = get_jpeg_encoder(self._resources)
+            self._logger.debug(f"{self} will be optimized via {encoder.name}…")
+            span.set(tool=encoder.name)
+            if image is None:
+                try:
+                    with Image(blob=blob) as image:
+                        blob_optimized = self._encode_jpeg(
+                            encoder, image, jpeg_compression, target_ssim, span
+                        )
+                except WandException as exc:
+                    self._logger.error(f"Unable to decode {self}: {exc}")
+                    return blob
             else:
-                size_tmp = path_tmp_file.stat().st_size
-                if size_tmp < (self._size_resized * 0.98):
-                    path_tmp_file.rename(self._path)
-                    self._size_optimized = self._path.stat().st_size
-            if path_tmp_file.exists():
-                path_tmp_file.unlink()
+                blob_optimized = self._encode_jpeg(
+                    encoder, image, jpeg_compression, target_ssim, span
+                )
+            if blob_optimized is not None and len(blob_optimized) < (
+                self._size_resized * 0.98
+            ):
+                self._size_optimized = len(blob_optimized)
+                return blob_optimized
+        return blob
+
+    def _encode_jpeg(self, encoder, image, jpeg_compression, target_ssim, span):
+        if target_ssim is None:
+            return encoder.encode(image, jpeg_compression, self)
+        return self._search_jpeg(encoder, image, target_ssim, span)
+
+    def _search_jpeg(self, encoder, image, target_ssim, span):
+        # Lowest quality whose result still meets the SSIM target against the
+        # decoded pixels; a handful of encodes thanks to the bisection.
+        reference = image_luma(image)
+
+        def score(candidate):
+            with Image(blob=candidate) as decoded:
+                return ssim(reference, image_luma(decoded))
+
+        result = search_jpeg_quality(
+            lambda quality: encoder.encode(image, quality, self), score, target_ssim
+        )
+        if result is None:
+            self._logger.debug(
+                f"{self} does not reach SSIM {target_ssim} with any quality."
+            )
+            return None
+        quality, blob_optimized = result
+        self._logger.debug(f"{self} meets SSIM {target_ssim} at quality {quality}.")
+        span.set(quality=quality)
+        return blob_optimized
+
+    def _log_resized(self):
+        self._logger.debug(
+            f"  Reducing size from "
+            f"{humanize.naturalsize(self._size_converted)} to "
+            f"{humanize.naturalsize(self._size_resized)} ("
+            f"{(self.lost_weight_resized * 100.0):.1f}% "
+            f"reduction)."
+        )
 
+    def _log_optimized(self):
         if self._size_optimized != self._size_resized:
             self._logger.debug(
                 f"  Reducing size from "
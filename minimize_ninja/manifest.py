@@ -0,0 +1,69 @@
+import json
+import threading
+
+MANIFEST_NAME = "Metadata/MinimizeNinja.json"
+MANIFEST_VERSION = 1
+
+
+def normalize_settings(settings):
+    # Settings as they read back from JSON, so fresh and stored ones compare.
+    return json.loads(json.dumps(settings, sort_keys=True))
+
+
+class Manifest(object):
+    # Records, per file in Data/, the digest of the slimmed file and the
+    # settings it was slimmed with. It is stored inside the Keynote package,
+    # so a later run can skip every image that has not changed since.
+    def __init__(self, entries=None):
+        self._entries = entries if entries is not None else {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Manifest({len(self._entries)} entries)"
+
+    @classmethod
+    def from_buffer(cls, content):
+        try:
+            manifest = json.loads(content)
+        except ValueError:
+            return cls()
+        if manifest.get("version") != MANIFEST_VERSION:
+            return cls()
+        return cls(manifest.get("files", {}))
+
+    @classmethod
+    def load(cls, path):
+        if not path.exists():
+            return cls()
+        return cls.from_buffer(path.read_bytes())
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def matches(self, name, digest, settings):
+        entry = self._entries.get(name)
+        return (
+            entry is not None
+            and entry["digest"] == digest
+            and entry["settings"] == normalize_settings(settings)
+        )
+
+    def record(self, name, digest, settings):
+        with self._lock:
+            self._entries[name] = dict(
+                digest=digest, settings=normalize_settings(settings)
+            )
+
+    def save(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(
+                dict(version=MANIFEST_VERSION, files=self._entries),
+                file,
+                indent=1,
+                sort_keys=True,
+            )
+
+    @property
+    def entries(self):
+        return self._entries
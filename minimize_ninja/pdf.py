@@ -0,0 +1,247 @@
+import hashlib
+import math
+import zlib
+from io import BytesIO
+
+from minimize_ninja.backends import load_backend
+
+# Form XObjects nested deeper than this are not followed any further.
+MAX_FORM_DEPTH = 8
+
+# Raw sample formats Wand reads and writes, per PDF color space.
+RAW_FORMATS = {"/DeviceRGB": "rgb", "/DeviceGray": "gray"}
+
+FONT_FILE_KEYS = ["/FontFile", "/FontFile2", "/FontFile3"]
+
+
+def multiply(first, second):
+    # Product of two PDF transformation matrices [a b c d e f].
+    a, b, c, d, e, f = first
+    a2, b2, c2, d2, e2, f2 = second
+    return [
+        a * a2 + b * c2,
+        a * b2 + b * d2,
+        c * a2 + d * c2,
+        c * b2 + d * d2,
+        e * a2 + f * c2 + e2,
+        e * b2 + f * d2 + f2,
+    ]
+
+
+def page_size(page):
+    x0, y0, x1, y1 = (float(value) for value in page.mediabox)
+    width, height = abs(x1 - x0), abs(y1 - y0)
+    if int(page.obj.get("/Rotate", 0)) % 180:
+        return height, width
+    return width, height
+
+
+class PdfOptimizer(object):
+    # Slims PDF assets in memory with pikepdf: raster images are scaled down
+    # to the resolution they are drawn at, identical embedded font programs
+    # are stored once, unused resources and objects are dropped and all
+    # streams are compressed again. Runs in the calling worker thread.
+    def __init__(self, resources):
+        self._resources = resources
+        self._logger = resources["logger"]
+
+    def __repr__(self):
+        return "PdfOptimizer()"
+
+    def optimize(self, blob, target_sizes=(), jpeg_compression=85, label=None):
+        # `target_sizes` are the (width, height) in pixels the first page is
+        # shown at; without any, images keep their resolution.
+        pikepdf = load_backend("pdf")
+        try:
+            with pikepdf.open(BytesIO(blob)) as pdf:
+                if target_sizes:
+                    self._downsample_images(
+                        pikepdf, pdf, target_sizes, jpeg_compression, label
+                    )
+                self._deduplicate_fonts(pikepdf, pdf, label)
+                pdf.remove_unreferenced_resources()
+                stream = BytesIO()
+                pdf.save(
+                    stream,
+                    compress_streams=True,
+                    recompress_flate=True,
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                )
+        except pikepdf.PdfError as exc:
+            self._logger.error(f"Unable to optimize {label}: {exc}")
+            return blob
+        return stream.getvalue()
+
+    def _downsample_images(self, pikepdf, pdf, target_sizes, jpeg_compression, label):
+        # Pages share the scale of the first page, as Keynote places them all
+        # the same way.
+        width, height = page_size(pdf.pages[0])
+        pixels_per_point = max(
+            max(target_width / width, target_height / height)
+            for target_width, target_height in target_sizes
+        )
+        drawn = {}
+        for page in pdf.pages:
+            self._trace(
+                pikepdf,
+                page.obj,
+                page.obj.get("/Resources"),
+                [1.0, 0.0, 0.0, 1.0, 0.0, 0.0],
+                drawn,
+                0,
+            )
+        for xobject, (width, height) in drawn.values():
+            self._downsample(
+                pikepdf,
+                xobject,
+                math.ceil(width * pixels_per_point),
+                math.ceil(height * pixels_per_point),
+                jpeg_compression,
+                label,
+            )
+
+    def _trace(self, pikepdf, content, resources, ctm, drawn, depth):
+        # Follows the transformations of a content stream and records, per
+        # image XObject, the largest size in page points it is drawn at.
+        xobjects = resources.get("/XObject", {}) if resources is not None else {}
+        stack = []
+        for operands, operator in pikepdf.parse_content_stream(content):
+            operator = str(operator)
+            if operator == "q":
+                stack.append(ctm)
+            elif operator == "Q" and stack:
+                ctm = stack.pop()
+            elif operator == "cm":
+                ctm = multiply([float(value) for value in operands], ctm)
+            elif operator == "Do":
+                xobject = xobjects.get(str(operands[0]))
+                if xobject is None:
+                    continue
+                subtype = xobject.get("/Subtype")
+                if subtype == "/Image":
+                    width = math.hypot(ctm[0], ctm[1])
+                    height = math.hypot(ctm[2], ctm[3])
+                    _, size = drawn.get(xobject.objgen, (None, (0.0, 0.0)))
+                    drawn[xobject.objgen] = (
+                        xobject,
+                        (max(size[0], width), max(size[1], height)),
+                    )
+                elif subtype == "/Form" and depth < MAX_FORM_DEPTH:
+                    matrix = [float(value) for value in xobject.get("/Matrix", [])]
+                    self._trace(
+                        pikepdf,
+                        xobject,
+                        xobject.get("/Resources", resources),
+                        multiply(matrix, ctm) if len(matrix) == 6 else ctm,
+                        drawn,
+                        depth + 1,
+                    )
+
+    def _is_plain_image(self, xobject):
+        # 8 bit RGB or gray samples without masks or decode arrays, which
+        # scale without touching anything else.
+        return (
+            str(xobject.get("/ColorSpace")) in RAW_FORMATS
+            and int(xobject.get("/BitsPerComponent", 0)) == 8
+            and not xobject.get("/ImageMask", False)
+            and "/Mask" not in xobject
+            and "/Decode" not in xobject
+            and xobject.get("/Filter") in (None, "/FlateDecode", "/DCTDecode")
+        )
+
+    def _downsample(self, pikepdf, xobject, width, height, jpeg_compression, label):
+        from wand.exceptions import WandException
+
+        if not self._is_plain_image(xobject):
+            return
+        width_original = int(xobject.Width)
+        height_original = int(xobject.Height)
+        ratio = max(width / width_original, height / height_original)
+        if ratio >= 1.0:
+            return
+        width = max(int(width_original * ratio), 1)
+        height = max(int(height_original * ratio), 1)
+        smask = xobject.get("/SMask")
+        if smask is not None and not (
+            self._is_plain_image(smask)
+            and (int(smask.Width), int(smask.Height))
+            == (width_original, height_original)
+        ):
+            return
+        try:
+            scaled = [
+                (stream, self._scaled(pikepdf, stream, width, height, jpeg_compression))
+                for stream in [xobject] + ([smask] if smask is not None else [])
+            ]
+        except (pikepdf.PdfError, WandException, ValueError) as exc:
+            self._logger.debug(f"{label}: unable to scale an image: {exc}")
+            return
+        if sum(len(data) for stream, (data, _) in scaled) >= sum(
+            len(stream.read_raw_bytes()) for stream, _ in scaled
+        ):
+            return
+        self._logger.debug(
+            f"{label}: scaling an image from {width_original} x "
+            f"{height_original} to {width} x {height}"
+        )
+        for stream, (data, filter) in scaled:
+            stream.write(data, filter=filter)
+            if "/DecodeParms" in stream:
+                del stream["/DecodeParms"]
+            stream.Width = width
+            stream.Height = height
+
+    def _scaled(self, pikepdf, stream, width, height, jpeg_compression):
+        # The samples of an image XObject scaled to width x height, encoded
+        # with the filter it had before, and that filter.
+        Image = load_backend("image").Image
+        if stream.get("/Filter") == "/DCTDecode":
+            with Image(blob=stream.read_raw_bytes()) as image:
+                image.resize(width, height)
+                image.format = "jpg"
+                image.compression_quality = jpeg_compression
+                return image.make_blob(), pikepdf.Name.DCTDecode
+        format = RAW_FORMATS[str(stream.ColorSpace)]
+        with Image(
+            blob=stream.read_bytes(),
+            format=format,
+            width=int(stream.Width),
+            height=int(stream.Height),
+            depth=8,
+        ) as image:
+            image.resize(width, height)
+            image.format = format
+            image.depth = 8
+            return zlib.compress(image.make_blob(), 9), pikepdf.Name.FlateDecode
+
+    def _deduplicate_fonts(self, pikepdf, pdf, label):
+        # Documents combined from several sources often embed the very same
+        # font program once per source.
+        kept = {}
+        merged = 0
+        for obj in pdf.objects:
+            if not isinstance(obj, pikepdf.Dictionary):
+                continue
+            if obj.get("/Type") != "/FontDescriptor":
+                continue
+            for key in FONT_FILE_KEYS:
+                font_file = obj.get(key)
+                if font_file is None or not font_file.is_indirect:
+                    continue
+                digest = hashlib.sha256(font_file.read_raw_bytes())
+                for name in sorted(font_file.keys()):
+                    if name != "/Length":
+                        digest.update(f"{name}={font_file[name]!r}".encode())
+                survivor = kept.setdefault((key, digest.hexdigest()), font_file)
+                if survivor.objgen != font_file.objgen:
+                    obj[key] = survivor
+                    merged += 1
+        if merged:
+            self._logger.debug(f"{label}: merged {merged} duplicate font program(s)")
+
+
+def get_pdf_optimizer(resources):
+    optimizer = resources.get("pdf_optimizer")
+    if optimizer is None:
+        optimizer = resources.setdefault("pdf_optimizer", PdfOptimizer(resources))
+    return optimizer
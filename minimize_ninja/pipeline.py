@@ -0,0 +1,295 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from tqdm import tqdm
+
+from minimize_ninja.common import converts, get_tracer
+from minimize_ninja.events import (
+    DeckFinished,
+    ImageDone,
+    ImagesPruned,
+    StageFinished,
+    StageStarted,
+)
+
+# Settings (resize_factor, jpeg_compression, png_convert) of the quality
+# levels 1–3 of `mn slim --quality`.
+QUALITY_LEVELS = {
+    1: (2.0, 80, True),
+    2: (1.5, 75, True),
+    3: (1.0, 70, True),
+}
+
+# Settings of `mn slim` without --quality, followed by the quality levels.
+ANALYSIS_LEVELS = {0: (2.0, 85, False), **QUALITY_LEVELS}
+
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+
+class MemoryBudget(object):
+    # Admits images to processing only while the estimated memory of all
+    # images in flight stays below the budget. An image larger than the whole
+    # budget is admitted as soon as it would be the only one in flight.
+    def __init__(self, max_memory):
+        self._max_memory = max_memory
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return f"MemoryBudget({self._in_use}/{self._max_memory})"
+
+    def acquire(self, cost):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._in_use == 0 or self._in_use + cost <= self._max_memory
+            )
+            self._in_use += cost
+
+    def release(self, cost):
+        with self._condition:
+            self._in_use -= cost
+            self._condition.notify_all()
+
+    @property
+    def max_memory(self):
+        return self._max_memory
+
+
+def image_settings(
+    image,
+    png_convert=False,
+    resize_factor=2.0,
+    jpeg_compression=85,
+    target_ssim=None,
+    crop=False,
+):
+    return dict(
+        convert=converts(image.filename.suffix, png_convert),
+        png_convert=png_convert,
+        resize_factor=resize_factor,
+        jpeg_compression=jpeg_compression,
+        target_ssim=target_ssim,
+        crop=crop,
+    )
+
+
+def process_image(
+    image,
+    convert=False,
+    png_convert=False,
+    resize_factor=2.0,
+    jpeg_compression=85,
+    target_ssim=None,
+    crop=False,
+):
+    budget = image.resources.get("memory_budget")
+    cost = image.memory_cost if budget is not None else 0
+    if budget is not None:
+        budget.acquire(cost)
+    try:
+        cpu_time = time.thread_time()
+        image.process(
+            convert=convert,
+            # TIFFs have always been test-converted with the default JPEG quality.
+            convert_jpeg_compression=85 if "tif" in image.filename.suffix else None,
+            jpeg_compression=jpeg_compression,
+            max_ratio_factor=resize_factor,
+            target_ssim=target_ssim,
+            crop=crop,
+            png_convert=png_convert,
+        )
+        image.cpu_time = time.thread_time() - cpu_time
+    finally:
+        if budget is not None:
+            budget.release(cost)
+    for duplicate in image.duplicates:
+        duplicate.adopt(image)
+    return image
+
+
+def slim_deck_events(
+    kf,
+    executor,
+    dedup=True,
+    keep_unpacked=False,
+    png_convert=False,
+    resize_factor=2.0,
+    jpeg_compression=85,
+    target_ssim=None,
+    prune=False,
+    crop=False,
+):
+    # Unpacks, slims and repacks a single deck, but hands the images to a
+    # shared executor, so several decks can be in flight at the same time.
+    # Yields the events of minimize_ninja.events as the work progresses.
+    # Closing the generator cancels the images not started yet, waits for
+    # the running ones and cleans up.
+    tracer = get_tracer(kf.resources)
+    start = time.time()
+    futures = []
+    pruned = []
+    try:
+        yield StageStarted("unpack")
+        kf.unpack()
+        images_dict = kf.images_dict
+        if dedup:
+            with tracer.span("deduplicate"):
+                kf.deduplicate()
+        if prune:
+            with tracer.span("prune"):
+                pruned = kf.prune()
+        kf.link_references()
+        yield StageFinished("unpack", time.time() - start, len(images_dict))
+        if pruned:
+            yield ImagesPruned(
+                [image.filename.name for image in pruned],
+                sum(image.size_original for image in pruned),
+            )
+
+        yield StageStarted("images")
+        stage = time.time()
+        with tracer.span("images", images=len(images_dict)):
+            futures = [
+                executor.submit(
+                    process_image,
+                    image,
+                    **image_settings(
+                        image,
+                        png_convert,
+                        resize_factor,
+                        jpeg_compression,
+                        target_ssim,
+                        crop,
+                    ),
+                )
+                for image in images_dict.values()
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                image = future.result()
+                yield ImageDone(
+                    image.filename.name,
+                    done,
+                    len(futures),
+                    image.size_original,
+                    image.size_optimized,
+                    image.unchanged,
+                )
+        yield StageFinished("images", time.time() - stage, len(images_dict))
+
+        yield StageStarted("repack")
+        stage = time.time()
+        kf.save_placements()
+        kf.metadata.save()
+        kf.repack()
+        yield StageFinished("repack", time.time() - stage, len(images_dict))
+    finally:
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        if not keep_unpacked:
+            shutil.rmtree(kf.path_unpacked, ignore_errors=True)
+    yield DeckFinished(
+        len(images_dict),
+        sum(image.unchanged for image in images_dict.values()),
+        len(pruned),
+        kf.path_keynote.stat().st_size,
+        kf.path_repacked.stat().st_size,
+        time.time() - start,
+    )
+
+
+def slim_deck(kf, executor, progress=None, **settings):
+    # Runs slim_deck_events() to the end, handing each event to `progress`.
+    for event in slim_deck_events(kf, executor, **settings):
+        if progress is not None:
+            progress(event)
+    return event._asdict()
+
+
+def slim_decks(kfs, jobs=None, max_decks=2, **settings):
+    # All decks share one pool of image workers. At most `max_decks` decks are
+    # unpacked at the same time, which bounds the disk usage, while one deck
+    # is being unpacked or repacked the others keep the image workers busy.
+    if jobs is None:
+        jobs = default_jobs()
+    results = {}
+    with (
+        ThreadPoolExecutor(max_workers=jobs) as executor,
+        ThreadPoolExecutor(max_workers=max_decks) as deck_executor,
+    ):
+        futures = {
+            deck_executor.submit(slim_deck, kf, executor, **settings): kf for kf in kfs
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            kf = futures[future]
+            try:
+                results[kf] = future.result()
+            except Exception as exc:
+                results[kf] = dict(error=str(exc))
+    return [(kf, results[kf]) for kf in kfs]
+
+
+def analysis_levels(image):
+    return {
+        level: image_settings(image, png_convert, resize_factor, jpeg_compression)
+        for level, (resize_factor, jpeg_compression, png_convert) in (
+            ANALYSIS_LEVELS.items()
+        )
+    }
+
+
+def estimate_image(image, levels, tile_size=256):
+    budget = image.resources.get("memory_budget")
+    cost = image.memory_cost if budget is not None else 0
+    if budget is not None:
+        budget.acquire(cost)
+    try:
+        return image.estimate(levels, tile_size=tile_size)
+    finally:
+        if budget is not None:
+            budget.release(cost)
+
+
+def analyze_deck(kf, jobs=None, tile_size=256):
+    # Estimates the savings of every quality level without touching Data/ or
+    # repacking: the deck is opened in streaming mode, so only the Index
+    # archives are extracted, and byte-identical images are estimated once.
+    if jobs is None:
+        jobs = default_jobs()
+    start = time.time()
+    kf.unpack()
+    try:
+        images = list(kf.images_dict.values())
+        kf.link_references()
+        survivors = {}
+        duplicates = {}
+        for image in images:
+            survivor = survivors.setdefault(image.digest, image)
+            if survivor is not image:
+                duplicates[image] = survivor
+
+        estimates = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(
+                    estimate_image, image, analysis_levels(image), tile_size
+                ): image
+                for image in survivors.values()
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                estimates[futures[future]] = future.result()
+    finally:
+        shutil.rmtree(kf.path_unpacked, ignore_errors=True)
+    for image, survivor in duplicates.items():
+        estimates[image] = estimates[survivor]
+    return dict(
+        images=[(image, estimates[image]) for image in images],
+        duplicates=duplicates,
+        size_original=kf.path_keynote.stat().st_size,
+        seconds=time.time() - start,
+    )
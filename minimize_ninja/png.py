@@ -0,0 +1,157 @@
+import threading
+import time
+
+from minimize_ninja.backends import load_backend
+
+# Levels tried one after the other when optimizing within a time budget.
+OXIPNG_LADDER = [1, 2, 4, 6]
+
+# Rough running time of each oxipng level relative to level 1, used to
+# predict whether the next level still fits into the budget.
+OXIPNG_LEVEL_COST = {0: 0.25, 1: 1.0, 2: 2.2, 3: 5.3, 4: 5.7, 5: 11.0, 6: 14.0}
+
+# Above this size, filters are evaluated with a fast compressor first.
+LARGE_PNG_PIXELS = 8 * 1024 * 1024
+
+
+class OxipngStats(object):
+    # Time and bytes saved per oxipng level, shared by all optimizers of a run.
+    def __init__(self):
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def record(self, level, seconds, saved):
+        with self._lock:
+            entry = self._levels.setdefault(level, dict(runs=0, seconds=0.0, saved=0))
+            entry["runs"] += 1
+            entry["seconds"] += seconds
+            entry["saved"] += saved
+
+    @property
+    def levels(self):
+        with self._lock:
+            return {level: dict(entry) for level, entry in sorted(self._levels.items())}
+
+
+class PngOptimizer(object):
+    # Without budgets every PNG is optimized once at the requested level.
+    # With a budget per image and/or per deck, the levels of OXIPNG_LADDER are
+    # climbed one by one as long as the predicted time of the next level fits
+    # into what is left and the previous level still gained at least
+    # `min_gain` of the size.
+    def __init__(
+        self,
+        resources,
+        image_budget=None,
+        deck_budget=None,
+        min_gain=0.005,
+        stats=None,
+    ):
+        self._resources = resources
+        self._logger = resources["logger"]
+        self._image_budget = image_budget
+        self._deck_budget = deck_budget
+        self._min_gain = min_gain
+        self._stats = stats if stats is not None else OxipngStats()
+        self._spent = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"PngOptimizer(image_budget={self._image_budget}, "
+            f"deck_budget={self._deck_budget}, spent={self._spent:.1f})"
+        )
+
+    def for_deck(self):
+        # Same settings and statistics, but a fresh deck budget.
+        return PngOptimizer(
+            self._resources,
+            image_budget=self._image_budget,
+            deck_budget=self._deck_budget,
+            min_gain=self._min_gain,
+            stats=self._stats,
+        )
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @property
+    def settings(self):
+        return dict(
+            image_budget=self._image_budget,
+            deck_budget=self._deck_budget,
+            min_gain=self._min_gain,
+        )
+
+    def optimize(self, blob, level=6, pixels=None, label=None):
+        if self._image_budget is None and self._deck_budget is None:
+            return self._run(blob, level, None, False)
+
+        large = pixels is not None and pixels > LARGE_PNG_PIXELS
+        ladder = [rung for rung in OXIPNG_LADDER if rung < level] + [level]
+        start = time.perf_counter()
+        best = blob
+        last = None
+        for rung in ladder:
+            remaining = self._remaining(start)
+            if last is not None:
+                last_rung, last_seconds, gain = last
+                if gain < self._min_gain:
+                    self._logger.debug(
+                        f"{label}: level {last_rung} gained only "
+                        f"{gain * 100.0:.2f} %, stopping."
+                    )
+                    break
+                predicted = (
+                    last_seconds
+                    * OXIPNG_LEVEL_COST[rung]
+                    / OXIPNG_LEVEL_COST[last_rung]
+                )
+                if remaining is not None and predicted > remaining:
+                    self._logger.debug(
+                        f"{label}: level {rung} would take ~{predicted:.1f} s, "
+                        f"only {remaining:.1f} s left, stopping."
+                    )
+                    break
+            elif remaining is not None and remaining <= 0:
+                # Budget used up: only the cheapest level with a short deadline.
+                remaining = 1
+            seconds = time.perf_counter()
+            optimized = self._run(best, rung, remaining, large)
+            seconds = time.perf_counter() - seconds
+            gain = 1.0 - len(optimized) / len(best)
+            if len(optimized) < len(best):
+                best = optimized
+            last = (rung, seconds, gain)
+        return best
+
+    def _run(self, blob, level, timeout, large):
+        start = time.perf_counter()
+        optimized = load_backend("png").optimize_from_memory(
+            blob,
+            level=level,
+            fast_evaluation=large,
+            timeout=max(int(timeout), 1) if timeout is not None else None,
+        )
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._spent += seconds
+        self._stats.record(level, seconds, max(len(blob) - len(optimized), 0))
+        return optimized
+
+    def _remaining(self, start):
+        remaining = []
+        if self._image_budget is not None:
+            remaining.append(self._image_budget - (time.perf_counter() - start))
+        if self._deck_budget is not None:
+            with self._lock:
+                remaining.append(self._deck_budget - self._spent)
+        return min(remaining) if remaining else None
+
+
+def get_png_optimizer(resources):
+    optimizer = resources.get("png_optimizer")
+    if optimizer is None:
+        optimizer = resources.setdefault("png_optimizer", PngOptimizer(resources))
+    return optimizer
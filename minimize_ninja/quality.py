@@ -0,0 +1,153 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Range of JPEG qualities searched for the lowest quality meeting an SSIM
+# target.
+JPEG_QUALITY_MIN = 30
+JPEG_QUALITY_MAX = 95
+
+# Stop the search as soon as a quality lands this close above the target.
+SSIM_TOLERANCE = 0.002
+
+# Stabilizing constants of SSIM for 8 bit data.
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+
+
+# Facts about the pixels that decide which encodings are worth trying.
+# `colors` is the number of distinct RGBA values, or a lower bound once it is
+# above the limit a palette can hold; None for true 16 bit images.
+PixelStats = namedtuple(
+    "PixelStats", ["opaque", "binary_alpha", "gray", "colors", "fits_8bit"]
+)
+
+PALETTE_COLORS = 256
+
+# pixel_stats() exports and analyses this many pixels at a time, which keeps
+# its working set small next to the decoded image.
+BAND_PIXELS = 1 << 20
+
+
+def raw_bands(image, depth):
+    # Raw RGBA samples of a Wand image, as blobs of consecutive rows.
+    rows = max(BAND_PIXELS // max(image.width, 1), 1)
+    for top in range(0, image.height, rows):
+        with image.clone() as band:
+            if rows < image.height:
+                band.crop(0, top, image.width, min(top + rows, image.height))
+            band.depth = depth
+            band.format = "rgba"
+            yield band.make_blob()
+
+
+def pixel_stats(image):
+    # Single pass over the raw RGBA samples of a Wand image, band by band.
+    # Images without an alpha channel are exported fully opaque.
+    depth = 16 if image.depth > 8 else 8
+    opaque = binary_alpha = gray = fits_8bit = True
+    colors = np.empty(0, dtype=np.uint32)
+    for blob in raw_bands(image, depth):
+        samples = np.frombuffer(blob, dtype=np.uint8 if depth == 8 else np.uint16)
+        samples = samples.reshape(-1, 4)
+        if depth == 16 and fits_8bit:
+            # A 16 bit sample carries 8 bits if both of its bytes are equal,
+            # which holds regardless of the byte order of the export.
+            low = samples & 0xFF
+            fits_8bit = bool(np.all(samples >> 8 == low))
+            if fits_8bit:
+                samples = low.astype(np.uint8)
+        maximum = np.iinfo(samples.dtype).max
+        alpha = samples[:, 3]
+        opaque = opaque and bool(np.all(alpha == maximum))
+        binary_alpha = binary_alpha and (
+            opaque or bool(np.all((alpha == 0) | (alpha == maximum)))
+        )
+        gray = gray and bool(
+            np.all(samples[:, 0] == samples[:, 1])
+            and np.all(samples[:, 1] == samples[:, 2])
+        )
+        if fits_8bit and len(colors) <= PALETTE_COLORS:
+            packed = np.ascontiguousarray(samples).view(np.uint32).ravel()
+            # A strided sample rules out most photos before the full count.
+            colors = np.union1d(colors, packed[:: max(len(packed) // 65536, 1)])
+            if len(colors) <= PALETTE_COLORS:
+                colors = np.union1d(colors, packed)
+    return PixelStats(
+        opaque, binary_alpha, gray, len(colors) if fits_8bit else None, fits_8bit
+    )
+
+
+def image_luma(image):
+    # Luma (BT.601) of a Wand image as float32 array; alpha is ignored.
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:
+        return pixels.astype(np.float32)
+    if pixels.shape[2] < 3:
+        return pixels[:, :, 0].astype(np.float32)
+    return (
+        0.299 * pixels[:, :, 0].astype(np.float32)
+        + 0.587 * pixels[:, :, 1].astype(np.float32)
+        + 0.114 * pixels[:, :, 2].astype(np.float32)
+    )
+
+
+def window_means(values, window):
+    # Means of all window x window blocks via a summed-area table.
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=table[1:, 1:])
+    sums = (
+        table[window:, window:]
+        - table[:-window, window:]
+        - table[window:, :-window]
+        + table[:-window, :-window]
+    )
+    return sums / (window * window)
+
+
+def ssim(reference, candidate, window=8):
+    # Mean structural similarity of two luma arrays over sliding windows.
+    if reference.shape != candidate.shape:
+        return 0.0
+    window = min(window, *reference.shape)
+    mean_reference = window_means(reference, window)
+    mean_candidate = window_means(candidate, window)
+    variance_reference = window_means(reference * reference, window) - mean_reference**2
+    variance_candidate = window_means(candidate * candidate, window) - mean_candidate**2
+    covariance = (
+        window_means(reference * candidate, window) - mean_reference * mean_candidate
+    )
+    ssim_map = ((2 * mean_reference * mean_candidate + C1) * (2 * covariance + C2)) / (
+        (mean_reference**2 + mean_candidate**2 + C1)
+        * (variance_reference + variance_candidate + C2)
+    )
+    return float(ssim_map.mean())
+
+
+def search_jpeg_quality(
+    encode,
+    score,
+    target,
+    low=JPEG_QUALITY_MIN,
+    high=JPEG_QUALITY_MAX,
+    tolerance=SSIM_TOLERANCE,
+):
+    # Bisects for the lowest quality whose encoding scores at least `target`.
+    # `encode(quality)` returns the encoded blob (or None on failure) and
+    # `score(blob)` its similarity to the source. Returns (quality, blob) or
+    # None if not even `high` meets the target.
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        blob = encode(quality)
+        if blob is None:
+            return best
+        value = score(blob)
+        if value >= target:
+            best = (quality, blob)
+            if value - target < tolerance:
+                break
+            high = quality - 1
+        else:
+            low = quality + 1
+    return best
@@ -0,0 +1,423 @@
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from minimize_ninja.api import deck_resources
+from minimize_ninja.events import event_name
+from minimize_ninja.keynote import KeynoteFile
+from minimize_ninja.pipeline import QUALITY_LEVELS, default_jobs, slim_deck
+
+# Finished jobs and their results are removed after this many seconds.
+RESULT_TTL = 3600
+
+# Size of the chunks in which uploads and results are copied.
+CHUNK_SIZE = 1024 * 1024
+
+
+def safe_filename(name):
+    # The base name of a client-supplied file name, restricted to characters
+    # that cannot break out of a quoted header value.
+    return re.sub(r"[^\w.\- ]", "_", Path(name).name, flags=re.ASCII)
+
+
+class JobError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def job_settings(query):
+    # Slimming settings of a job from the query string of its upload, with
+    # the same defaults and quality levels as `mn slim`.
+    def value(name, convert, default):
+        if name not in query:
+            return default
+        try:
+            return convert(query[name][-1])
+        except ValueError:
+            raise JobError(HTTPStatus.BAD_REQUEST, f"Invalid value for {name}.")
+
+    def flag(text):
+        if text.lower() not in ("1", "0", "true", "false", "yes", "no"):
+            raise ValueError(text)
+        return text.lower() in ("1", "true", "yes")
+
+    quality = value("quality", int, 0)
+    if quality not in range(0, 4):
+        raise JobError(HTTPStatus.BAD_REQUEST, "quality must be between 0 and 3.")
+    settings = dict(
+        dedup=value("dedup", flag, True),
+        prune=value("prune", flag, False),
+        crop=value("crop", flag, False),
+        png_convert=value("png_convert", flag, False),
+        resize_factor=value("resize_factor", float, 2.0),
+        jpeg_compression=value("jpeg_compression", int, 85),
+        target_ssim=value("target_ssim", float, None),
+    )
+    if quality in QUALITY_LEVELS:
+        (
+            settings["resize_factor"],
+            settings["jpeg_compression"],
+            settings["png_convert"],
+        ) = QUALITY_LEVELS[quality]
+    if settings["target_ssim"] is not None and not 0.0 < settings["target_ssim"] <= 1:
+        raise JobError(HTTPStatus.BAD_REQUEST, "target_ssim must be in (0, 1].")
+    return settings
+
+
+class Job(object):
+    # A single uploaded deck. Every state change and processed image is
+    # appended to `events`, which any number of clients can follow.
+    def __init__(self, path, name, settings):
+        self._id = uuid.uuid4().hex
+        self._path = path
+        self._name = name
+        self._settings = settings
+        self._status = "queued"
+        self._result = None
+        self._finished = None
+        self._events = []
+        self._condition = threading.Condition()
+        self.emit("queued")
+
+    def __repr__(self):
+        return f"Job({self._id}, {self._name}, {self._status})"
+
+    def emit(self, event, **data):
+        with self._condition:
+            if event in ("running", "done", "failed"):
+                self._status = event
+            if event in ("done", "failed"):
+                self._finished = time.time()
+            self._events.append(dict(event=event, time=time.time(), **data))
+            self._condition.notify_all()
+
+    def progress(self, event):
+        self.emit(event_name(event), **event._asdict())
+
+    def events(self, timeout=None):
+        # Yields all events so far and then new ones as they arrive until the
+        # job is finished or no event came within `timeout` seconds.
+        index = 0
+        while True:
+            with self._condition:
+                if not self._condition.wait_for(
+                    lambda: index < len(self._events) or self.finished,
+                    timeout=timeout,
+                ):
+                    return
+                events = self._events[index:]
+                finished = self.finished
+            index += len(events)
+            yield from events
+            if finished and not events:
+                return
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def settings(self):
+        return self._settings
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def finished(self):
+        return self._status in ("done", "failed")
+
+    @property
+    def finished_at(self):
+        return self._finished
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def path_keynote(self):
+        return self._path / "original.key"
+
+    @property
+    def path_repacked(self):
+        return self._path / "slimmed.key"
+
+    @property
+    def result(self):
+        return self._result
+
+    @result.setter
+    def result(self, result):
+        self._result = result
+
+    def to_dict(self):
+        with self._condition:
+            return dict(
+                id=self._id,
+                name=self._name,
+                status=self._status,
+                settings=self._settings,
+                result=self._result,
+                error=next(
+                    (e["error"] for e in self._events if e["event"] == "failed"),
+                    None,
+                ),
+            )
+
+
+class JobQueue(object):
+    # Runs uploaded decks with slim_deck(). The image workers, the result
+    # cache and the JPEG and PNG encoders stay warm between jobs; at most
+    # `max_jobs` decks are processed at the same time and at most
+    # `max_queued` wait for their turn.
+    def __init__(
+        self,
+        resources,
+        path_work=None,
+        jobs=None,
+        max_jobs=2,
+        max_queued=16,
+        result_ttl=RESULT_TTL,
+    ):
+        self._resources = resources
+        self._logger = resources["logger"]
+        self._temporary = path_work is None
+        if path_work is None:
+            path_work = tempfile.mkdtemp(prefix="minimize-ninja-serve-")
+        self._path_work = Path(path_work)
+        self._path_work.mkdir(parents=True, exist_ok=True)
+        self._max_jobs = max_jobs
+        self._max_queued = max_queued
+        self._result_ttl = result_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=jobs if jobs is not None else default_jobs()
+        )
+        self._deck_executor = ThreadPoolExecutor(max_workers=max_jobs)
+
+    def __repr__(self):
+        return f"JobQueue({len(self._jobs)} jobs, {self._path_work})"
+
+    @property
+    def path_work(self):
+        return self._path_work
+
+    def submit(self, stream, length, name, settings):
+        self._expire()
+        with self._lock:
+            pending = sum(not job.finished for job in self._jobs.values())
+            if pending >= self._max_jobs + self._max_queued:
+                raise JobError(
+                    HTTPStatus.SERVICE_UNAVAILABLE, "Too many jobs, try again later."
+                )
+            job = Job(
+                Path(tempfile.mkdtemp(prefix="job-", dir=self._path_work)),
+                name,
+                settings,
+            )
+            self._jobs[job.id] = job
+        try:
+            with open(job.path_keynote, "wb") as file:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise JobError(HTTPStatus.BAD_REQUEST, "Incomplete upload.")
+                    file.write(chunk)
+                    remaining -= len(chunk)
+        except Exception:
+            self.remove(job.id)
+            raise
+        self._logger.info(f"Queued {job} ({length} bytes).")
+        self._deck_executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobError(HTTPStatus.NOT_FOUND, f"Unknown job {job_id}.")
+        return job
+
+    def remove(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            shutil.rmtree(job.path, ignore_errors=True)
+        return job
+
+    def shutdown(self):
+        self._deck_executor.shutdown(wait=True, cancel_futures=True)
+        self._executor.shutdown(wait=True)
+        for job_id in list(self._jobs):
+            self.remove(job_id)
+        if self._temporary:
+            shutil.rmtree(self._path_work, ignore_errors=True)
+
+    def _run(self, job):
+        job.emit("running")
+        kf = KeynoteFile(
+            deck_resources(self._resources),
+            path_keynote=job.path_keynote,
+            streaming=True,
+            path_repacked=job.path_repacked,
+        )
+        try:
+            job.result = slim_deck(
+                kf, self._executor, progress=job.progress, **job.settings
+            )
+        except Exception as exc:
+            self._logger.error(f"{job} failed: {exc}")
+            job.emit("failed", error=str(exc))
+            return
+        finally:
+            job.path_keynote.unlink(missing_ok=True)
+        job.emit("done", **job.result)
+        self._logger.info(
+            f"Finished {job}: {job.result['size_original']} → "
+            f"{job.result['size_optimized']} bytes in {job.result['seconds']:.1f} s."
+        )
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job.id
+                for job in self._jobs.values()
+                if job.finished and now - job.finished_at > self._result_ttl
+            ]
+        for job_id in expired:
+            self.remove(job_id)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # POST   /jobs?quality=…&name=…  upload a deck, returns the job
+    # GET    /jobs/<id>              status and result of a job
+    # GET    /jobs/<id>/events       progress as newline-delimited JSON
+    # GET    /jobs/<id>/result       the slimmed deck
+    # DELETE /jobs/<id>              remove a job and its files
+    # GET    /health                 liveness check
+    server_version = "MinimizeNinja/0.0.2"
+    routes = [
+        ("POST", re.compile(r"^/jobs$"), "create_job"),
+        ("GET", re.compile(r"^/jobs/(\w+)$"), "get_job"),
+        ("GET", re.compile(r"^/jobs/(\w+)/events$"), "get_events"),
+        ("GET", re.compile(r"^/jobs/(\w+)/result$"), "get_result"),
+        ("DELETE", re.compile(r"^/jobs/(\w+)$"), "delete_job"),
+        ("GET", re.compile(r"^/health$"), "get_health"),
+    ]
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(url.path)
+            if match is not None and route_method == method:
+                try:
+                    getattr(self, handler)(*match.groups())
+                except JobError as exc:
+                    self.send_json(dict(error=str(exc)), exc.status)
+                return
+        self.send_json(dict(error="Not found."), HTTPStatus.NOT_FOUND)
+
+    def send_json(self, data, status=HTTPStatus.OK):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def create_job(self):
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit() or int(length) == 0:
+            raise JobError(HTTPStatus.LENGTH_REQUIRED, "Upload the Keynote file.")
+        if int(length) > self.server.max_upload:
+            raise JobError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Upload too large.")
+        settings = job_settings(self.query)
+        name = safe_filename(self.query.get("name", ["upload.key"])[-1])
+        job = self.server.queue.submit(self.rfile, int(length), name, settings)
+        self.send_json(job.to_dict(), HTTPStatus.ACCEPTED)
+
+    def get_job(self, job_id):
+        self.send_json(self.server.queue.get(job_id).to_dict())
+
+    def get_events(self, job_id):
+        job = self.server.queue.get(job_id)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # The stream ends with the job, or after a minute without progress.
+        try:
+            for event in job.events(timeout=60):
+                self.wfile.write(json.dumps(event).encode() + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def get_result(self, job_id):
+        job = self.server.queue.get(job_id)
+        if job.status == "failed":
+            raise JobError(HTTPStatus.CONFLICT, f"Job {job_id} failed.")
+        if job.status != "done":
+            raise JobError(HTTPStatus.CONFLICT, f"Job {job_id} is {job.status}.")
+        stem = Path(job.name).stem
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-iwork-keynote-sffkey")
+        self.send_header("Content-Length", str(job.path_repacked.stat().st_size))
+        self.send_header(
+            "Content-Disposition", f'attachment; filename="{stem}_tiffy.key"'
+        )
+        self.end_headers()
+        with open(job.path_repacked, "rb") as file:
+            shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+
+    def delete_job(self, job_id):
+        job = self.server.queue.get(job_id)
+        if not job.finished:
+            raise JobError(HTTPStatus.CONFLICT, f"Job {job_id} is {job.status}.")
+        self.server.queue.remove(job_id)
+        self.send_json(dict(id=job_id, status="deleted"))
+
+    def get_health(self):
+        self.send_json(dict(status="ok"))
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(f"{self.address_string()} {format % args}")
+
+
+class SlimServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, resources, queue, host="127.0.0.1", port=8737, max_upload=None):
+        super().__init__((host, port), RequestHandler)
+        self.logger = resources["logger"]
+        self.queue = queue
+        self.max_upload = max_upload if max_upload is not None else float("inf")
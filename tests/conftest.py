@@ -0,0 +1,94 @@
+import pytest
+
+from minimize_ninja.common import read_config
+
+
+@pytest.fixture
+def resources():
+    return read_config()
+
+
+@pytest.fixture
+def encode_iwa():
+    # Encodes {archive identifier: object} as a binary IWA archive.
+    from keynote_parser.codec import IWAFile, import_version
+
+    types = {
+        message.DESCRIPTOR.full_name: number
+        for number, message in import_version()[0].items()
+    }
+
+    def encode(objects):
+        archives = [
+            {
+                "header": {
+                    "_pbtype": "TSP.ArchiveInfo",
+                    "identifier": str(identifier),
+                    "messageInfos": [
+                        {
+                            "_pbtype": "TSP.MessageInfo",
+                            "type": types[obj["_pbtype"]],
+                            "version": [1, 0, 5],
+                        }
+                    ],
+                },
+                "objects": [obj],
+            }
+            for identifier, obj in objects.items()
+        ]
+        return IWAFile.from_dict({"chunks": [{"archives": archives}]}).to_buffer()
+
+    return encode
+
+
+@pytest.fixture
+def make_keynote(tmp_path, encode_iwa):
+    # Writes a packed deck with one slide per image, each shown at a third of
+    # its size. `images` maps file names to Wand pseudo images.
+    from zipfile import ZipFile
+
+    Image = pytest.importorskip("wand.image", exc_type=ImportError).Image
+
+    def make(images, size=(600, 400), name="deck.key"):
+        width, height = size
+        datas = []
+        slide = {}
+        for number, filename in enumerate(images):
+            identifier = str(100 + number)
+            datas.append(
+                {
+                    "identifier": identifier,
+                    "digest": "AAAA",
+                    "fileName": filename,
+                    "preferredFileName": filename,
+                }
+            )
+            slide[10 + number] = {
+                "_pbtype": "TSD.ImageArchive",
+                "data": {"identifier": identifier},
+                "originalSize": {"width": width / 3.0, "height": height / 3.0},
+                "super": {},
+            }
+        path = tmp_path / name
+        with ZipFile(path, "w") as zipfile:
+            zipfile.writestr(
+                "Index/Metadata.iwa",
+                encode_iwa(
+                    {
+                        1: {
+                            "_pbtype": "TSP.PackageMetadata",
+                            "lastObjectIdentifier": "99",
+                            "revision": {"identifier": "1"},
+                            "datas": datas,
+                        }
+                    }
+                ),
+            )
+            zipfile.writestr("Index/Slide.iwa", encode_iwa(slide))
+            for filename, pseudo in images.items():
+                with Image(width=width, height=height, pseudo=pseudo) as image:
+                    image.format = filename.rsplit(".", 1)[1]
+                    zipfile.writestr(f"Data/{filename}", image.make_blob())
+        return path
+
+    return make
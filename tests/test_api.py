@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+
+from minimize_ninja import api
+
+
+def test_cancelling_aslim_mid_step_cleans_up(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    cleaned = []
+
+    def slow_slim(*args):
+        try:
+            yield "unpacked"
+            started.set()
+            release.wait(5)
+            yield "images"
+        finally:
+            cleaned.append(threading.current_thread() is not threading.main_thread())
+
+    monkeypatch.setattr(api, "slim", slow_slim)
+
+    async def cancel_during_second_step():
+        loop = asyncio.get_running_loop()
+        events = []
+
+        async def consume():
+            async for event in api.aslim("deck.key"):
+                events.append(event)
+
+        task = asyncio.create_task(consume())
+        await loop.run_in_executor(None, started.wait, 5)
+        task.cancel()
+        # The step still runs when the task is cancelled.
+        loop.call_later(0.1, release.set)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return events
+
+    assert asyncio.run(cancel_during_second_step()) == ["unpacked"]
+    # Closed once the step was done, in a worker thread.
+    assert cleaned == [True]
+
+
+@pytest.fixture
+def deck(make_keynote):
+    return make_keynote({"scan.tiff": "plasma:", "graphic.png": "plasma:"})
+
+
+def test_package_exports_the_api():
+    import minimize_ninja
+
+    assert minimize_ninja.API == api.__all__
+    assert minimize_ninja.slim is api.slim
+
+
+def test_slim(deck, tmp_path):
+    options = api.SlimOptions(no_cache=True, streaming=True, jobs=2)
+    events = list(api.slim(deck, options, path_repacked=tmp_path / "slim.key"))
+    assert [type(event) for event in events[:2]] == [
+        api.StageStarted,
+        api.StageFinished,
+    ]
+    done = [event for event in events if isinstance(event, api.ImageDone)]
+    # The TIFF is converted and renamed on the way.
+    assert len(done) == 2
+    assert "graphic.png" in [event.name for event in done]
+    finished = events[-1]
+    assert isinstance(finished, api.DeckFinished)
+    assert finished.images == 2
+    assert finished.size_optimized == (tmp_path / "slim.key").stat().st_size
+
+
+def test_aslim(deck, tmp_path):
+    options = api.SlimOptions(no_cache=True, streaming=True, jobs=2)
+
+    async def collect():
+        return [
+            event
+            async for event in api.aslim(
+                deck, options, path_repacked=tmp_path / "aslim.key"
+            )
+        ]
+
+    events = asyncio.run(collect())
+    assert sum(isinstance(event, api.ImageDone) for event in events) == 2
+    assert isinstance(events[-1], api.DeckFinished)
+    assert (tmp_path / "aslim.key").exists()
@@ -0,0 +1,18 @@
+import pytest
+
+from minimize_ninja.backends import Backend, BackendError
+
+
+def test_backend_failing_to_import_is_not_available():
+    # Found by find_spec, but the import fails like Wand without ImageMagick.
+    backend = Backend(
+        "broken",
+        "image",
+        module="json.missing",
+        hint="Install it.",
+        verify_import=True,
+    )
+    assert not backend.available
+    with pytest.raises(BackendError, match="Install it.") as exc_info:
+        backend.load()
+    assert "json.missing" in str(exc_info.value)
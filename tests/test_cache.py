@@ -0,0 +1,63 @@
+import os
+
+from minimize_ninja.cache import ResultCache
+
+
+def test_put_and_get(resources, tmp_path):
+    cache = ResultCache(resources, tmp_path)
+    key = ResultCache.make_key(b"source", {"jpeg_compression": 85})
+    assert cache.get(key) is None
+    cache.put(key, b"optimized", {"format": "jpg"})
+    assert cache.get(key) == (b"optimized", {"format": "jpg", "size": 9})
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_keys_depend_on_source_and_settings():
+    key = ResultCache.make_key(b"source", {"a": 1, "b": 2})
+    assert key == ResultCache.make_key(b"source", {"b": 2, "a": 1})
+    assert key != ResultCache.make_key(b"other", {"a": 1, "b": 2})
+    assert key != ResultCache.make_key(b"source", {"a": 1, "b": 3})
+
+
+def test_truncated_entry_is_a_miss(resources, tmp_path):
+    cache = ResultCache(resources, tmp_path)
+    key = ResultCache.make_key(b"source", {})
+    cache.put(key, b"optimized", {})
+    path_blob = next(tmp_path.glob("*/*.bin"))
+    path_blob.write_bytes(b"optim")
+    assert cache.get(key) is None
+
+
+def test_evicts_least_recently_used(resources, tmp_path):
+    cache = ResultCache(resources, tmp_path, max_size=25)
+    keys = [ResultCache.make_key(bytes([number]), {}) for number in range(3)]
+    for age, key in zip([200, 100], keys[:2]):
+        cache.put(key, bytes(10), {})
+        path_blob = next(tmp_path.glob(f"*/{key}.bin"))
+        os.utime(
+            path_blob, (path_blob.stat().st_atime, path_blob.stat().st_mtime - age)
+        )
+    # Reading the oldest entry makes the other one the least recently used.
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], bytes(10), {})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+def test_evicts_only_once_full(resources, tmp_path, monkeypatch):
+    cache = ResultCache(resources, tmp_path, max_size=100)
+    evictions = []
+    monkeypatch.setattr(cache, "evict", lambda: evictions.append(True))
+    for number in range(10):
+        cache.put(ResultCache.make_key(bytes([number]), {}), bytes(10), {})
+    assert evictions == []
+    cache.put(ResultCache.make_key(b"full", {}), bytes(10), {})
+    assert evictions == [True]
+
+
+def test_eviction_leaves_headroom(resources, tmp_path):
+    cache = ResultCache(resources, tmp_path, max_size=100)
+    for number in range(11):
+        cache.put(ResultCache.make_key(bytes([number]), {}), bytes(10), {})
+    assert len(list(tmp_path.glob("*/*.bin"))) == 9
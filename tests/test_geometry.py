@@ -0,0 +1,151 @@
+import copy
+
+import pytest
+
+from minimize_ninja.geometry import ResolutionEngine
+
+
+def placement(x, y, width, height, **fields):
+    return dict(
+        {
+            "_pbtype": "TSD.ImageArchive",
+            "super": {
+                "geometry": {
+                    "position": {"x": x, "y": y},
+                    "size": {"width": width, "height": height},
+                }
+            },
+            "originalSize": {"width": width, "height": height},
+        },
+        **fields,
+    )
+
+
+def group(identifier, children, width, height):
+    return {
+        "_pbtype": "TSD.GroupArchive",
+        "super": {"geometry": {"size": {"width": width, "height": height}}},
+        "children": [{"identifier": child} for child in children],
+    }
+
+
+def child(x, y, width, height, parent):
+    obj = placement(x, y, width, height)
+    obj["super"]["parent"] = {"identifier": parent}
+    return obj
+
+
+def test_footprint_is_scaled_to_the_rendered_slide():
+    # 1080 pixels high for a 2160 points high slide: half the points.
+    engine = ResolutionEngine(slide_size=(3840.0, 2160.0))
+    footprint = engine.image_footprint(placement(100, 100, 800, 600))
+    assert footprint == (400.0, 300.0, None)
+
+
+def test_partially_off_slide_placement():
+    engine = ResolutionEngine(slide_size=(1920.0, 1080.0))
+    footprint = engine.image_footprint(placement(-250, 780, 1000, 600))
+    assert footprint.visible == (0.25, 0.0, 1.0, 0.5)
+
+
+def test_mask_limits_the_visible_part():
+    mask = {
+        "_pbtype": "TSD.MaskArchive",
+        "super": {
+            "geometry": {
+                "position": {"x": 100, "y": 50},
+                "size": {"width": 500, "height": 200},
+            }
+        },
+    }
+    engine = ResolutionEngine(objects={"7": (None, mask)})
+    obj = placement(0, 0, 1000, 400, mask={"identifier": 7})
+    assert engine.image_footprint(obj).visible == (0.1, 0.125, 0.6, 0.625)
+
+
+def test_fully_visible_and_rotated_placements_are_not_cropped():
+    engine = ResolutionEngine()
+    assert engine.image_footprint(placement(10, 10, 500, 500)).visible is None
+    rotated = placement(-250, 0, 1000, 600)
+    rotated["super"]["geometry"]["angle"] = 90.0
+    assert engine.image_footprint(rotated).visible is None
+
+
+def test_enlarging_groups_scale_their_children():
+    objects = {
+        "1": (None, group(1, [2, 3], 400, 200)),
+        "2": (None, child(0, 0, 100, 100, 1)),
+        "3": (None, child(100, 0, 100, 100, 1)),
+    }
+    engine = ResolutionEngine(objects=objects)
+    footprint = engine.image_footprint(objects["2"][1])
+    # Children span 200 x 100 points and are stretched to 400 x 200.
+    assert footprint == (200.0, 200.0, None)
+
+
+def test_shrinking_groups_do_not_reduce_the_footprint():
+    objects = {
+        "1": (None, group(1, [2], 50, 50)),
+        "2": (None, child(0, 0, 100, 100, 1)),
+    }
+    engine = ResolutionEngine(objects=objects)
+    assert engine.image_footprint(objects["2"][1]) == (100.0, 100.0, None)
+
+
+def test_crop_placement_keeps_the_visible_part_in_place():
+    engine = ResolutionEngine()
+    obj = placement(-250, 780, 1000, 600)
+    assert engine.crop_placement(obj, (0.25, 0.0, 1.0, 0.5)) is None
+    geometry = obj["super"]["geometry"]
+    assert geometry["position"] == {"x": 0.0, "y": 780.0}
+    assert geometry["size"] == {"width": 750.0, "height": 300.0}
+    assert obj["originalSize"] == {"width": 750.0, "height": 300.0}
+    # Once cropped, all of it is visible.
+    assert engine.image_footprint(obj).visible is None
+
+
+def test_crop_placement_to_the_whole_image_changes_nothing():
+    engine = ResolutionEngine()
+    obj = placement(100, 200, 640, 480)
+    before = copy.deepcopy(obj)
+    engine.crop_placement(obj, (0.0, 0.0, 1.0, 1.0))
+    assert obj == before
+
+
+@pytest.fixture
+def image_file(resources, tmp_path):
+    keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+    (tmp_path / "photo.jpg").write_bytes(b"\xff\xd8")
+
+    def make(*placements):
+        image = keynote.ImageFile(
+            {
+                "identifier": 1,
+                "fileName": "photo.jpg",
+                "preferredFileName": "photo.jpg",
+            },
+            tmp_path,
+            resources,
+        )
+        engine = ResolutionEngine()
+        for obj in placements:
+            image.add_slide_reference(None, obj, engine)
+        return image
+
+    return make
+
+
+def test_crop_fractions_cover_every_placement(image_file):
+    image = image_file(placement(-500, 0, 1000, 500), placement(-250, 780, 1000, 600))
+    assert image._crop_fractions() == [0.25, 0.0, 1.0, 1.0]
+
+
+def test_small_gains_and_adjusted_images_are_not_cropped(image_file):
+    assert image_file(placement(-50, 0, 1000, 500))._crop_fractions() is None
+    adjusted = placement(-500, 0, 1000, 500, imageAdjustments={})
+    assert image_file(adjusted)._crop_fractions() is None
+    fully_visible = placement(0, 0, 1000, 500)
+    assert (
+        image_file(placement(-500, 0, 1000, 500), fully_visible)._crop_fractions()
+        is None
+    )
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("wand.image", exc_type=ImportError)
+
+from minimize_ninja.geometry import ResolutionEngine  # noqa: E402
+from minimize_ninja.keynote import TiffyIwa  # noqa: E402
+
+
+def geometry(x, y, width, height):
+    return {
+        "position": {"x": x, "y": y},
+        "size": {"width": width, "height": height},
+    }
+
+
+@pytest.fixture
+def grouped_slide(tmp_path, encode_iwa):
+    path = tmp_path / "Slide.iwa"
+    path.write_bytes(
+        encode_iwa(
+            {
+                10: {
+                    "_pbtype": "TSD.ImageArchive",
+                    "data": {"identifier": "100"},
+                    "super": {
+                        "geometry": geometry(0, 0, 500, 250),
+                        "parent": {"identifier": "11"},
+                    },
+                },
+                11: {
+                    "_pbtype": "TSD.GroupArchive",
+                    "super": {"geometry": geometry(0, 0, 1000, 500)},
+                    "children": [{"identifier": "10"}],
+                },
+            }
+        )
+    )
+    return path
+
+
+def archives(iwa):
+    return {
+        archive["header"]["identifier"]: (iwa, archive["objects"][0])
+        for chunk in iwa.yaml["chunks"]
+        for archive in chunk["archives"]
+    }
+
+
+def test_save_keeps_archive_usable(grouped_slide, resources):
+    iwa = TiffyIwa(grouped_slide, resources=resources)
+    iwa.save()
+    image = archives(iwa)["10"][1]
+    assert image["_pbtype"] == "TSD.ImageArchive"
+    engine = ResolutionEngine(objects=archives(iwa))
+    assert engine.image_footprint(image).width == pytest.approx(1000)
+
+    iwa.save()
+    reloaded = TiffyIwa(grouped_slide, resources=resources)
+    assert reloaded.yaml == iwa.yaml
@@ -0,0 +1,63 @@
+import pytest
+
+from minimize_ninja import jpeg
+from minimize_ninja.geometry import ResolutionEngine
+
+
+def test_missing_mozjpeg_falls_back_to_cjpeg(resources, monkeypatch):
+    monkeypatch.setattr(jpeg, "has_backend", lambda kind: kind == "jpeg-command")
+    encoder = jpeg.create_jpeg_encoder(resources, "inprocess")
+    assert isinstance(encoder, jpeg.CjpegEncoder)
+
+
+def test_in_process_encoding(resources):
+    Image = pytest.importorskip("wand.image", exc_type=ImportError).Image
+    pytest.importorskip("mozjpeg_lossless_optimization")
+    # Input cjpeg could not read, encoded without touching the disk.
+    with Image(width=64, height=48, pseudo="plasma:") as image:
+        image.format = "tga"
+        blob = jpeg.InProcessEncoder(resources).encode(image, 80)
+    assert blob[:2] == b"\xff\xd8"
+    with Image(blob=blob) as image:
+        assert image.size == (64, 48)
+
+
+class ShrinkingEncoder(object):
+    # Returns the first `share` of the original JPEG.
+    name = "shrinking"
+
+    def __init__(self, original, share):
+        self.original = original
+        self.share = share
+
+    def encode(self, image, quality, label=None):
+        return self.original[: int(len(self.original) * self.share)]
+
+
+@pytest.mark.parametrize("share, kept", [(0.99, True), (0.9, False)])
+def test_jpegs_are_kept_unless_below_98_percent(resources, tmp_path, share, kept):
+    keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+    from wand.image import Image
+
+    with Image(width=64, height=48, pseudo="plasma:") as photo:
+        photo.format = "jpg"
+        original = photo.make_blob()
+    (tmp_path / "photo.jpg").write_bytes(original)
+    resources["jpeg_encoder"] = ShrinkingEncoder(original, share)
+    image = keynote.ImageFile(
+        {"identifier": 1, "fileName": "photo.jpg", "preferredFileName": "photo.jpg"},
+        tmp_path,
+        resources,
+    )
+    image.add_slide_reference(
+        None,
+        {
+            "_pbtype": "TSD.ImageArchive",
+            "super": {"geometry": {"size": {"width": 64, "height": 48}}},
+        },
+        ResolutionEngine(),
+    )
+    image.optimize()
+    blob = (tmp_path / "photo.jpg").read_bytes()
+    assert (blob == original) is kept
+    assert image.size_optimized == len(blob)
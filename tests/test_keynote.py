@@ -0,0 +1,139 @@
+import pytest
+import yaml
+
+keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+benchmark = pytest.importorskip("minimize_ninja.benchmark", exc_type=ImportError)
+
+
+def test_deduplicate(resources, tmp_path):
+    # Plasma noise is random, gradients are byte-identical: image-1 and
+    # image-3 are the same file.
+    path = benchmark.generate_deck(tmp_path / "deck", 0, 4, 0, 60, 40)
+    kf = keynote.KeynoteFile(resources, path_unpacked=path)
+    duplicates = kf.deduplicate()
+    assert [image.filename.name for image in duplicates] == ["image-3.png"]
+    kf.metadata.save()
+    names = sorted(path.name for path in (path / "Data").iterdir())
+    assert names == ["image-0.png", "image-1.png", "image-2.png"]
+    kf = keynote.KeynoteFile(resources, path_unpacked=path)
+    assert sorted(image.filename.name for image in kf.images_dict.values()) == names
+    # The slide of the merged duplicate shows the surviving file instead.
+    with open(path / "Index" / "Slide-3.iwa.yaml") as file:
+        slide = yaml.safe_load(file)
+    assert slide["chunks"][0]["archives"][0]["objects"][0]["data"] == {
+        "identifier": 1001
+    }
+
+
+def test_prune(resources, tmp_path):
+    # Without its slide nothing refers to image-0 any more.
+    path = benchmark.generate_deck(tmp_path / "deck", 0, 0, 3, 60, 40)
+    (path / "Index" / "Slide-0.iwa.yaml").unlink()
+    kf = keynote.KeynoteFile(resources, path_unpacked=path)
+    pruned = kf.prune()
+    assert [image.filename.name for image in pruned] == ["image-0.jpg"]
+    kf.metadata.save()
+    names = sorted(path.name for path in (path / "Data").iterdir())
+    assert names == ["image-1.jpg", "image-2.jpg"]
+    kf = keynote.KeynoteFile(resources, path_unpacked=path)
+    assert sorted(image.filename.name for image in kf.images_dict.values()) == names
+
+
+def test_prune_keeps_images_mentioned_in_metadata(resources, tmp_path):
+    path = benchmark.generate_deck(tmp_path / "deck", 0, 0, 2, 60, 40)
+    (path / "Index" / "Slide-0.iwa.yaml").unlink()
+    kf = keynote.KeynoteFile(resources, path_unpacked=path)
+    metadata = kf.metadata.yaml["chunks"][0]["archives"][0]["objects"][0]
+    metadata["thumbnail"] = {"identifier": 1000}
+    assert kf.prune() == []
+
+
+def test_yaml_archive_round_trip(tmp_path):
+    path = tmp_path / "Slide.iwa.yaml"
+    content = {"chunks": [{"archives": [{"objects": [{"size": 1.5, "name": "é"}]}]}]}
+    path.write_text(yaml.safe_dump(content))
+    archive = keynote.TiffyYaml(path)
+    archive.yaml["chunks"][0]["archives"][0]["objects"][0]["size"] = 3.0
+    archive.save()
+    assert keynote.TiffyYaml(path).yaml["chunks"][0]["archives"][0]["objects"] == [
+        {"size": 3.0, "name": "é"}
+    ]
+
+
+def test_process_decodes_and_writes_once(resources, tmp_path, monkeypatch):
+    from wand.image import Image
+
+    from minimize_ninja.geometry import ResolutionEngine
+
+    with Image(width=1200, height=800, pseudo="plasma:") as scan:
+        scan.format = "tiff"
+        scan.save(filename=str(tmp_path / "scan.tiff"))
+    image = keynote.ImageFile(
+        {"identifier": 1, "fileName": "scan.tiff", "preferredFileName": "scan.tiff"},
+        tmp_path,
+        resources,
+    )
+    image.add_slide_reference(
+        None,
+        {
+            "_pbtype": "TSD.ImageArchive",
+            "super": {"geometry": {"size": {"width": 300, "height": 200}}},
+        },
+        ResolutionEngine(),
+    )
+    calls = []
+
+    def counted(name):
+        method = getattr(image, name)
+
+        def call(*args):
+            calls.append(name)
+            return method(*args)
+
+        return call
+
+    monkeypatch.setattr(image, "_open_image", counted("_open_image"))
+    monkeypatch.setattr(image, "_write", counted("_write"))
+    image.process(convert=True)
+    assert calls == ["_open_image", "_write"]
+    # Converted and shown at a quarter of its size, twice that is kept.
+    assert [path.name for path in tmp_path.iterdir()] == [image.filename.name]
+    with Image(filename=str(tmp_path / image.filename.name)) as result:
+        assert result.size == (600, 400)
+
+
+@pytest.fixture
+def tiff_image(resources, tmp_path):
+    # An unplaced TIFF of plasma noise, which JPEG compresses far better.
+    from wand.image import Image
+
+    def make(width, height):
+        with Image(width=width, height=height, pseudo="plasma:") as scan:
+            scan.format = "tiff"
+            scan.save(filename=str(tmp_path / "scan.tiff"))
+        return keynote.ImageFile(
+            {
+                "identifier": 1,
+                "fileName": "scan.tiff",
+                "preferredFileName": "scan.tiff",
+            },
+            tmp_path,
+            resources,
+        )
+
+    return make
+
+
+def test_format_prediction_matches_full_encodes(tiff_image):
+    assert tiff_image(1200, 900).check_format_prediction() == ("jpg", "jpg")
+
+
+def test_small_images_are_not_predicted(tiff_image):
+    assert tiff_image(600, 400).check_format_prediction() == (None, "jpg")
+
+
+def test_close_predictions_fall_back_to_full_encodes(tiff_image, monkeypatch):
+    image = tiff_image(1200, 900)
+    # Both formats extrapolate to the same size.
+    monkeypatch.setattr(image, "_sample_tiles", lambda *args, **kwargs: (100, 0.5))
+    assert image.check_format_prediction() == (None, "jpg")
@@ -0,0 +1,59 @@
+import pytest
+
+from minimize_ninja.api import SlimOptions, create_resources, slim
+from minimize_ninja.events import DeckFinished
+from minimize_ninja.manifest import MANIFEST_NAME, Manifest
+
+
+def slim_to(path, path_repacked, **options):
+    options = SlimOptions(no_cache=True, streaming=True, dedup=False, jobs=2, **options)
+    events = list(slim(path, options, create_resources(options), None, path_repacked))
+    return [event for event in events if isinstance(event, DeckFinished)][0]
+
+
+@pytest.mark.parametrize("png_convert", [False, True])
+def test_reslimming_a_slimmed_deck_is_a_no_op(make_keynote, tmp_path, png_convert):
+    path = make_keynote(
+        {
+            "scan.tiff": "plasma:",
+            "chart.tiff": "gradient:white-navy",
+            "photo.png": "plasma:",
+            "graphic.png": "gradient:white-steelblue",
+            "picture.jpg": "plasma:",
+        }
+    )
+    first = slim_to(path, tmp_path / "first.key", png_convert=png_convert)
+    assert first.unchanged == 0
+    second = slim_to(
+        tmp_path / "first.key", tmp_path / "second.key", png_convert=png_convert
+    )
+    assert second.unchanged == second.images == 5
+
+
+def test_manifest_matches_digest_and_settings(tmp_path):
+    manifest = Manifest()
+    manifest.record("image.jpg", "digest", {"suffix": ".jpg", "resize_factor": 2})
+    path = tmp_path / MANIFEST_NAME
+    manifest.save(path)
+    manifest = Manifest.load(path)
+    assert "image.jpg" in manifest
+    # Settings compare as they read back from JSON, in any key order.
+    assert manifest.matches(
+        "image.jpg", "digest", {"resize_factor": 2.0, "suffix": ".jpg"}
+    )
+    assert not manifest.matches(
+        "image.jpg", "other", {"suffix": ".jpg", "resize_factor": 2}
+    )
+    assert not manifest.matches(
+        "image.jpg", "digest", {"suffix": ".png", "resize_factor": 2}
+    )
+    assert not manifest.matches(
+        "other.jpg", "digest", {"suffix": ".jpg", "resize_factor": 2}
+    )
+
+
+def test_manifest_of_another_version_is_empty():
+    assert "image.jpg" not in Manifest.from_buffer(
+        b'{"version": 0, "files": {"image.jpg": {}}}'
+    )
+    assert "image.jpg" not in Manifest.from_buffer(b"not json")
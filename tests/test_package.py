@@ -0,0 +1,74 @@
+import io
+import os
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+
+keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+
+
+class Unseekable(io.RawIOBase):
+    # Makes ZipFile write data descriptors after the member data.
+    def __init__(self, raw):
+        self._raw = raw
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._raw.write(data)
+
+
+def test_raw_copied_members_round_trip(tmp_path):
+    members = {
+        "Index/Document.iwa": (bytes(range(256)) * 40, ZIP_STORED),
+        "Data/image.png": (b"\x89PNG" + bytes(5000), ZIP_DEFLATED),
+    }
+    stream = io.BytesIO()
+    with ZipFile(Unseekable(stream), "w") as zipfile:
+        for name, (data, compression) in members.items():
+            zipfile.writestr(name, data, compress_type=compression)
+    path = tmp_path / "source.key"
+    path.write_bytes(stream.getvalue())
+    with ZipFile(path) as source:
+        assert all(info.flag_bits & 0x08 for info in source.infolist())
+        with ZipFile(tmp_path / "copy.key", "w") as target:
+            for info in source.infolist():
+                keynote.copy_raw_member(source, target, info)
+    with ZipFile(tmp_path / "copy.key") as zipfile:
+        assert zipfile.testzip() is None
+        assert {name: zipfile.read(name) for name in zipfile.namelist()} == {
+            name: data for name, (data, _) in members.items()
+        }
+
+
+def test_write_package_round_trip(tmp_path):
+    files = {"Index/Document.iwa": b"index", "Data/image.png": b"image"}
+    for name, data in files.items():
+        path = tmp_path / "deck" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    keynote.write_package(tmp_path / "deck", tmp_path / "deck.key")
+    with ZipFile(tmp_path / "deck.key") as zipfile:
+        assert zipfile.testzip() is None
+        assert {name: zipfile.read(name) for name in zipfile.namelist()} == files
+
+
+def test_edits_within_the_same_timestamp_are_written(tmp_path):
+    # File systems with coarse timestamps can give an archive rewritten
+    # right after extraction the same modification time.
+    with ZipFile(tmp_path / "deck.key", "w") as zipfile:
+        zipfile.writestr("Index/Metadata.iwa", b"original")
+        zipfile.writestr("Index/Slide.iwa", b"untouched")
+        zipfile.writestr("Data/image.png", b"image")
+    package = keynote.KeynotePackage(tmp_path / "deck.key")
+    package.extract_index(tmp_path / "deck")
+    path = tmp_path / "deck" / "Index" / "Metadata.iwa"
+    mtime = path.stat().st_mtime_ns
+    path.write_bytes(b"modified")
+    os.utime(path, ns=(mtime, mtime))
+    package.write(tmp_path / "deck", tmp_path / "repacked.key")
+    with ZipFile(tmp_path / "repacked.key") as zipfile:
+        assert zipfile.read("Index/Metadata.iwa") == b"modified"
+        assert zipfile.read("Index/Slide.iwa") == b"untouched"
+        assert zipfile.read("Data/image.png") == b"image"
@@ -0,0 +1,79 @@
+import random
+from io import BytesIO
+
+import pytest
+
+from minimize_ninja.geometry import ResolutionEngine
+
+pikepdf = pytest.importorskip("pikepdf")
+
+
+@pytest.fixture
+def lines_pdf():
+    # Random strokes that do not compress any further, and an unused font
+    # the optimizer drops: about 1 % smaller once optimized.
+    rng = random.Random(1)
+    pdf = pikepdf.new()
+    pdf.add_blank_page(page_size=(200, 100))
+    page = pdf.pages[0]
+    page.Contents = pdf.make_stream(
+        b"".join(
+            b"%d %d m %d %d l S\n" % tuple(rng.randrange(200) for _ in range(4))
+            for _ in range(300)
+        )
+    )
+    page.Resources = pikepdf.Dictionary(
+        Font=pikepdf.Dictionary(
+            F1=pikepdf.Dictionary(
+                Type=pikepdf.Name.Font,
+                Subtype=pikepdf.Name.Type1,
+                BaseFont=pikepdf.Name.Helvetica,
+            )
+        )
+    )
+    stream = BytesIO()
+    pdf.save(
+        stream,
+        compress_streams=True,
+        recompress_flate=True,
+        object_stream_mode=pikepdf.ObjectStreamMode.generate,
+    )
+    return stream.getvalue()
+
+
+def test_unused_resources_are_dropped(resources, lines_pdf):
+    from minimize_ninja.pdf import PdfOptimizer
+
+    blob = PdfOptimizer(resources).optimize(lines_pdf, target_sizes=[(400, 200)])
+    assert len(blob) < len(lines_pdf)
+    with pikepdf.open(BytesIO(blob)) as pdf:
+        assert not pdf.pages[0].Resources.Font
+
+
+def test_small_gains_keep_the_original_pdf(resources, lines_pdf, tmp_path):
+    keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+    (tmp_path / "drawing.pdf").write_bytes(lines_pdf)
+    image = keynote.ImageFile(
+        {
+            "identifier": 1,
+            "fileName": "drawing.pdf",
+            "preferredFileName": "drawing.pdf",
+        },
+        tmp_path,
+        resources,
+    )
+    image.add_slide_reference(
+        None,
+        {
+            "_pbtype": "TSD.ImageArchive",
+            "super": {
+                "geometry": {
+                    "position": {"x": 0, "y": 0},
+                    "size": {"width": 200, "height": 100},
+                }
+            },
+        },
+        ResolutionEngine(),
+    )
+    image.optimize()
+    assert (tmp_path / "drawing.pdf").read_bytes() == lines_pdf
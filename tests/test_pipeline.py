@@ -0,0 +1,115 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from minimize_ninja.api import deck_resources
+from minimize_ninja.pipeline import (
+    ANALYSIS_LEVELS,
+    MemoryBudget,
+    analyze_deck,
+    process_image,
+    slim_decks,
+)
+
+
+def test_memory_budget_waits_for_room():
+    budget = MemoryBudget(100)
+    budget.acquire(60)
+    admitted = threading.Event()
+
+    def second():
+        budget.acquire(60)
+        admitted.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not admitted.wait(0.1)
+    budget.release(60)
+    assert admitted.wait(5)
+    thread.join()
+    assert repr(budget) == "MemoryBudget(60/100)"
+
+
+def test_memory_budget_admits_a_huge_image_alone():
+    budget = MemoryBudget(100)
+    budget.acquire(500)
+    assert repr(budget) == "MemoryBudget(500/100)"
+
+
+class FailingImage(object):
+    memory_cost = 80
+    filename = Path("huge.jpg")
+
+    def __init__(self, budget):
+        self.resources = dict(memory_budget=budget)
+
+    def process(self, **settings):
+        raise MemoryError()
+
+
+def test_process_image_releases_its_budget_on_errors():
+    budget = MemoryBudget(100)
+    with pytest.raises(MemoryError):
+        process_image(FailingImage(budget))
+    assert repr(budget) == "MemoryBudget(0/100)"
+
+
+@pytest.fixture
+def decks(resources, tmp_path):
+    # Packed decks of three JPEGs each, plus one that is not a zip file.
+    keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+    benchmark = pytest.importorskip("minimize_ninja.benchmark", exc_type=ImportError)
+    kfs = []
+    for name in ["first", "second"]:
+        path_deck = benchmark.generate_deck(tmp_path / name, 0, 0, 3, 600, 400)
+        keynote.convert_package(path_deck, tmp_path / f"{name}.key")
+        kfs.append(tmp_path / f"{name}.key")
+    (tmp_path / "broken.key").write_bytes(b"not a deck")
+    kfs.insert(1, tmp_path / "broken.key")
+    return [
+        keynote.KeynoteFile(
+            deck_resources(resources),
+            path_keynote=path,
+            streaming=True,
+            path_repacked=tmp_path / "out" / f"{path.stem}_tiffy.key",
+        )
+        for path in kfs
+    ]
+
+
+def test_slim_decks_reports_every_deck(decks, tmp_path):
+    (tmp_path / "out").mkdir()
+    results = slim_decks(decks, jobs=2, max_decks=2, dedup=False)
+    assert [kf for kf, _ in results] == decks
+    first, broken, second = [result for _, result in results]
+    assert "error" in broken
+    for result in [first, second]:
+        assert result["images"] == 3
+        assert result["size_optimized"] < result["size_original"]
+    assert sorted(path.name for path in (tmp_path / "out").iterdir()) == [
+        "first_tiffy.key",
+        "second_tiffy.key",
+    ]
+    assert not any(kf.path_unpacked.exists() for kf in decks)
+
+
+def test_analyze_deck_leaves_the_deck_alone(resources, make_keynote, monkeypatch):
+    from minimize_ninja import keynote
+
+    path = make_keynote({"photo.png": "plasma:", "scan.tiff": "plasma:"})
+    content = path.read_bytes()
+
+    def write(image, blob):
+        raise AssertionError(f"{image} written during analysis")
+
+    monkeypatch.setattr(keynote.ImageFile, "_write", write)
+    kf = keynote.KeynoteFile(resources, path_keynote=path, streaming=True)
+    result = analyze_deck(kf, jobs=2)
+    assert path.read_bytes() == content
+    assert sorted(path.name for path in path.parent.iterdir()) == ["deck.key"]
+    assert not kf.path_unpacked.exists()
+    assert len(result["images"]) == 2
+    for image, estimates in result["images"]:
+        assert sorted(estimates) == sorted(ANALYSIS_LEVELS)
+        assert all(size <= image.size_original for size in estimates.values())
@@ -0,0 +1,122 @@
+import pytest
+
+from minimize_ninja import png
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+
+class FakeOxipng(object):
+    # Takes OXIPNG_LEVEL_COST[level] seconds of the fake clock and removes
+    # `saved` of the bytes on every run.
+    def __init__(self, clock, saved=0.1):
+        self.clock = clock
+        self.saved = saved
+        self.runs = []
+
+    def optimize_from_memory(self, blob, level, fast_evaluation, timeout):
+        self.runs.append((level, fast_evaluation, timeout))
+        self.clock.now += png.OXIPNG_LEVEL_COST[level]
+        return blob[: int(len(blob) * (1.0 - self.saved))]
+
+
+@pytest.fixture
+def oxipng(monkeypatch):
+    clock = FakeClock()
+    backend = FakeOxipng(clock)
+    monkeypatch.setattr(png, "time", clock)
+    monkeypatch.setattr(png, "load_backend", lambda kind: backend)
+    return backend
+
+
+def levels(backend):
+    return [level for level, _, _ in backend.runs]
+
+
+def test_without_budget_only_the_requested_level_runs(resources, oxipng):
+    optimizer = png.PngOptimizer(resources)
+    assert len(optimizer.optimize(bytes(1000), level=4)) == 900
+    assert oxipng.runs == [(4, False, None)]
+
+
+def test_climbs_the_ladder_within_the_budget(resources, oxipng):
+    optimizer = png.PngOptimizer(resources, image_budget=100.0)
+    assert len(optimizer.optimize(bytes(10000), level=6)) < 10000 * 0.9**3
+    assert levels(oxipng) == [1, 2, 4, 6]
+
+
+def test_stops_when_the_next_level_does_not_fit(resources, oxipng):
+    # Level 1 takes 1 s, level 2 is predicted at 2.2 s with 2 s left.
+    optimizer = png.PngOptimizer(resources, image_budget=3.0)
+    optimizer.optimize(bytes(1000), level=6)
+    assert levels(oxipng) == [1]
+
+
+def test_stops_when_a_level_gains_too_little(resources, oxipng):
+    oxipng.saved = 0.001
+    optimizer = png.PngOptimizer(resources, image_budget=100.0, min_gain=0.005)
+    optimizer.optimize(bytes(1000), level=6)
+    assert levels(oxipng) == [1]
+
+
+def test_large_images_use_fast_evaluation(resources, oxipng):
+    optimizer = png.PngOptimizer(resources, image_budget=1.5)
+    optimizer.optimize(bytes(1000), level=6, pixels=png.LARGE_PNG_PIXELS + 1)
+    assert oxipng.runs[0][1] is True
+
+
+def test_deck_budget_is_shared_per_deck(resources, oxipng):
+    optimizer = png.PngOptimizer(resources, deck_budget=10.0)
+    optimizer.optimize(bytes(1000), level=6)
+    assert levels(oxipng) == [1, 2, 4]
+    # Used up: the next image only gets the cheapest level, briefly.
+    oxipng.runs.clear()
+    optimizer.optimize(bytes(1000), level=6)
+    assert oxipng.runs == [(1, False, 1)]
+    # A new deck starts with the full budget, but keeps the statistics.
+    oxipng.runs.clear()
+    deck = optimizer.for_deck()
+    deck.optimize(bytes(1000), level=6)
+    assert levels(oxipng) == [1, 2, 4]
+    assert deck.stats is optimizer.stats
+    assert deck.settings == optimizer.settings
+
+
+def test_stats_add_up_per_level(resources, oxipng):
+    optimizer = png.PngOptimizer(resources, image_budget=4.0)
+    optimizer.optimize(bytes(1000), level=6)
+    optimizer.optimize(bytes(2000), level=6)
+    assert optimizer.stats.levels == {
+        1: dict(runs=2, seconds=2.0, saved=300),
+        2: dict(runs=2, seconds=4.4, saved=270),
+    }
+
+
+class RecordingOptimizer(object):
+    settings = {}
+
+    def __init__(self):
+        self.pixels = []
+
+    def optimize(self, blob, level=6, pixels=None, label=None):
+        self.pixels.append(pixels)
+        return blob
+
+
+def test_resized_pngs_are_optimized_with_their_new_size(resources, tmp_path):
+    keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+    from minimize_ninja.benchmark import generate_deck
+
+    optimizer = resources["png_optimizer"] = RecordingOptimizer()
+    path = generate_deck(tmp_path / "deck", 0, 1, 0, 600, 400)
+    kf = keynote.KeynoteFile(resources, path_unpacked=path)
+    kf.link_references()
+    (image,) = kf.images_dict.values()
+    image.process(max_ratio_factor=2.0)
+    assert image.info.width < 600
+    assert optimizer.pixels == [image.info.width * image.info.height]
@@ -0,0 +1,66 @@
+import io
+import struct
+import zlib
+
+import pytest
+
+keynote = pytest.importorskip("minimize_ninja.keynote", exc_type=ImportError)
+
+
+def png_header(width, height, bit_depth, color_type):
+    ihdr = struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + struct.pack(">I", len(ihdr))
+        + b"IHDR"
+        + ihdr
+        + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    )
+
+
+def jpeg_segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def tiff_header(order, width, height):
+    # ImageWidth as SHORT, ImageLength as LONG, BitsPerSample per channel
+    # stored after the IFD and PhotometricInterpretation RGB.
+    magic = b"II*\x00" if order == "<" else b"MM\x00*"
+    entries = [
+        struct.pack(order + "HHIHH", 256, 3, 1, width, 0),
+        struct.pack(order + "HHII", 257, 4, 1, height),
+        struct.pack(order + "HHII", 258, 3, 3, 8 + 2 + 4 * 12 + 4),
+        struct.pack(order + "HHIHH", 262, 3, 1, 2, 0),
+    ]
+    return (
+        magic
+        + struct.pack(order + "I", 8)
+        + struct.pack(order + "H", len(entries))
+        + b"".join(entries)
+        + struct.pack(order + "I", 0)
+        + struct.pack(order + "HHH", 16, 16, 16)
+    )
+
+
+def test_probe_png():
+    info = keynote.probe_image(io.BytesIO(png_header(640, 480, 8, 6) + b"IDAT"))
+    assert info == keynote.ImageInfo("png", 640, 480, 8, True, "rgb")
+
+
+def test_probe_progressive_jpeg_after_large_exif():
+    # EXIF blocks with thumbnails easily outgrow the first read.
+    exif = jpeg_segment(0xE1, b"Exif\x00\x00" + bytes(65000))
+    sof2 = jpeg_segment(0xC2, struct.pack(">BHHB", 8, 1200, 1600, 3) + bytes(9))
+    data = b"\xff\xd8" + exif + exif + jpeg_segment(0xDB, bytes(65)) + sof2
+    info = keynote.probe_image(io.BytesIO(data))
+    assert info == keynote.ImageInfo("jpg", 1600, 1200, 8, False, "rgb")
+
+
+@pytest.mark.parametrize("order", ["<", ">"])
+def test_probe_tiff(order):
+    info = keynote.probe_image(io.BytesIO(tiff_header(order, 300, 70000)))
+    assert info == keynote.ImageInfo("tiff", 300, 70000, 16, False, "rgb")
+
+
+def test_probe_unknown_format():
+    assert keynote.probe_image(io.BytesIO(b"%PDF-1.7\n" + bytes(32))) is None
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from minimize_ninja import quality
+
+
+@pytest.mark.parametrize("pseudo", ["plasma:", "gradient:white-steelblue"])
+def test_pixel_stats_do_not_depend_on_the_band_size(monkeypatch, pseudo):
+    Image = pytest.importorskip("wand.image", exc_type=ImportError).Image
+    with Image(width=300, height=200, pseudo=pseudo) as image:
+        whole = quality.pixel_stats(image)
+        monkeypatch.setattr(quality, "BAND_PIXELS", 1000)
+        banded = quality.pixel_stats(image)
+    assert banded._replace(colors=None) == whole._replace(colors=None)
+    if whole.colors <= quality.PALETTE_COLORS:
+        assert banded.colors == whole.colors
+    else:
+        assert banded.colors > quality.PALETTE_COLORS
+
+
+def test_ssim_of_identical_arrays_is_one():
+    rng = np.random.default_rng(0)
+    luma = rng.uniform(0, 255, (64, 48)).astype(np.float32)
+    assert quality.ssim(luma, luma.copy()) == pytest.approx(1.0)
+
+
+def test_ssim_drops_with_noise():
+    rng = np.random.default_rng(0)
+    luma = np.tile(np.linspace(0, 255, 64, dtype=np.float32), (64, 1))
+    noisy = np.clip(luma + rng.normal(0, 25, luma.shape), 0, 255)
+    assert quality.ssim(luma, noisy.astype(np.float32)) < 0.98
+    assert quality.ssim(luma, luma[:32]) == 0.0
+
+
+def test_search_finds_the_lowest_quality_meeting_the_target():
+    # A fake encoder whose score grows with the quality by 0.01 per step.
+    encoded = []
+
+    def encode(quality):
+        encoded.append(quality)
+        return quality
+
+    def score(blob):
+        return 0.5 + blob / 200
+
+    assert quality.search_jpeg_quality(encode, score, 0.9, tolerance=0.0) == (80, 80)
+    # Bisection, not a scan through all qualities.
+    assert len(encoded) <= 7
+
+
+def test_search_gives_up_when_even_the_best_quality_misses():
+    assert quality.search_jpeg_quality(lambda q: q, lambda blob: 0.5, 0.9) is None
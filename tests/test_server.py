@@ -0,0 +1,87 @@
+import json
+import threading
+from http.client import HTTPConnection
+from io import BytesIO
+from urllib.parse import quote
+from zipfile import ZipFile
+
+import pytest
+
+server = pytest.importorskip("minimize_ninja.server", exc_type=ImportError)
+
+
+@pytest.fixture
+def slim_server(tmp_path):
+    from minimize_ninja.api import SlimOptions, create_resources
+
+    resources = create_resources(SlimOptions(no_cache=True))
+    queue = server.JobQueue(resources, path_work=tmp_path / "work", jobs=2)
+    httpd = server.SlimServer(resources, queue, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    queue.shutdown()
+
+
+def request(httpd, method, path, body=None):
+    connection = HTTPConnection("127.0.0.1", httpd.server_port, timeout=30)
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_safe_filename():
+    assert server.safe_filename("../talk.key") == "talk.key"
+    assert server.safe_filename('a"\r\nSet-Cookie: x.key') == "a___Set-Cookie_ x.key"
+    assert server.safe_filename("Präsentation.key") == "Pr_sentation.key"
+
+
+def test_upload_follow_download_and_delete(slim_server, make_keynote):
+    deck = make_keynote({"scan.tiff": "plasma:", "graphic.png": "plasma:"})
+    name = quote('talk"\r\nX-Injected: 1.key')
+    response, body = request(
+        slim_server, "POST", f"/jobs?quality=0&name={name}", deck.read_bytes()
+    )
+    assert response.status == 202
+    job = json.loads(body)
+    assert job["status"] in ("queued", "running")
+
+    response, body = request(slim_server, "GET", f"/jobs/{job['id']}/events")
+    assert response.status == 200
+    events = [json.loads(line) for line in body.splitlines()]
+    assert events[0]["event"] == "queued"
+    assert events[-1]["event"] == "done"
+    assert sum(event["event"] == "image_done" for event in events) == 2
+
+    response, body = request(slim_server, "GET", f"/jobs/{job['id']}/result")
+    assert response.status == 200
+    assert response.getheader("X-Injected") is None
+    assert response.getheader("Content-Disposition") == (
+        'attachment; filename="talk___X-Injected_ 1_tiffy.key"'
+    )
+    with ZipFile(BytesIO(body)) as zipfile:
+        assert zipfile.testzip() is None
+
+    response, _ = request(slim_server, "DELETE", f"/jobs/{job['id']}")
+    assert response.status == 200
+    response, _ = request(slim_server, "GET", f"/jobs/{job['id']}")
+    assert response.status == 404
+
+
+def test_unknown_job(slim_server):
+    for method, path in [
+        ("GET", "/jobs/0123abcd"),
+        ("GET", "/jobs/0123abcd/events"),
+        ("GET", "/jobs/0123abcd/result"),
+        ("DELETE", "/jobs/0123abcd"),
+    ]:
+        response, body = request(slim_server, method, path)
+        assert response.status == 404
+        assert "Unknown job" in json.loads(body)["error"]
+
+
+def test_invalid_settings_are_rejected(slim_server):
+    response, body = request(slim_server, "POST", "/jobs?quality=7", b"PK")
+    assert response.status == 400